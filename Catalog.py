@@ -0,0 +1,238 @@
+"""静态游戏数据目录
+
+助理名单、回忆卡、星海轶闻和展台配置在插件初始化时编译为只读记录，并按名称、
+稀有度、展区建立索引，指令中只做字典查找，不再逐条扫描列表。展台的费用和收入
+解析为数值，助理特质和回忆卡效果也一并编译，每个邀约卡池和每个区域的回忆卡池预先建好别名表。
+
+编译结果按数据文件内容的哈希写入缓存文件，文件未变化时启动直接读取缓存。
+数据文件修改后调用 Catalog.sources_changed 即可发现，重新 load_catalog 得到新目录，
+不需要重启机器人。
+"""
+import hashlib
+import json
+import os
+import pickle
+
+from .Economy import GachaPool, IncomeEngine, MemoryCardPool, MemoryCardTable, TraitEngine, parse_amount
+
+# 目录的数据来源：属性名 -> 插件目录下的文件名
+CATALOG_FILES = {
+    'assistants': '[星铁Wolrd]助理名单.json',
+    'memory_cards': '[星铁Wolrd]回忆卡.json',
+    'anecdotes': '[星铁Wolrd]星海轶闻.json',
+}
+# 编译结果的格式版本，修改记录结构或编译逻辑时递增，使旧缓存失效
+CATALOG_FORMAT = 3
+CATALOG_CACHE_FILE = os.path.join('cache', 'catalog.pickle')
+
+
+class FrozenRecord:
+    """只读记录：字段固定为 __slots__，创建后不能修改"""
+
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for field, value in zip(self.__slots__, values):
+            object.__setattr__(self, field, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} 是只读记录")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} 是只读记录")
+
+    def __reduce__(self):
+        return type(self), tuple(getattr(self, field) for field in self.__slots__)
+
+    def __repr__(self):
+        fields = ', '.join(f"{field}={getattr(self, field)!r}" for field in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class AssistantRecord(FrozenRecord):
+    """助理：名称、稀有度（见习/熟练/资深）、羁绊助理、特质文本"""
+
+    __slots__ = ('name', 'rarity', 'bond', 'traits')
+
+
+class MemoryCardRecord(FrozenRecord):
+    """回忆卡：名称、所属区域、稀有度（稀有，其余都按普通）、集齐效果、介绍"""
+
+    __slots__ = ('name', 'area', 'rarity', 'effect', 'description')
+
+
+class BoothRecord(FrozenRecord):
+    """展台：名称、所属展区、解锁费用和每秒基础收入（数值），以及配置中的原始文本"""
+
+    __slots__ = ('name', 'area', 'unlock_cost', 'base_income', 'unlock_cost_text', 'base_income_text')
+
+
+def group_by(records, key):
+    """按 key(记录) 分桶，返回 {键: 记录元组}，桶内保持原顺序"""
+    buckets = {}
+    for record in records:
+        buckets.setdefault(key(record), []).append(record)
+    return {bucket: tuple(items) for bucket, items in buckets.items()}
+
+
+class Catalog:
+    """编译后的静态游戏数据
+
+    星海轶闻的事件会原样保存到玩家数据中（current_event），因此保留为字典，取用时不要修改。
+    """
+
+    def __init__(self, digest, assistants, memory_cards, anecdotes, booths, pool_config=None, problems=()):
+        self.digest = digest
+        self.problems = list(problems)
+        self.sources = {}
+
+        self.assistants = tuple(assistants)
+        self.assistants_by_name = {record.name: record for record in self.assistants}
+        self.assistants_by_rarity = group_by(self.assistants, lambda record: record.rarity)
+
+        self.memory_cards = tuple(memory_cards)
+        self.memory_cards_by_name = {record.name: record for record in self.memory_cards}
+        self.memory_cards_by_area = group_by(self.memory_cards, lambda record: record.area)
+        self.memory_cards_by_area_rarity = group_by(self.memory_cards, lambda record: (record.area, record.rarity))
+        # 回忆卡抽取池：区域 -> MemoryCardPool，抽取一次为O(1)
+        self.memory_card_pools = {
+            area: MemoryCardPool(self.memory_cards_by_area_rarity.get((area, '普通'), ()),
+                                 self.memory_cards_by_area_rarity.get((area, '稀有'), ()))
+            for area in self.memory_cards_by_area
+        }
+
+        self.anecdotes = tuple(anecdotes)
+
+        self.booths = {record.name: record for record in booths}
+        self.booths_by_area = group_by(booths, lambda record: record.area)
+
+        # 邀约卡池：卡池名 -> GachaPool，抽取一次为O(1)
+        self.gacha_pools = {
+            name: GachaPool(config['rates'], self.assistants_by_rarity)
+            for name, config in (pool_config or {}).items()
+        }
+
+        # 收入计算使用的编译结果
+        self.trait_engine = TraitEngine(
+            {'name': record.name, 'traits': record.traits} for record in self.assistants
+        )
+        self.memory_card_table = MemoryCardTable(
+            {'名称': record.name, '集齐效果': record.effect} for record in self.memory_cards
+        )
+        self.income_engine = IncomeEngine(self.booths, self.trait_engine)
+        self.problems += [f"无法识别助理 {name} 的特质: {trait}" for name, trait in self.trait_engine.unknown_traits]
+        self.problems += [f"无法识别回忆卡 {name} 的集齐效果: {effect}"
+                          for name, effect in self.memory_card_table.unknown_effects]
+
+    def sources_changed(self):
+        """数据文件的修改时间或大小是否与加载时不同"""
+        return any(_file_signature(path) != signature for path, signature in self.sources.items())
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _parse_json(content, default, label, problems):
+    if content is None:
+        problems.append(f"{label}文件不存在")
+        return default
+    try:
+        data = json.loads(content.decode('utf-8'))
+    except ValueError as e:
+        problems.append(f"{label}JSON解析错误: {e}")
+        return default
+    return data if isinstance(data, type(default)) else default
+
+
+def compile_catalog(digest, contents, booth_config, pool_config=None):
+    """由数据文件内容编译目录
+
+    :param contents: {属性名: 文件内容(bytes)，文件不存在时为None}
+    :param booth_config: Economy.BOOTHS 格式的展台配置
+    :param pool_config: Economy.ASSISTANT_POOLS 格式的邀约卡池配置
+    """
+    problems = []
+    assistants = [
+        AssistantRecord(data['name'], data.get('level', '见习'), tuple(data.get('bond') or ()),
+                        tuple(data.get('traits') or ()))
+        for data in _parse_json(contents['assistants'], [], '助理名单', problems)
+        if isinstance(data, dict) and data.get('name')
+    ]
+    memory_cards = [
+        MemoryCardRecord(data['名称'], data.get('所属', ''), '稀有' if data.get('稀有度') == '稀有' else '普通',
+                         data.get('集齐效果', ''), data.get('介绍', ''))
+        for data in _parse_json(contents['memory_cards'], [], '回忆卡', problems)
+        if isinstance(data, dict) and data.get('名称')
+    ]
+    anecdotes = _parse_json(contents['anecdotes'], {}, '星海轶闻', problems).get('星海轶闻') or []
+    booths = [
+        BoothRecord(name, config['area'], parse_amount(config['unlock_cost']), parse_amount(config['base_income']),
+                    config['unlock_cost'], config['base_income'])
+        for name, config in booth_config.items()
+    ]
+    return Catalog(digest, assistants, memory_cards, anecdotes, booths, pool_config, problems)
+
+
+def load_catalog(directory, booth_config, pool_config=None, cache_path=None):
+    """读取数据文件并返回目录，内容与缓存一致时直接使用缓存中的编译结果
+
+    :param directory: 数据文件所在目录（插件目录）
+    :param cache_path: 缓存文件路径，默认为 directory 下的 cache/catalog.pickle；传入空字符串不使用缓存
+    """
+    if cache_path is None:
+        cache_path = os.path.join(directory, CATALOG_CACHE_FILE)
+    paths = {key: os.path.join(directory, filename) for key, filename in CATALOG_FILES.items()}
+    # 先取签名再读内容：读取期间文件被修改时，下次检查会再次发现变化
+    sources = {path: _file_signature(path) for path in paths.values()}
+    contents = {}
+    for key, path in paths.items():
+        try:
+            with open(path, 'rb') as f:
+                contents[key] = f.read()
+        except OSError:
+            contents[key] = None
+
+    hasher = hashlib.sha256(f"{CATALOG_FORMAT}\n".encode())
+    hasher.update(json.dumps([booth_config, pool_config], sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    for key in CATALOG_FILES:
+        content = contents[key]
+        hasher.update(b'\0' if content is None else b'\1' + len(content).to_bytes(8, 'big') + content)
+    digest = hasher.hexdigest()
+
+    catalog = _read_cache(cache_path, digest) if cache_path else None
+    if catalog is None:
+        catalog = compile_catalog(digest, contents, booth_config, pool_config)
+        if cache_path:
+            _write_cache(cache_path, catalog)
+    catalog.sources = sources
+    return catalog
+
+
+def _read_cache(cache_path, digest):
+    try:
+        with open(cache_path, 'rb') as f:
+            cached_digest, catalog = pickle.load(f)
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError, AttributeError, ImportError, TypeError):
+        return None
+    return catalog if cached_digest == digest else None
+
+
+def _write_cache(cache_path, catalog):
+    """写入临时文件后替换，多个进程同时写入也不会读到不完整的缓存"""
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+        with open(temp_path, 'wb') as f:
+            pickle.dump((catalog.digest, catalog), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        print(f"写入静态数据缓存失败: {e}")
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
@@ -1,16 +1,41 @@
-import pymysql
+try:
+    import pymysql
+    import pymysql.cursors
+    from pymysql.constants import CLIENT, SERVER_STATUS
+except ImportError:
+    # 使用SQLite或内存存储后端时不需要pymysql
+    pymysql = None
+import bisect
+import hashlib
+import itertools
 import json
+import math
 import threading
+import zlib
 import time
-import queue
+import copy
+import asyncio
+import functools
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 from contextlib import contextmanager
 
+from .Economy import Gold, gold_code
+
 
 class ConnectionPool:
-    """数据库连接池"""
+    """数据库连接池
+
+    - 取连接时不做网络校验，空闲超过 validate_after 秒的连接由后台线程 ping 校验
+    - 新连接在锁外创建，建立TCP和认证的耗时不会阻塞其他线程取还连接
+    - 会话参数通过 init_command 在建立连接时设置一次
+    - 连接使用 autocommit，只读查询不产生事务；归还时只有确实存在未结束的事务才回滚
+    """
     
     def __init__(self, host, port, user, password, database, charset='utf8mb4', 
-                 pool_size=10, max_overflow=20, recycle=3600):
+                 pool_size=10, max_overflow=20, recycle=3600, validate_after=30,
+                 reaper_interval=10, init_command=None, timeout=30):
         self.host = host
         self.port = port
         self.user = user
@@ -20,23 +45,38 @@ class ConnectionPool:
         self.pool_size = pool_size
         self.max_overflow = max_overflow
         self.recycle = recycle
+        self.validate_after = validate_after
+        self.reaper_interval = reaper_interval
+        self.init_command = init_command
+        self.timeout = timeout
         
-        self._pool = queue.Queue(maxsize=pool_size + max_overflow)
+        # 空闲连接 (conn, 最近一次使用或校验的时间)，后进先出，热连接优先复用
+        self._idle = []
+        # 连接创建时间，用于按 recycle 回收
+        self._created_at = {}
         self._created_connections = 0
-        self._lock = threading.RLock()
+        self._closed = False
+        self._lock = threading.Condition(threading.RLock())
         
         # 预创建连接
         self._initialize_pool()
+        
+        self._stop_reaper = threading.Event()
+        self._reaper = threading.Thread(target=self._reap_loop, name='db_pool_reaper', daemon=True)
+        self._reaper.start()
     
     def _initialize_pool(self):
         """初始化连接池"""
         for _ in range(self.pool_size):
+            with self._lock:
+                self._created_connections += 1
             conn = self._create_connection()
             if conn:
-                self._pool.put((conn, time.time()))
+                with self._lock:
+                    self._idle.append((conn, time.time()))
     
     def _create_connection(self):
-        """创建新的数据库连接"""
+        """创建新的数据库连接，调用前需已在计数中占位，失败时释放占位"""
         try:
             conn = pymysql.connect(
                 host=self.host,
@@ -45,15 +85,32 @@ class ConnectionPool:
                 password=self.password,
                 database=self.database,
                 charset=self.charset,
-                autocommit=False
+                autocommit=True,
+                init_command=self.init_command,
+                # 允许一次发送多条语句，玩家数据加载只需一次网络往返
+                client_flag=CLIENT.MULTI_STATEMENTS
             )
             with self._lock:
-                self._created_connections += 1
+                self._created_at[conn] = time.time()
             return conn
         except Exception as e:
             print(f"创建数据库连接失败: {e}")
+            with self._lock:
+                self._created_connections -= 1
+                self._lock.notify()
             return None
     
+    def _discard(self, conn):
+        """关闭连接并释放计数"""
+        try:
+            conn.close()
+        except:
+            pass
+        with self._lock:
+            self._created_at.pop(conn, None)
+            self._created_connections -= 1
+            self._lock.notify()
+    
     def _is_connection_alive(self, conn):
         """检查连接是否存活"""
         try:
@@ -64,113 +121,1565 @@ class ConnectionPool:
     
     def get_connection(self):
         """从连接池获取连接"""
-        try:
-            # 尝试从池中获取连接
-            while True:
-                try:
-                    conn, created_time = self._pool.get_nowait()
-                    
-                    # 检查连接是否过期
-                    if time.time() - created_time > self.recycle:
-                        try:
-                            conn.close()
-                        except:
-                            pass
-                        with self._lock:
-                            self._created_connections -= 1
-                        continue
-                    
-                    # 检查连接是否存活
-                    if self._is_connection_alive(conn):
-                        return conn
-                    else:
-                        try:
-                            conn.close()
-                        except:
-                            pass
-                        with self._lock:
-                            self._created_connections -= 1
+        deadline = time.time() + self.timeout
+        while True:
+            expired = []
+            conn = None
+            create = False
+            with self._lock:
+                while self._idle:
+                    candidate, _ = self._idle.pop()
+                    if time.time() - self._created_at.get(candidate, 0) > self.recycle:
+                        expired.append(candidate)
                         continue
-                        
-                except queue.Empty:
+                    conn = candidate
                     break
+                if conn is None:
+                    if self._created_connections < self.pool_size + self.max_overflow:
+                        # 先占位，连接在锁外创建
+                        self._created_connections += 1
+                        create = True
+                    elif not expired:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            print("获取数据库连接失败: 连接池已耗尽")
+                            raise Exception("无法获取有效的数据库连接")
+                        self._lock.wait(remaining)
             
-            # 池中没有可用连接，创建新连接
-            with self._lock:
-                if self._created_connections < self.pool_size + self.max_overflow:
-                    conn = self._create_connection()
-                    if conn:
-                        return conn
-            
-            # 无法创建新连接，等待其他连接归还
-            conn, _ = self._pool.get(timeout=30)
-            if self._is_connection_alive(conn):
+            for old_conn in expired:
+                self._discard(old_conn)
+            if conn is not None:
                 return conn
-            else:
-                try:
-                    conn.close()
-                except:
-                    pass
-                with self._lock:
-                    self._created_connections -= 1
+            if create:
+                conn = self._create_connection()
+                if conn:
+                    return conn
                 raise Exception("无法获取有效的数据库连接")
-                
-        except Exception as e:
-            print(f"获取数据库连接失败: {e}")
-            raise
     
     def return_connection(self, conn):
         """归还连接到连接池"""
-        if conn and self._is_connection_alive(conn):
+        if not conn:
+            return
+        # open 只检查本地套接字状态，不产生网络往返
+        if self._closed or not conn.open:
+            self._discard(conn)
+            return
+        if conn.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+            # 调用方开启的事务没有结束，回滚后再放回池中
             try:
-                # 重置连接状态
                 conn.rollback()
-                self._pool.put((conn, time.time()), timeout=1)
-            except queue.Full:
-                # 池已满，关闭连接
-                try:
-                    conn.close()
-                except:
-                    pass
-                with self._lock:
-                    self._created_connections -= 1
             except Exception as e:
                 print(f"归还连接失败: {e}")
-                try:
-                    conn.close()
-                except:
-                    pass
-                with self._lock:
-                    self._created_connections -= 1
-        else:
-            # 连接无效，关闭并减少计数
-            try:
-                if conn:
-                    conn.close()
-            except:
-                pass
+                self._discard(conn)
+                return
+        with self._lock:
+            self._idle.append((conn, time.time()))
+            self._lock.notify()
+    
+    def _reap_loop(self):
+        """后台校验空闲连接，关闭失效和超过 recycle 的连接"""
+        while not self._stop_reaper.wait(self.reaper_interval):
+            now = time.time()
             with self._lock:
-                self._created_connections -= 1
+                stale = [item for item in self._idle if now - item[1] > self.validate_after]
+                self._idle = [item for item in self._idle if now - item[1] <= self.validate_after]
+            for conn, _ in stale:
+                if now - self._created_at.get(conn, 0) > self.recycle or not self._is_connection_alive(conn):
+                    self._discard(conn)
+                    continue
+                with self._lock:
+                    # 校验通过的连接放到栈底，优先复用最近用过的连接
+                    self._idle.insert(0, (conn, time.time()))
+                    self._lock.notify()
+    
+    def status(self):
+        """连接池状态"""
+        with self._lock:
+            return {
+                'pool_size': self.pool_size,
+                'max_overflow': self.max_overflow,
+                'created_connections': self._created_connections,
+                'available_connections': len(self._idle)
+            }
     
     def close_all(self):
         """关闭所有连接"""
-        while True:
+        self._stop_reaper.set()
+        with self._lock:
+            self._closed = True
+            idle = self._idle
+            self._idle = []
+        for conn, _ in idle:
+            self._discard(conn)
+
+
+class PlayerVersionConflict(Exception):
+    """保存玩家数据时版本号不匹配，说明数据在读取后已被其他操作修改"""
+
+    def __init__(self, user_id):
+        super().__init__(f"玩家 {user_id} 的数据已被其他操作修改")
+        self.user_id = user_id
+
+
+# players 表中由玩家数据决定的列（user_id/group_id 只在插入时写入）
+PLAYER_COLUMNS = (
+    'player_id', 'name', 'gold', 'diamond', 'city_level', 'total_income',
+    'tutorial_step', 'ticket_normal', 'ticket_gold', 'ticket_rainbow',
+    'last_checkin_date', 'consecutive_checkins', 'memory_tickets',
+    'current_event', 'event_expire_time'
+)
+
+# 子表结构：表名 -> (主键列, 数据列)，每张子表都有 (user_id, 主键列) 唯一索引
+CHILD_TABLES = {
+    'player_booths': ('booth_name', ('unlocked', 'assistant_name', 'assistant_level', 'assistant_star', 'last_collect')),
+    'player_assistants': ('assistant_name', ('level', 'star')),
+    'player_fragments': ('assistant_name', ('count',)),
+    'player_memory_parts': ('card_part_key', ('count',)),
+    'player_memory_cards': ('card_name', ('count',)),
+}
+
+
+def build_player_rows(player_data):
+    """将玩家数据转换为各表的行数据，用于变更比较和写入
+
+    :return: {'players': {列名: 值}, 子表名: {主键: (数据列值...)}}
+    """
+    tickets = player_data.get('tickets', {'普通': 1, '黄金': 0, '炫彩': 0})
+    last_checkin_date = player_data.get('last_checkin_date')
+    current_event = player_data.get('current_event')
+    rows = {
+        'players': {
+            'player_id': player_data.get('player_id'),
+            'name': player_data.get('name', '未知玩家'),
+            # 金额保存为 Gold 的定长整数编码
+            'gold': gold_code(player_data.get('gold', 0)),
+            'diamond': player_data.get('diamond', 0),
+            'city_level': player_data.get('city_level', 1),
+            'total_income': gold_code(player_data.get('total_income', 0)),
+            'tutorial_step': player_data.get('tutorial_step', 1),
+            'ticket_normal': tickets.get('普通', 1),
+            'ticket_gold': tickets.get('黄金', 0),
+            'ticket_rainbow': tickets.get('炫彩', 0),
+            # 数据库读出的是date对象，签到逻辑写入的是字符串，统一成ISO格式便于比较
+            'last_checkin_date': str(last_checkin_date) if last_checkin_date else None,
+            'consecutive_checkins': player_data.get('consecutive_checkins', 0),
+            'memory_tickets': player_data.get('memory_tickets', 0),
+            'current_event': json.dumps(current_event) if current_event else None,
+            'event_expire_time': player_data.get('event_expire_time', 0)
+        }
+    }
+
+    booths = {}
+    for booth_name, booth_data in player_data.get('booths', {}).items():
+        assistant = booth_data.get('assistant')
+        unlocked_value = booth_data.get('unlocked', False)
+        unlocked = 1 if (unlocked_value and unlocked_value not in ('', None, 'false', '0')) else 0
+        booths[booth_name] = (
+            unlocked,
+            assistant['name'] if assistant else None,
+            assistant.get('level', 1) if assistant else 1,
+            assistant.get('star', 1) if assistant else 1,
+            booth_data.get('last_collect', 0)
+        )
+    rows['player_booths'] = booths
+
+    rows['player_assistants'] = {
+        assistant.get('name', '未知助理'): (assistant.get('level', 1), assistant.get('star', 1))
+        for assistant in player_data.get('assistants', [])
+    }
+    # 数量为0的记录视为不存在，保存时删除
+    for table, field in (('player_fragments', 'fragments'),
+                         ('player_memory_parts', 'memory_parts'),
+                         ('player_memory_cards', 'memory_cards')):
+        rows[table] = {key: (count,) for key, count in player_data.get(field, {}).items() if count > 0}
+    return rows
+
+
+class PlayerRecord(dict):
+    """带变更追踪的玩家数据
+
+    用法与普通字典完全一致，额外记录上次读取/保存时的持久化快照。
+    保存时与快照比较，得出需要更新的列、需要写入和删除的子表记录。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.snapshot = None
+        # players.version，保存时用于比较并交换
+        self.version = None
+        # 写回缓存中的版本号：从缓存读取的副本带有该值，写入缓存时与缓存中的数据比较并交换
+        self.cache_version = None
+        # 读取时的存储布局：tables（各子表）或 document（players.document）
+        self.layout = 'tables'
+        # 由玩家数据推导出的计算结果（如回忆卡加成），只在进程内缓存，不写入数据库；
+        # 修改对应的玩家数据时由修改方清除
+        self.derived = {}
+
+    def mark_persisted(self, rows=None):
+        """记录当前数据已与数据库一致"""
+        self.snapshot = rows if rows is not None else build_player_rows(self)
+
+    def changes(self, rows=None):
+        """计算自上次持久化以来的变更
+
+        :return: (players表变更列, {子表名: 需要写入的记录}, {子表名: 需要删除的主键})，
+                 没有快照时返回None，表示需要完整写入
+        """
+        if self.snapshot is None:
+            return None
+        rows = rows if rows is not None else build_player_rows(self)
+        old_player = self.snapshot['players']
+        player_changes = {col: value for col, value in rows['players'].items() if old_player.get(col) != value}
+        upserts = {}
+        deletes = {}
+        for table in CHILD_TABLES:
+            old, new = self.snapshot[table], rows[table]
+            changed = {key: value for key, value in new.items() if old.get(key) != value}
+            removed = [key for key in old if key not in new]
+            if changed:
+                upserts[table] = changed
+            if removed:
+                deletes[table] = removed
+        return player_changes, upserts, deletes
+
+
+def apply_player_changes(rows, changes):
+    """把 PlayerRecord.changes 得到的变更应用到另一份行数据上，返回新的行数据"""
+    player_changes, upserts, deletes = changes
+    merged = {'players': dict(rows['players'], **player_changes)}
+    for table in CHILD_TABLES:
+        records = dict(rows[table])
+        records.update(upserts.get(table, {}))
+        for key in deletes.get(table, ()):
+            records.pop(key, None)
+        merged[table] = records
+    return merged
+
+
+def parse_player_results(results):
+    """将玩家主表行和各子表结果集组装为 PlayerRecord
+
+    :param results: [players行列表, 展台行, 助理行, 碎片行, 回忆碎片行, 回忆卡行]，
+                    players 行的列顺序为 PLAYER_COLUMNS + version，子表行的列顺序
+                    为 CHILD_TABLES 中的主键列 + 数据列
+    """
+    player_rows, booth_rows, assistant_rows, fragment_rows, part_rows, card_rows = results
+    if not player_rows:
+        return None
+    player = player_rows[0]
+    playerData = PlayerRecord({
+        'name': player[1],
+        'player_id': int(player[0]),
+        'gold': Gold.decode(player[2]),
+        'diamond': int(player[3]),
+        'city_level': int(player[4]),
+        'total_income': Gold.decode(player[5]),
+        'tutorial_step': int(player[6]),
+        'tickets': {
+            '普通': int(player[7]),
+            '黄金': int(player[8]),
+            '炫彩': int(player[9])
+        },
+        # 签到逻辑按ISO日期字符串比较，这里不返回date对象
+        'last_checkin_date': str(player[10]) if player[10] else None,
+        'consecutive_checkins': int(player[11]),
+        'memory_tickets': int(player[12]),
+        'current_event': json.loads(player[13]) if player[13] else None,
+        'event_expire_time': int(player[14])
+    })
+    playerData.version = int(player[15])
+    booths = {}
+    for row in booth_rows:
+        assistant = None
+        if row[2]:
+            assistant = {
+                'name': row[2],
+                'level': int(row[3]),
+                'star': int(row[4])
+            }
+        booths[row[0]] = {
+            'unlocked': bool(row[1]),
+            'assistant': assistant,
+            'last_collect': int(row[5])
+        }
+    playerData['booths'] = booths
+    playerData['assistants'] = [
+        {'name': row[0], 'level': int(row[1]), 'star': int(row[2])}
+        for row in assistant_rows
+    ]
+    playerData['fragments'] = {row[0]: int(row[1]) for row in fragment_rows}
+    playerData['memory_parts'] = {row[0]: int(row[1]) for row in part_rows}
+    playerData['memory_cards'] = {row[0]: int(row[1]) for row in card_rows}
+    playerData['memory_effects'] = []
+    playerData.mark_persisted()
+    return playerData
+
+
+# 文档存储模式下仍保留为独立列的字段：重名检查、排行和好友列表会直接查询这些列
+DOCUMENT_COLUMNS = ('player_id', 'name', 'city_level', 'total_income')
+
+
+def parse_player_rows(rows, version):
+    """由 build_player_rows 格式的行数据还原 PlayerRecord"""
+    player_row = [rows['players'][col] for col in PLAYER_COLUMNS] + [version]
+    return parse_player_results(
+        [[player_row]] + [[(key, *value) for key, value in rows[table].items()] for table in CHILD_TABLES]
+    )
+
+
+def encode_player_document(rows):
+    """将玩家的行数据压缩为 players.document 中保存的二进制文档"""
+    return zlib.compress(json.dumps(rows, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+def decode_player_document(document, version):
+    """解压 players.document 并还原 PlayerRecord"""
+    rows = json.loads(zlib.decompress(document).decode('utf-8'))
+    player_data = parse_player_rows(rows, version)
+    player_data.layout = 'document'
+    return player_data
+
+
+def group_child_rows(rows):
+    """将带 user_id 前缀的子表行按玩家分组：[(user_id, ...)] -> {user_id: [(...)]}"""
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row[0], []).append(row[1:])
+    return grouped
+
+
+def assemble_players(player_rows, child_groups):
+    """批量组装玩家数据，用于全量导出
+
+    :param player_rows: [(user_id, PLAYER_COLUMNS..., version)]
+    :param child_groups: 与 CHILD_TABLES 顺序一致的 group_child_rows 结果列表
+    :return: [(user_id, PlayerRecord)]
+    """
+    return [
+        (row[0], parse_player_results([[row[1:]]] + [group.get(row[0], []) for group in child_groups]))
+        for row in player_rows
+    ]
+
+
+def chunked(items, size):
+    """按固定大小切分列表"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class PlayerSessionCache:
+    """热点玩家数据的写回缓存
+
+    按 user_id 缓存最近活跃玩家的数据，容量有限，按最近使用顺序淘汰。
+    指令修改后的数据只写入缓存并标记为脏，由后台线程按固定间隔合并写库，
+    同一玩家在一个间隔内的多次修改只产生一次保存。被淘汰的脏数据和关闭时
+    的剩余数据也会写回数据库。
+
+    缓存中的对象不直接交给调用方：读取返回副本，写入保存副本，
+    指令中途失败返回时未保存的修改不会污染缓存。
+
+    写库时数据库中的数据已被缓存以外的写入修改过（版本冲突），重新读取数据库，
+    把缓存中尚未落库的修改合并到最新数据上后再写，不丢弃玩家的进度。
+
+    指令之间的并发修改在写入缓存时检测：每份缓存数据带有进程内唯一的 cache_version，
+    读取的副本带着它，写入时与缓存中的当前值不一致（期间已有其他指令写入或缓存已被
+    替换）即抛出 PlayerVersionConflict，由调用方重新加载后再执行指令。
+    """
+
+    def __init__(self, save_func, load_func=None, max_size=1000, flush_interval=5.0):
+        self._save = save_func
+        # 版本冲突时重新读取数据库中的玩家数据
+        self._load = load_func
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self._entries = OrderedDict()
+        self._dirty = set()
+        # 被淘汰但尚未写库的数据，写库前仍可被读取
+        self._evicted = {}
+        # 每个玩家最近一次落库的 (快照, 版本号, 存储布局)，写库时以此计算变更并比较版本号
+        self._persisted = {}
+        self._cache_versions = itertools.count(1)
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._flush_thread = threading.Thread(target=self._flush_loop, name='player_cache_flusher', daemon=True)
+        self._flush_thread.start()
+
+    def get(self, user_id):
+        """读取缓存的玩家数据副本，未命中返回None"""
+        with self._lock:
+            player_data = self._entries.get(user_id)
+            if player_data is not None:
+                self._entries.move_to_end(user_id)
+            else:
+                player_data = self._evicted.get(user_id)
+            return copy.deepcopy(player_data) if player_data is not None else None
+
+    def add(self, user_id, player_data):
+        """放入刚从数据库读取的玩家数据并返回交给调用方的副本
+
+        已有缓存时保留缓存中的数据（可能含有尚未落库的修改），返回缓存数据的副本。
+        """
+        with self._lock:
+            if self._current(user_id) is None:
+                self._store(user_id, player_data)
+                self._persisted[user_id] = (player_data.snapshot, player_data.version, player_data.layout)
+            return self.get(user_id)
+
+    def put(self, user_id, player_data, dirty=False):
+        """写入缓存，dirty为True时等待后台写库
+
+        dirty为True时先比较版本：player_data 读取自缓存但缓存中的数据已被其他指令更新或
+        已被替换时抛出 PlayerVersionConflict。dirty为False表示数据刚写入数据库，直接替换缓存。
+        """
+        with self._lock:
+            if dirty:
+                self._check_version(user_id, player_data)
+            else:
+                self._persisted[user_id] = (player_data.snapshot, player_data.version, player_data.layout)
+            self._store(user_id, player_data)
+            if dirty:
+                self._dirty.add(user_id)
+            while len(self._entries) > self.max_size:
+                old_user_id, old_data = self._entries.popitem(last=False)
+                if old_user_id in self._dirty:
+                    self._dirty.discard(old_user_id)
+                    self._evicted[old_user_id] = old_data
+                else:
+                    self._persisted.pop(old_user_id, None)
+            if self._evicted:
+                self._wakeup.set()
+
+    def _current(self, user_id):
+        """缓存中该玩家的当前数据（含已淘汰但尚未写库的），没有时返回None"""
+        player_data = self._entries.get(user_id)
+        return player_data if player_data is not None else self._evicted.get(user_id)
+
+    def _check_version(self, user_id, player_data):
+        current = self._current(user_id)
+        if current is None:
+            if player_data.cache_version is not None:
+                # 读取后缓存数据已写库并被淘汰，副本可能已过期
+                raise PlayerVersionConflict(user_id)
+            # 不是从缓存读取的数据，写库时按其自身的版本号与数据库比较
+            self._persisted[user_id] = (player_data.snapshot, player_data.version, player_data.layout)
+        elif player_data.cache_version != current.cache_version:
+            raise PlayerVersionConflict(user_id)
+
+    def _store(self, user_id, player_data):
+        """保存副本并分配新的 cache_version，调用方的对象同步为新版本，可以继续修改后再次写入"""
+        entry = copy.deepcopy(player_data)
+        entry.cache_version = player_data.cache_version = next(self._cache_versions)
+        self._entries[user_id] = entry
+        self._entries.move_to_end(user_id)
+        self._evicted.pop(user_id, None)
+
+    def invalidate(self, user_id):
+        """丢弃缓存（不写库）"""
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._evicted.pop(user_id, None)
+            self._persisted.pop(user_id, None)
+            self._dirty.discard(user_id)
+
+    def flush_all(self):
+        """立即写回所有脏数据"""
+        # 同一玩家的写库必须串行，否则版本号会互相冲突
+        with self._flush_lock:
+            with self._lock:
+                # 已淘汰的数据写库成功后才移除，写库期间仍可被读取
+                pending = dict(self._evicted)
+                for user_id in self._dirty:
+                    pending[user_id] = self._entries[user_id]
+                self._dirty.clear()
+            for user_id, player_data in pending.items():
+                self._flush_entry(user_id, player_data)
+
+    def write_through(self, user_id, player_data):
+        """立即写库，数据写入数据库后才返回True，成功后缓存中的数据与数据库一致
+
+        与后台写库串行执行。用于改名等需要确认数据已落库才能继续的操作。
+        """
+        with self._flush_lock:
+            with self._lock:
+                self._check_version(user_id, player_data)
+                record = self._flush_record(user_id, player_data)
             try:
-                conn, _ = self._pool.get_nowait()
-                try:
-                    conn.close()
-                except:
-                    pass
-            except queue.Empty:
-                break
-        
+                saved = self._save(user_id, record)
+            except PlayerVersionConflict:
+                self._rebase(user_id, record)
+                raise
+            if saved:
+                with self._lock:
+                    self._persisted[user_id] = (record.snapshot, record.version, record.layout)
+                    self._store(user_id, record)
+                    player_data.cache_version = record.cache_version
+                    self._dirty.discard(user_id)
+            return saved
+
+    def _flush_record(self, user_id, player_data):
+        """写库用的记录：数据取自缓存，快照、版本号和布局取最近一次落库的状态，不修改缓存中的对象"""
+        record = PlayerRecord(player_data)
+        record.snapshot, record.version, record.layout = self._persisted.get(
+            user_id, (player_data.snapshot, player_data.version, player_data.layout)
+        )
+        return record
+
+    def _flush_entry(self, user_id, player_data):
+        with self._lock:
+            record = self._flush_record(user_id, player_data)
+        try:
+            saved = self._save(user_id, record)
+        except PlayerVersionConflict:
+            self._rebase(user_id, record)
+            return
+        if saved:
+            with self._lock:
+                if self._evicted.get(user_id) is player_data:
+                    del self._evicted[user_id]
+                if user_id in self._entries or user_id in self._evicted:
+                    self._persisted[user_id] = (record.snapshot, record.version, record.layout)
+                else:
+                    self._persisted.pop(user_id, None)
+            return
+        # 写库失败，重新标记为脏等待下一轮
+        with self._lock:
+            if self._entries.get(user_id) is player_data:
+                self._dirty.add(user_id)
+            elif user_id not in self._entries and user_id not in self._evicted:
+                self._evicted[user_id] = player_data
+        print(f"用户 {user_id} 的缓存数据写回失败，稍后重试")
+
+    def _rebase(self, user_id, record):
+        """数据库中的数据被缓存以外的写入修改过：把缓存中尚未落库的修改合并到数据库的最新数据上
+
+        合并后的数据仍标记为脏，由下一轮写库写入；双方修改了同一列或同一条子表记录时以缓存为准。
+        读取数据库失败时保留原数据，下一轮再次尝试。
+        """
+        current = self._load(user_id) if self._load else None
         with self._lock:
-            self._created_connections = 0
+            in_entries = user_id in self._entries
+            latest = self._current(user_id) or record
+            # 以上次落库的状态为基础计算缓存中的修改
+            changes = self._flush_record(user_id, latest).changes()
+            if current is None:
+                print(f"用户 {user_id} 的缓存数据与数据库版本冲突，重新读取数据库失败，稍后重试")
+                merged = latest
+            elif changes is None:
+                # 没有落库快照的新玩家数据与数据库中已有的玩家冲突，无法合并，以数据库为准
+                self.invalidate(user_id)
+                print(f"用户 {user_id} 已存在，缓存中的新玩家数据未写入")
+                return
+            else:
+                # 应用到数据库的最新数据上
+                merged = parse_player_rows(apply_player_changes(current.snapshot, changes), current.version)
+                merged.snapshot, merged.layout = current.snapshot, current.layout
+                # 合并后的数据使用新的 cache_version，基于合并前数据的副本写入缓存时会冲突
+                merged.cache_version = next(self._cache_versions)
+                self._persisted[user_id] = (current.snapshot, current.version, current.layout)
+                print(f"用户 {user_id} 的数据在缓存以外被修改，已将缓存中未写入的修改合并到数据库的最新数据")
+            if in_entries:
+                self._entries[user_id] = merged
+                self._dirty.add(user_id)
+            else:
+                self._evicted[user_id] = merged
+                self._wakeup.set()
+
+    def _flush_loop(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush_all()
+            except Exception as e:
+                print(f"玩家缓存写回异常: {e}")
+
+    def close(self):
+        """停止后台线程并写回剩余数据"""
+        self._stopped.set()
+        self._wakeup.set()
+        self._flush_thread.join(timeout=self.flush_interval + 1)
+        self.flush_all()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'cached_players': len(self._entries),
+                'dirty_players': len(self._dirty),
+                'evicted_pending': len(self._evicted)
+            }
+
+
+class IdBlockAllocator:
+    """按块预留的自增ID分配器
+
+    每次从数据库原子地预留一段连续ID（默认100个），之后在内存中依次分配，
+    用完再预留下一段。进程重启时未分配完的ID会被跳过，ID可能不连续。
+    """
+
+    def __init__(self, reserve_block, block_size=100):
+        # reserve_block(size) 返回预留到的第一个ID
+        self._reserve_block = reserve_block
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        with self._lock:
+            if self._next >= self._end:
+                start = self._reserve_block(self.block_size)
+                self._next, self._end = start, start + self.block_size
+            value = self._next
+            self._next += 1
+            return value
+
+
+class RankingIndex:
+    """进程内的世界排行榜前N名索引
+
+    首次读取时从 world_ranking 表加载前N名，之后每次更新排行数据时在内存中
+    增量调整，读取排行榜不再查询数据库。条目按 (-总收入, user_id) 保存在有序
+    列表中，N 只有一两百，bisect 插入删除的开销可以忽略。
+
+    总收入只增不减，因此索引外的玩家只能通过一次更新进入前N名，索引始终准确；
+    若某个条目的总收入下降（如人工修改数据）且索引外可能还有玩家，则丢弃索引，
+    下次读取时重新加载。
+    """
+
+    def __init__(self, capacity=100, display_size=20):
+        self.capacity = capacity
+        self.display_size = display_size
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._order = []
+        self._loaded = False
+        # 索引是否包含了全部玩家（加载到的行数少于容量且从未淘汰过条目）
+        self._complete = False
+        # 前 display_size 名变化时递增，用于判断排行榜文本缓存是否失效
+        self.revision = 0
+        self._rendered = None
+        self._rendered_revision = None
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def load(self, rows):
+        """用数据库中的前N名初始化索引
+
+        :param rows: [(user_id, name, gold, total_income)]，金额为数据库中的编码值
+        """
+        with self._lock:
+            self._entries = {}
+            self._order = []
+            for user_id, name, gold, total_income in rows[:self.capacity]:
+                self._entries[user_id] = (name, Gold.decode(gold), Gold.decode(total_income))
+                self._order.append((-int(total_income), user_id))
+            self._order.sort()
+            self._complete = len(rows) < self.capacity
+            self._loaded = True
+            self.revision += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
+
+    def update(self, user_id, name, gold, total_income):
+        """排行数据写入数据库后调用，增量调整索引"""
+        gold, total_income = Gold.coerce(gold), Gold.coerce(total_income)
+        with self._lock:
+            if not self._loaded:
+                return
+            new_key = (-total_income.encode(), user_id)
+            old = self._entries.get(user_id)
+            old_position = None
+            if old is not None:
+                if total_income < old[2] and not self._complete:
+                    # 条目下降后，索引外的玩家可能排到它前面
+                    self._loaded = False
+                    return
+                old_position = bisect.bisect_left(self._order, (-old[2].encode(), user_id))
+                del self._order[old_position]
+            elif len(self._order) >= self.capacity and new_key > self._order[-1]:
+                # 仍在前N名之外
+                return
+            bisect.insort(self._order, new_key)
+            self._entries[user_id] = (name, gold, total_income)
+            new_position = bisect.bisect_left(self._order, new_key)
+            while len(self._order) > self.capacity:
+                _, evicted = self._order.pop()
+                del self._entries[evicted]
+                self._complete = False
+            if (old_position is not None and old_position < self.display_size) or new_position < self.display_size:
+                # 排行榜只显示名称和总收入，仅金币变化时不必重新渲染
+                if old is None or (old[0], old[2]) != (name, total_income) or old_position != new_position:
+                    self.revision += 1
+
+    def top(self, limit=None):
+        """按总收入降序返回 [{'name', 'gold', 'total_income'}]"""
+        with self._lock:
+            keys = self._order[:limit] if limit else list(self._order)
+            return [
+                {'name': name, 'gold': gold, 'total_income': total_income}
+                for name, gold, total_income in (self._entries[user_id] for _, user_id in keys)
+            ]
+
+    def render(self, renderer):
+        """返回排行榜文本，前 display_size 名没有变化时直接使用上次的结果
+
+        :param renderer: 接收前 display_size 名列表、返回文本的函数
+        """
+        with self._lock:
+            if self._rendered_revision == self.revision:
+                return self._rendered
+            revision = self.revision
+        text = renderer(self.top(self.display_size))
+        with self._lock:
+            self._rendered, self._rendered_revision = text, revision
+        return text
+
+
+class RankingWriteBuffer:
+    """世界排行数据的合并写缓冲
+
+    排行数据只在查看排行榜时读取，不需要每次收取后立即落库。缓冲区按玩家
+    只保留最新的 (名称, 金币, 总收入)，由后台线程按固定间隔或在积压条数
+    达到阈值时用一条多行语句批量写入。
+    """
+
+    def __init__(self, write_batch, flush_interval=2.0, max_pending=200):
+        # write_batch([(user_id, name, gold, total_income)]) 成功返回True
+        self._write_batch = write_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._flush_thread = threading.Thread(target=self._flush_loop, name='ranking_writer', daemon=True)
+        self._flush_thread.start()
+
+    def put(self, user_id, name, gold, total_income):
+        with self._lock:
+            self._pending[user_id] = (name, gold, total_income)
+            if len(self._pending) >= self.max_pending:
+                self._wakeup.set()
+
+    def flush(self):
+        """立即写入所有积压的排行数据"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, OrderedDict()
+            if not pending:
+                return True
+            entries = [(user_id, *values) for user_id, values in pending.items()]
+            if self._write_batch(entries):
+                return True
+            # 写入失败，放回缓冲区等待下一轮，期间又有更新的玩家以新数据为准
+            with self._lock:
+                for user_id, values in pending.items():
+                    self._pending.setdefault(user_id, values)
+            return False
+
+    def _flush_loop(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"排行数据写入异常: {e}")
+
+    def close(self):
+        """停止后台线程并写入剩余数据"""
+        self._stopped.set()
+        self._wakeup.set()
+        self._flush_thread.join(timeout=self.flush_interval + 1)
+        self.flush()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+
+class FriendGraph:
+    """好友关系和好友资料的进程内缓存
+
+    好友关系按玩家缓存邻接表 {好友user_id: 成为好友的时间}，同意或删除好友时
+    使双方的邻接表失效。好友资料 (player_id, 名称, 展会等级, 总收入) 单独缓存，
+    玩家保存时同步更新，缺失或过期的资料按 user_id 一次批量加载。
+    查看好友和好友排行只涉及该玩家的好友，开销与好友数成正比，与玩家总数无关。
+    """
+
+    def __init__(self, load_friends, load_profiles, max_users=5000, profile_ttl=300):
+        # load_friends(user_id) -> [(friend_user_id, since)]
+        # load_profiles(user_ids) -> [(user_id, player_id, name, city_level, total_income)]
+        self._load_friends = load_friends
+        self._load_profiles = load_profiles
+        self.max_users = max_users
+        self.profile_ttl = profile_ttl
+        self._friends = OrderedDict()
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def friends(self, user_id):
+        """返回 {好友user_id: 成为好友的时间}"""
+        with self._lock:
+            friends = self._friends.get(user_id)
+            if friends is not None:
+                self._friends.move_to_end(user_id)
+                return friends
+        friends = dict(self._load_friends(user_id))
+        with self._lock:
+            self._friends[user_id] = friends
+            while len(self._friends) > self.max_users:
+                self._friends.popitem(last=False)
+        return friends
+
+    def invalidate(self, *user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._friends.pop(user_id, None)
+
+    def profiles(self, user_ids):
+        """返回 {user_id: {'player_id', 'name', 'city_level', 'total_income'}}"""
+        now = time.monotonic()
+        result = {}
+        missing = []
+        with self._lock:
+            for user_id in user_ids:
+                cached = self._profiles.get(user_id)
+                if cached is not None and cached[0] > now:
+                    result[user_id] = cached[1]
+                else:
+                    missing.append(user_id)
+        if missing:
+            rows = self._load_profiles(missing)
+            with self._lock:
+                for user_id, player_id, name, city_level, total_income in rows:
+                    profile = {'player_id': int(player_id), 'name': name, 'city_level': int(city_level),
+                               'total_income': Gold.decode(total_income)}
+                    self._store_profile(user_id, profile, now)
+                    result[user_id] = profile
+        return result
+
+    def update_profile(self, user_id, player_data):
+        """玩家保存时更新已缓存的资料，未缓存的玩家不处理"""
+        with self._lock:
+            if user_id in self._profiles:
+                self._store_profile(user_id, {
+                    'player_id': player_data.get('player_id'),
+                    'name': player_data.get('name'),
+                    'city_level': player_data.get('city_level', 1),
+                    'total_income': Gold.coerce(player_data.get('total_income', 0)),
+                }, time.monotonic())
+
+    def _store_profile(self, user_id, profile, now):
+        self._profiles[user_id] = (now + self.profile_ttl, profile)
+        self._profiles.move_to_end(user_id)
+        while len(self._profiles) > self.max_users * 4:
+            self._profiles.popitem(last=False)
+
+
+def normalize_name(name):
+    """名称唯一性比较使用的规范形式：NFKC 归一化（全角转半角等）、去首尾空白、忽略大小写"""
+    return unicodedata.normalize('NFKC', name).strip().casefold()
+
+
+def report_name_collisions(players, owners):
+    """列出名称表迁移时因规范化后重名而未能登记的玩家，逐个写入迁移日志
+
+    players 为按 players.id 排序的 (user_id, name)，owners 为名称表中 name_key 到 user_id 的映射。
+    返回 (user_id, name, 登记该名称的 user_id) 列表。
+    """
+    collisions = []
+    for user_id, name in players:
+        owner = owners.get(normalize_name(name))
+        if owner != user_id:
+            collisions.append((user_id, name, owner))
+    if collisions:
+        print(f"有 {len(collisions)} 个玩家的名称与其他玩家重复，未登记到名称表，需要使用“改名”指令换一个名称：")
+        for user_id, name, owner in collisions:
+            print(f"  玩家 {user_id} 的名称「{name}」已由玩家 {owner} 登记")
+    return collisions
+
+
+class NameBloomFilter:
+    """已使用名称的布隆过滤器
+
+    判定不存在的名称一定未被本进程见过的任何玩家使用，重名检查可以不访问数据库；
+    判定可能存在时再按名称索引查询。名称无法从过滤器中删除，改名释放的旧名称
+    仍判定为可能存在，下次重建时清除。加入的名称超过容量后误判率上升，
+    由调用方按 needs_rebuild 从数据库重新加载。
+    """
+
+    def __init__(self, capacity=10000, error_rate=0.01):
+        self.capacity = max(int(capacity), 1)
+        # 位数 m = -n·ln(p) / (ln2)²，哈希函数个数 k = m/n·ln2
+        bits = int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)) + 1
+        self.bit_count = (bits + 7) // 8 * 8
+        self.hash_count = max(1, round(self.bit_count / self.capacity * math.log(2)))
+        self._bits = bytearray(self.bit_count // 8)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _positions(self, key):
+        # 双重哈希：一次 blake2b 摘要拆成两个64位哈希，生成 k 个位置
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bit_count for i in range(self.hash_count)]
+
+    def add(self, key):
+        positions = self._positions(key)
+        with self._lock:
+            for pos in positions:
+                self._bits[pos >> 3] |= 1 << (pos & 7)
+            self.count += 1
+
+    def __contains__(self, key):
+        bits = self._bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    @property
+    def needs_rebuild(self):
+        return self.count > self.capacity
+
+    @classmethod
+    def build(cls, keys, expected, error_rate=0.01):
+        """按预计的名称数建立过滤器，预留一倍余量给之后新注册的名称"""
+        bloom = cls(max(expected * 2, 10000), error_rate)
+        for key in keys:
+            bloom.add(key)
+        return bloom
+
+
+class StorageBackend:
+    """玩家数据存储后端接口
+
+    MySQL（IdleTycoonDatabase）、SQLite、内存三种实现共用这里的写回缓存、
+    玩家ID分配和保存重试逻辑，子类只需实现具体的读写方法。
+    """
+
+    # 玩家ID每次从存储中预留的数量
+    PLAYER_ID_BLOCK_SIZE = 100
+
+    # 玩家数据写回缓存配置，可由构造参数 session_cache 按实例覆盖
+    SESSION_CACHE_ENABLED = True
+    SESSION_CACHE_SIZE = 1000
+    SESSION_FLUSH_INTERVAL = 5.0
+    # 配置文件中 session_cache 段的键名 -> 属性名和类型
+    SESSION_CACHE_KEYS = {
+        'enabled': ('SESSION_CACHE_ENABLED', bool),
+        'max_size': ('SESSION_CACHE_SIZE', int),
+        'flush_interval': ('SESSION_FLUSH_INTERVAL', float),
+    }
+
+    # 世界排行榜索引保留的名次数和排行榜显示的名次数
+    RANKING_INDEX_SIZE = 100
+    RANKING_DISPLAY_SIZE = 20
+    # 排行数据批量写入的间隔秒数和触发立即写入的积压条数
+    RANKING_FLUSH_INTERVAL = 2.0
+    RANKING_FLUSH_SIZE = 200
+
+    # 名称布隆过滤器的目标误判率；预留后未确认的名称超过该秒数可被他人重新预留
+    NAME_FILTER_ERROR_RATE = 0.01
+    NAME_RESERVATION_TTL = 300
+
+    session_cache = None
+    player_id_allocator = None
+    ranking_index = None
+    ranking_buffer = None
+    friend_graph = None
+    name_filter = None
+    _name_filter_lock = None
+
+    def _init_services(self, session_cache=None):
+        """创建玩家ID分配器和写回缓存，子类初始化完存储连接后调用
+
+        :param session_cache: 写回缓存配置 {'enabled', 'max_size', 'flush_interval'}，
+                              只设置在本实例上，不影响同一后端类的其他实例
+        """
+        for key, (attr, convert) in self.SESSION_CACHE_KEYS.items():
+            if session_cache and key in session_cache:
+                setattr(self, attr, convert(session_cache[key]))
+        if self.player_id_allocator is None:
+            self.player_id_allocator = IdBlockAllocator(self._reserve_player_id_block, self.PLAYER_ID_BLOCK_SIZE)
+        if self.SESSION_CACHE_ENABLED and self.session_cache is None:
+            self.session_cache = PlayerSessionCache(
+                self.save_player_with_retry,
+                self.load_player,
+                max_size=self.SESSION_CACHE_SIZE,
+                flush_interval=self.SESSION_FLUSH_INTERVAL
+            )
+        elif not self.SESSION_CACHE_ENABLED:
+            self.session_cache = None
+        if self.ranking_index is None:
+            self.ranking_index = RankingIndex(self.RANKING_INDEX_SIZE, self.RANKING_DISPLAY_SIZE)
+        if self.ranking_buffer is None:
+            self.ranking_buffer = RankingWriteBuffer(
+                self._write_world_ranking_batch,
+                flush_interval=self.RANKING_FLUSH_INTERVAL,
+                max_pending=self.RANKING_FLUSH_SIZE
+            )
+        if self.friend_graph is None:
+            self.friend_graph = FriendGraph(self._query_friend_ids, self._query_profiles)
+        if self._name_filter_lock is None:
+            self._name_filter_lock = threading.Lock()
+
+    # ---- 子类实现 ----
+
+    def load_player(self, user_id, read_only=False):
+        """加载玩家数据，返回 PlayerRecord，不存在时返回None
+
+        :param read_only: 调用方只读取不保存，支持只读副本的后端可以从副本读取
+        """
+        raise NotImplementedError
+
+    def save_player(self, user_id, player_data):
+        """保存玩家数据，成功返回True；版本冲突时抛出 PlayerVersionConflict"""
+        raise NotImplementedError
+
+    def _query_world_ranking(self, limit):
+        """按总收入降序查询排行榜前limit名 [(user_id, name, gold, total_income)]，金额为编码值"""
+        raise NotImplementedError
+
+    def _write_world_ranking_batch(self, entries):
+        """批量写入排行数据 [(user_id, name, gold, total_income)]，金额为编码值，成功返回True"""
+        raise NotImplementedError
+
+    def _name_key_exists(self, name_key):
+        """名称表中是否存在该规范名称（已使用或预留中）"""
+        raise NotImplementedError
+
+    def _count_names(self):
+        raise NotImplementedError
+
+    def _iter_name_keys(self):
+        """流式读取名称表中的全部规范名称"""
+        raise NotImplementedError
+
+    def _reserve_name_key(self, user_id, name_key, now):
+        """原子地为玩家预留规范名称，已被他人使用或预留时返回False"""
+        raise NotImplementedError
+
+    def _commit_name_key(self, user_id, name_key, old_key):
+        """将玩家预留的名称标记为已使用，并释放其旧名称"""
+        raise NotImplementedError
+
+    def _release_name_key(self, user_id, name_key):
+        """释放玩家预留但未使用的名称"""
+        raise NotImplementedError
+
+    def get_player_id_by_user_id(self, user_id):
+        raise NotImplementedError
+
+    def add_friend(self, user_id, friend_player_id):
+        """发送好友请求，返回 {'success': bool, 'message': str}"""
+        raise NotImplementedError
+
+    def get_friends(self, user_id):
+        """返回好友列表 [(player_id, name, city_level, total_income, friend_since)]"""
+        raise NotImplementedError
+
+    def get_friend_requests(self, user_id):
+        """返回待处理的好友请求 [(player_id, name, city_level, total_income, request_time)]"""
+        raise NotImplementedError
+
+    def _reserve_player_id_block(self, size):
+        """原子地预留一段玩家ID，返回第一个ID"""
+        raise NotImplementedError
+
+    def accept_friend(self, user_id, requester_player_id):
+        """同意好友请求，双方互为好友，返回 {'success': bool, 'message': str}"""
+        raise NotImplementedError
+
+    def remove_friend(self, user_id, friend_player_id):
+        """删除好友（双向），返回 {'success': bool, 'message': str}"""
+        raise NotImplementedError
+
+    def _query_friend_ids(self, user_id):
+        """查询已同意的好友 [(friend_user_id, 成为好友的时间)]"""
+        raise NotImplementedError
+
+    def _query_profiles(self, user_ids):
+        """按 user_id 批量查询 [(user_id, player_id, name, city_level, total_income)]，总收入为编码值"""
+        raise NotImplementedError
+
+    def iter_players(self, batch_size=500):
+        """流式读取全部玩家，逐个返回 (user_id, PlayerRecord)，内存中最多保留一批玩家"""
+        raise NotImplementedError
+
+    def import_player_batch(self, records):
+        """批量写入一批完整玩家数据（覆盖已有数据），返回写入的玩家数
+
+        :param records: [(user_id, 玩家数据字典)]，缺少 player_id 的玩家会分配新ID
+        """
+        raise NotImplementedError
+
+    # ---- 通用逻辑 ----
+
+    def get_next_player_id(self):
+        """分配新的玩家ID，大部分情况下直接从内存中预留的ID段取值"""
+        return self.player_id_allocator.next_id()
+
+    def save_player_with_retry(self, user_id, player_data, max_retries=3):
+        """带重试机制的保存方法
+
+        失败多为连接中断等瞬时错误，立即重试即可；版本冲突不在这里重试，
+        直接抛出 PlayerVersionConflict，由调用方重新加载数据后再执行指令。
+        """
+        for attempt in range(max_retries):
+            if self.save_player(user_id, player_data):
+                return True
+            if attempt < max_retries - 1:
+                print(f"保存失败，重试 (第{attempt + 1}次)")
+                    
+        print(f"用户 {user_id} 数据保存失败，已尝试 {max_retries} 次")
+        return False
+
+    def save_player_async_queue(self, user_id, player_data):
+        """将保存任务加入写回缓存，由后台线程合并写库
+
+        只有从数据库加载过的玩家（带持久化快照）才走写回缓存；新玩家需要
+        立即落库，否则后续的重名检查和玩家ID分配看不到这条记录。
+        :return: 是否已成功加入队列或写入
+        """
+        if self.session_cache is None or not isinstance(player_data, PlayerRecord) or player_data.snapshot is None:
+            result = self.save_player_with_retry(user_id, player_data)
+            if result and self.session_cache is not None and isinstance(player_data, PlayerRecord):
+                self.session_cache.put(user_id, player_data)
+        else:
+            # 读取后已有其他指令写入时抛出 PlayerVersionConflict
+            self.session_cache.put(user_id, player_data, dirty=True)
+            result = True
+        if result:
+            self.friend_graph.update_profile(user_id, player_data)
+        return result
+
+    def save_player_now(self, user_id, player_data):
+        """立即保存玩家数据，写入数据库后才返回True，不经过写回缓存的延迟写库
+
+        用于改名等需要在数据落库后再确认其他状态（如名称表）的操作；
+        版本冲突时抛出 PlayerVersionConflict。
+        """
+        if self.session_cache is None or not isinstance(player_data, PlayerRecord):
+            result = self.save_player_with_retry(user_id, player_data)
+        else:
+            result = self.session_cache.write_through(user_id, player_data)
+        if result:
+            self.friend_graph.update_profile(user_id, player_data)
+        return result
+
+    def load_player_cached(self, user_id, read_only=False):
+        """优先从写回缓存读取玩家数据，未命中时加载并放入缓存
+
+        只读加载可能来自有延迟的副本，不放入缓存，避免之后的保存基于过期数据。
+        """
+        if self.session_cache is not None:
+            player_data = self.session_cache.get(user_id)
+            if player_data is not None:
+                return player_data
+        player_data = self.load_player(user_id, read_only)
+        if player_data is not None and self.session_cache is not None and not read_only:
+            # 同时加载的另一条指令可能已先放入缓存并修改，以缓存中的数据为准
+            return self.session_cache.add(user_id, player_data)
+        return player_data
+
+    def load_world_ranking(self, limit=50):
+        """按总收入降序返回排行榜 [{'name', 'gold', 'total_income'}]，优先从内存索引读取"""
+        if limit <= self.ranking_index.capacity:
+            self.warm_ranking_index()
+            return self.ranking_index.top(limit)
+        return [
+            {'name': name, 'gold': Gold.decode(gold), 'total_income': Gold.decode(total_income)}
+            for _, name, gold, total_income in self._query_world_ranking(limit)
+        ]
+
+    def warm_ranking_index(self):
+        """排行榜索引未加载时从数据库加载前N名"""
+        if not self.ranking_index.loaded:
+            # 先写入缓冲中的数据，否则加载到的是过期的名次
+            self.ranking_buffer.flush()
+            self.ranking_index.load(self._query_world_ranking(self.ranking_index.capacity))
+        return self.ranking_index
+
+    def update_world_ranking(self, user_id, name, gold, total_income):
+        """更新世界排行榜数据
+
+        立即调整内存索引，排行榜马上可见；写库由缓冲区合并后批量执行。
+        """
+        self.ranking_index.update(user_id, name, gold, total_income)
+        self.ranking_buffer.put(user_id, name, gold_code(gold), gold_code(total_income))
+        return True
+
+    def list_friends(self, user_id):
+        """返回好友资料列表，按总收入降序，数据来自好友缓存
+
+        :return: [{'player_id', 'name', 'city_level', 'total_income', 'since'}]
+        """
+        friends = self.friend_graph.friends(user_id)
+        profiles = self.friend_graph.profiles(list(friends))
+        result = [dict(profiles[friend], since=since) for friend, since in friends.items() if friend in profiles]
+        result.sort(key=lambda profile: profile['total_income'], reverse=True)
+        return result
+
+    def friend_leaderboard(self, user_id, limit=20):
+        """自己和好友按总收入排名，返回 (排行列表, 自己的名次)"""
+        friends = self.friend_graph.friends(user_id)
+        profiles = self.friend_graph.profiles([user_id] + list(friends))
+        ranking = sorted(profiles.items(), key=lambda item: item[1]['total_income'], reverse=True)
+        my_rank = next((i for i, (uid, _) in enumerate(ranking, 1) if uid == user_id), None)
+        return [profile for _, profile in ranking[:limit]], my_rank
+
+    def warm_name_filter(self):
+        """返回名称布隆过滤器，首次使用或注册的名称超过容量时从名称表重建"""
+        bloom = self.name_filter
+        if bloom is not None and not bloom.needs_rebuild:
+            return bloom
+        with self._name_filter_lock:
+            if self.name_filter is None or self.name_filter.needs_rebuild:
+                self.name_filter = NameBloomFilter.build(self._iter_name_keys(), self._count_names(),
+                                                         self.NAME_FILTER_ERROR_RATE)
+            return self.name_filter
+
+    def _remember_name_key(self, name_key):
+        if self.name_filter is not None:
+            self.name_filter.add(name_key)
+
+    def check_name_exists(self, name):
+        """检查名称是否已被使用或预留
+
+        布隆过滤器判定不存在时直接返回False，不访问数据库。其他进程注册的名称
+        不在本进程的过滤器中，因此结果只用于提前提示，名称归属以 reserve_name 为准。
+        """
+        name_key = normalize_name(name)
+        if name_key not in self.warm_name_filter():
+            return False
+        return self._name_key_exists(name_key)
+
+    def reserve_name(self, user_id, name):
+        """预留名称，成功后再保存玩家数据，保存成功调用 commit_name，失败调用 release_name
+
+        名称表以规范名称为主键，并发预留同一名称时只有一方成功；玩家自己已持有的名称可以重复预留。
+        """
+        name_key = normalize_name(name)
+        if not self._reserve_name_key(user_id, name_key, int(time.time())):
+            return False
+        self._remember_name_key(name_key)
+        return True
+
+    def commit_name(self, user_id, name, old_name=None):
+        """确认玩家已使用预留的名称，改名时同时释放旧名称"""
+        name_key = normalize_name(name)
+        old_key = normalize_name(old_name) if old_name else None
+        self._commit_name_key(user_id, name_key, old_key if old_key != name_key else None)
+
+    def release_name(self, user_id, name):
+        self._release_name_key(user_id, normalize_name(name))
+
+    def render_world_ranking(self, renderer):
+        """返回排行榜文本，前几名不变时复用上次渲染的结果"""
+        return self.warm_ranking_index().render(renderer)
+
+    def close(self):
+        """写回缓存数据并释放存储资源"""
+        if self.session_cache is not None:
+            self.session_cache.close()
+            self.session_cache = None
+        if self.ranking_buffer is not None:
+            self.ranking_buffer.close()
+            self.ranking_buffer = None
+
+
+# ---- MySQL 表结构迁移 ----
+#
+# 每个迁移步骤为 (版本号, 说明, [SQL语句或接收游标的函数])，按版本号顺序执行一次，
+# 执行完成后写入 schema_migrations。各步骤都可重复执行：旧版本插件用
+# CREATE TABLE IF NOT EXISTS 建好的库没有迁移记录，会从第1步开始补齐。
+
+MYSQL_INITIAL_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS players (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id VARCHAR(128) NOT NULL UNIQUE,
+        player_id INT NOT NULL UNIQUE,
+        group_id VARCHAR(64) DEFAULT NULL,
+        name VARCHAR(100) NOT NULL,
+        gold DECIMAL(30,2) DEFAULT 0,
+        diamond INT DEFAULT 0,
+        city_level INT DEFAULT 1,
+        total_income DECIMAL(30,2) DEFAULT 0,
+        tutorial_step INT DEFAULT 1,
+        ticket_normal INT DEFAULT 1,
+        ticket_gold INT DEFAULT 0,
+        ticket_rainbow INT DEFAULT 0,
+        last_checkin_date DATE DEFAULT NULL,
+        consecutive_checkins INT DEFAULT 0,
+        memory_tickets INT DEFAULT 0,
+        current_event JSON DEFAULT NULL,
+        event_expire_time INT DEFAULT 0,
+        version INT NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        INDEX idx_group_id (group_id),
+        INDEX idx_total_income (total_income)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS player_booths (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id VARCHAR(128) NOT NULL,
+        booth_name VARCHAR(50) NOT NULL,
+        unlocked BOOLEAN DEFAULT FALSE,
+        assistant_name VARCHAR(100) DEFAULT NULL,
+        assistant_level INT DEFAULT 1,
+        assistant_star INT DEFAULT 1,
+        last_collect INT DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        UNIQUE KEY unique_user_booth (user_id, booth_name),
+        FOREIGN KEY (user_id) REFERENCES players(user_id) ON DELETE CASCADE
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS player_assistants (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id VARCHAR(128) NOT NULL,
+        assistant_name VARCHAR(100) NOT NULL,
+        level INT DEFAULT 1,
+        star INT DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        UNIQUE KEY unique_user_assistant (user_id, assistant_name),
+        FOREIGN KEY (user_id) REFERENCES players(user_id) ON DELETE CASCADE
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS player_fragments (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id VARCHAR(128) NOT NULL,
+        assistant_name VARCHAR(100) NOT NULL,
+        count INT DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        UNIQUE KEY unique_user_fragment (user_id, assistant_name),
+        FOREIGN KEY (user_id) REFERENCES players(user_id) ON DELETE CASCADE
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS player_memory_parts (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id VARCHAR(128) NOT NULL,
+        card_part_key VARCHAR(150) NOT NULL,
+        count INT DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        UNIQUE KEY unique_user_memory_part (user_id, card_part_key),
+        FOREIGN KEY (user_id) REFERENCES players(user_id) ON DELETE CASCADE
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS player_memory_cards (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id VARCHAR(128) NOT NULL,
+        card_name VARCHAR(100) NOT NULL,
+        count INT DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        UNIQUE KEY unique_user_memory_card (user_id, card_name),
+        FOREIGN KEY (user_id) REFERENCES players(user_id) ON DELETE CASCADE
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS world_ranking (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id VARCHAR(128) NOT NULL UNIQUE,
+        name VARCHAR(100) NOT NULL,
+        gold DECIMAL(30,2) DEFAULT 0,
+        total_income DECIMAL(30,2) DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        INDEX idx_total_income (total_income DESC),
+        FOREIGN KEY (user_id) REFERENCES players(user_id) ON DELETE CASCADE
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS player_friends (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id VARCHAR(128) NOT NULL,
+        friend_user_id VARCHAR(128) NOT NULL,
+        friend_player_id INT NOT NULL,
+        status ENUM('pending', 'accepted', 'blocked') DEFAULT 'pending',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        UNIQUE KEY unique_friendship (user_id, friend_user_id),
+        INDEX idx_friend_player_id (friend_player_id),
+        FOREIGN KEY (user_id) REFERENCES players(user_id) ON DELETE CASCADE,
+        FOREIGN KEY (friend_user_id) REFERENCES players(user_id) ON DELETE CASCADE
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    ''',
+]
+
+
+def _mysql_column_exists(cur, table, column):
+    cur.execute('''SELECT COUNT(*) FROM information_schema.COLUMNS
+                   WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s''', (table, column))
+    return cur.fetchone()[0] > 0
+
+
+def _mysql_index_exists(cur, table, index):
+    cur.execute('''SELECT COUNT(*) FROM information_schema.STATISTICS
+                   WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s''', (table, index))
+    return cur.fetchone()[0] > 0
+
+
+def _mysql_add_version_column(cur):
+    """players.version：并发修改检测使用的版本号，旧版本创建的表没有该列"""
+    if not _mysql_column_exists(cur, 'players', 'version'):
+        cur.execute("ALTER TABLE players ADD COLUMN version INT NOT NULL DEFAULT 0 AFTER event_expire_time")
+
+
+def _mysql_add_document_column(cur):
+    """players.document：文档存储模式下压缩保存的完整玩家数据"""
+    if not _mysql_column_exists(cur, 'players', 'document'):
+        cur.execute("ALTER TABLE players ADD COLUMN document MEDIUMBLOB DEFAULT NULL AFTER version")
 
 
-class IdleTycoonDatabase:
+# 与唯一索引重复的二级索引：各表的 user_id 已是唯一索引或唯一联合索引的最左列
+MYSQL_REDUNDANT_INDEXES = [
+    ('players', 'idx_user_id'),
+    ('players', 'idx_player_id'),
+    ('player_booths', 'idx_user_id'),
+    ('player_assistants', 'idx_user_id'),
+    ('player_fragments', 'idx_user_id'),
+    ('player_memory_parts', 'idx_user_id'),
+    ('player_memory_cards', 'idx_user_id'),
+    ('player_friends', 'idx_user_id'),
+    # 区分度很低，查询改用下面的 (friend_user_id, status) 联合索引
+    ('player_friends', 'idx_status'),
+]
+
+# 查询需要但缺少的索引：(表名, 索引名, 列)
+# players.name 不建索引，重名检查查询名称表 player_names
+MYSQL_MISSING_INDEXES = [
+    # 好友请求列表按 friend_user_id + status 查询
+    ('player_friends', 'idx_friend_status', 'friend_user_id, status'),
+]
+
+
+def _mysql_fix_indexes(cur):
+    # 先建新索引再删旧索引，外键列在任何时刻都有可用的索引
+    for table, index, columns in MYSQL_MISSING_INDEXES:
+        if not _mysql_index_exists(cur, table, index):
+            cur.execute(f"ALTER TABLE {table} ADD INDEX {index} ({columns})")
+    for table, index in MYSQL_REDUNDANT_INDEXES:
+        if _mysql_index_exists(cur, table, index):
+            cur.execute(f"ALTER TABLE {table} DROP INDEX {index}")
+
+
+def _mysql_create_player_names(cur):
+    """player_names：以规范名称为主键的名称表，保证名称唯一并支持先预留后确认
+
+    规范化在Python中完成（normalize_name），列使用二进制排序规则，避免数据库的
+    排序规则再做一次不同的大小写/宽度折叠。已有玩家的名称按 players.id 顺序登记，
+    规范化后重名的玩家只有最早的一个登记成功。
+    """
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS player_names (
+            name_key VARCHAR(100) NOT NULL PRIMARY KEY,
+            user_id VARCHAR(128) NOT NULL,
+            status ENUM('reserved', 'taken') NOT NULL DEFAULT 'reserved',
+            reserved_at INT NOT NULL DEFAULT 0,
+            INDEX idx_user_id (user_id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin
+    ''')
+    cur.execute('SELECT user_id, name FROM players ORDER BY id')
+    players = cur.fetchall()
+    for batch in chunked(players, 1000):
+        placeholders = ', '.join(["(%s, %s, 'taken')"] * len(batch))
+        cur.execute(f'INSERT IGNORE INTO player_names (name_key, user_id, status) VALUES {placeholders}',
+                    [value for user_id, name in batch for value in (normalize_name(name), user_id)])
+    cur.execute('SELECT name_key, user_id FROM player_names')
+    report_name_collisions(players, dict(cur.fetchall()))
+    # 重名检查改为查询名称表；更早的插件版本在迁移4中建过 players.name 上的索引，这里删除
+    if _mysql_index_exists(cur, 'players', 'idx_name'):
+        cur.execute("ALTER TABLE players DROP INDEX idx_name")
+
+
+def _mysql_column_type(cur, table, column):
+    cur.execute('''SELECT DATA_TYPE FROM information_schema.COLUMNS
+                   WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s''', (table, column))
+    row = cur.fetchone()
+    return row[0].lower() if row else None
+
+
+def _mysql_encode_gold_columns(cur):
+    """gold/total_income 由 DECIMAL(30,2) 改为 Gold 的 BIGINT 编码
+
+    DECIMAL(30,2) 只能保存到 10^28，远小于金币单位表的上限。编码值的大小顺序与金额一致，
+    排行榜仍然直接按 total_income 列排序。先写入临时列再一次性替换原列，临时列为NULL的行
+    尚未转换，中途失败时重新执行只处理剩余的行；文档存储模式的玩家同时改写 document 中的金额。
+    """
+    for table, key_column, index in (('players', 'id', 'total_income'), ('world_ranking', 'id', 'total_income DESC')):
+        if _mysql_column_type(cur, table, 'gold') == 'bigint':
+            continue
+        for column in ('gold', 'total_income'):
+            if not _mysql_column_exists(cur, table, f'{column}_code'):
+                cur.execute(f"ALTER TABLE {table} ADD COLUMN {column}_code BIGINT DEFAULT NULL AFTER {column}")
+        with_document = table == 'players' and _mysql_column_exists(cur, table, 'document')
+        cur.execute(f"SELECT {key_column}, gold, total_income{', document' if with_document else ''} FROM {table} "
+                    f"WHERE total_income_code IS NULL")
+        rows = cur.fetchall()
+        for batch in chunked(rows, 1000):
+            updates = []
+            for row in batch:
+                gold, total_income = gold_code(row[1]), gold_code(row[2])
+                document = row[3] if with_document else None
+                if document:
+                    rows_data = json.loads(zlib.decompress(document).decode('utf-8'))
+                    rows_data['players']['gold'] = gold_code(rows_data['players'].get('gold', 0))
+                    rows_data['players']['total_income'] = gold_code(rows_data['players'].get('total_income', 0))
+                    document = encode_player_document(rows_data)
+                updates.append((gold, total_income, document, row[0]) if with_document else (gold, total_income, row[0]))
+            if with_document:
+                cur.executemany(f"UPDATE {table} SET gold_code = %s, total_income_code = %s, "
+                                f"document = COALESCE(%s, document) WHERE {key_column} = %s", updates)
+            else:
+                cur.executemany(f"UPDATE {table} SET gold_code = %s, total_income_code = %s WHERE {key_column} = %s",
+                                updates)
+        drop_index = 'DROP INDEX idx_total_income, ' if _mysql_index_exists(cur, table, 'idx_total_income') else ''
+        cur.execute(f'''ALTER TABLE {table} {drop_index}
+                        DROP COLUMN gold, DROP COLUMN total_income,
+                        CHANGE COLUMN gold_code gold BIGINT NOT NULL DEFAULT 0,
+                        CHANGE COLUMN total_income_code total_income BIGINT NOT NULL DEFAULT 0,
+                        ADD INDEX idx_total_income ({index})''')
+
+
+MYSQL_MIGRATIONS = [
+    (1, '创建玩家数据表', MYSQL_INITIAL_TABLES),
+    (2, '玩家表增加版本号列', [_mysql_add_version_column]),
+    (3, '创建ID序列表', ['''
+        CREATE TABLE IF NOT EXISTS id_sequences (
+            name VARCHAR(64) NOT NULL PRIMARY KEY,
+            next_value BIGINT NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    ''']),
+    (4, '删除冗余索引并补充查询索引', [_mysql_fix_indexes]),
+    (5, '玩家表增加文档存储列', [_mysql_add_document_column]),
+    (6, '创建名称表', [_mysql_create_player_names]),
+    (7, '金额列改为定长整数编码', [_mysql_encode_gold_columns]),
+]
+
+
+class IdleTycoonDatabase(StorageBackend):
     _instance = None
+    _instance_lock = threading.Lock()
     _pool = None
+    # 只读副本连接池，未配置副本时为None
+    _replica_pool = None
 
     # 数据库配置
     DB_HOST = '127.0.0.1'
@@ -179,7 +1688,27 @@ class IdleTycoonDatabase:
     DB_USER = 'wolrd'
     DB_PASS = '<PASSWORD>'
 
-    def __init__(self):
+    # 连接池配置
+    POOL_SIZE = 10
+    POOL_MAX_OVERFLOW = 20
+    POOL_RECYCLE = 3600
+    # 空闲超过该秒数的连接由后台线程校验
+    POOL_VALIDATE_AFTER = 30
+    # 连接建立时设置一次的会话参数：并发修改由版本号检测，事务很短，锁等待超时设短以便快速失败
+    SESSION_INIT_COMMAND = "SET SESSION innodb_lock_wait_timeout = 5"
+
+    # 只读副本配置：{'host', 'port', 'user', 'password', 'database', 'pool_size'}，
+    # 未填写的项与主库相同；为None时所有读写都走主库
+    REPLICA = None
+    # 玩家写入后的该秒数内，其读取仍走主库，保证读到自己刚写入的数据
+    REPLICA_STICKY_SECONDS = 10
+
+    # 玩家数据的写入布局：tables 写入 players 和各子表；document 将完整数据压缩后
+    # 写入 players.document 一列，读取和保存都只访问一行。两种布局都能读取，
+    # 切换后用 Transfer.py convert 改写存量数据
+    STORAGE_MODE = 'tables'
+
+    def __init__(self, session_cache=None):
         if IdleTycoonDatabase._pool is None:
             IdleTycoonDatabase._pool = ConnectionPool(
                 host=self.DB_HOST,
@@ -188,22 +1717,60 @@ class IdleTycoonDatabase:
                 password=self.DB_PASS,
                 database=self.DB_NAME,
                 charset='utf8mb4',
-                pool_size=10,
-                max_overflow=20,
-                recycle=3600
+                pool_size=self.POOL_SIZE,
+                max_overflow=self.POOL_MAX_OVERFLOW,
+                recycle=self.POOL_RECYCLE,
+                validate_after=self.POOL_VALIDATE_AFTER,
+                init_command=self.SESSION_INIT_COMMAND
             )
-            # 连接池创建后自动创建数据库表
+            # 连接池创建后执行未完成的表结构迁移
             try:
-                self.create_tables()
-                print("数据库表初始化完成")
+                self.migrate()
             except Exception as e:
-                print(f"数据库表初始化失败: {e}")
+                print(f"数据库迁移失败: {e}")
                 # 不抛出异常，允许程序继续运行
+        if IdleTycoonDatabase._replica_pool is None and self.REPLICA:
+            replica = self.REPLICA
+            IdleTycoonDatabase._replica_pool = ConnectionPool(
+                host=replica.get('host', self.DB_HOST),
+                port=replica.get('port', self.DB_PORT),
+                user=replica.get('user', self.DB_USER),
+                password=replica.get('password', self.DB_PASS),
+                database=replica.get('database', self.DB_NAME),
+                charset='utf8mb4',
+                pool_size=replica.get('pool_size', self.POOL_SIZE),
+                max_overflow=self.POOL_MAX_OVERFLOW,
+                recycle=self.POOL_RECYCLE,
+                validate_after=self.POOL_VALIDATE_AFTER
+            )
+        # user_id -> 读取需要走主库的截止时间
+        self._primary_until = {}
+        self._primary_until_lock = threading.Lock()
+        self._init_services(session_cache)
+
+    # 配置文件中 mysql 段的键名 -> 类属性
+    CONFIG_KEYS = {
+        'host': 'DB_HOST', 'port': 'DB_PORT', 'database': 'DB_NAME', 'user': 'DB_USER', 'password': 'DB_PASS',
+        'pool_size': 'POOL_SIZE', 'max_overflow': 'POOL_MAX_OVERFLOW', 'recycle': 'POOL_RECYCLE',
+        'replica': 'REPLICA', 'replica_sticky_seconds': 'REPLICA_STICKY_SECONDS',
+        'storage_mode': 'STORAGE_MODE',
+    }
+
+    @classmethod
+    def configure(cls, options):
+        """用配置文件中的 mysql 段覆盖默认连接参数，需在首次 get_instance 之前调用"""
+        for key, attr in cls.CONFIG_KEYS.items():
+            if key in options:
+                setattr(cls, attr, options[key])
 
     @classmethod
-    def get_instance(cls):
+    def get_instance(cls, session_cache=None):
+        """获取单例，session_cache 写回缓存配置只在首次创建实例时生效"""
         if cls._instance is None:
-            cls._instance = cls()
+            # 异步层会在多个工作线程中首次获取实例，需要加锁避免重复创建连接池
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls(session_cache)
         return cls._instance
 
     @contextmanager
@@ -221,155 +1788,97 @@ class IdleTycoonDatabase:
             if conn:
                 self._pool.return_connection(conn)
 
+    @contextmanager
+    def read_cursor(self, user_id=None):
+        """只读查询使用的游标：配置了副本且该玩家不在写后粘滞期内时从副本读取"""
+        pool = self._pool
+        if self._replica_pool is not None and not self._is_sticky(user_id):
+            pool = self._replica_pool
+        conn = None
+        cur = None
+        try:
+            conn = pool.get_connection()
+            cur = conn.cursor()
+            yield cur
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                pool.return_connection(conn)
+
+    def _mark_written(self, user_id):
+        """记录玩家刚写入主库，粘滞期内的读取不走副本"""
+        if self._replica_pool is None:
+            return
+        now = time.monotonic()
+        with self._primary_until_lock:
+            self._primary_until[user_id] = now + self.REPLICA_STICKY_SECONDS
+            if len(self._primary_until) > 1000:
+                # 顺便清理已过期的记录
+                self._primary_until = {uid: t for uid, t in self._primary_until.items() if t > now}
+
+    def _is_sticky(self, user_id):
+        if user_id is None:
+            return False
+        with self._primary_until_lock:
+            until = self._primary_until.get(user_id)
+        return until is not None and until > time.monotonic()
+
     def get_conn(self):
         """获取数据库连接（为了兼容性保留，但建议使用cursor方法）"""
         return self._pool.get_connection()
 
-    def create_tables(self):
-        tables = {
-            'players': '''
-                CREATE TABLE IF NOT EXISTS players (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    user_id VARCHAR(128) NOT NULL UNIQUE,
-                    player_id INT NOT NULL UNIQUE,
-                    group_id VARCHAR(64) DEFAULT NULL,
-                    name VARCHAR(100) NOT NULL,
-                    gold DECIMAL(30,2) DEFAULT 0,
-                    diamond INT DEFAULT 0,
-                    city_level INT DEFAULT 1,
-                    total_income DECIMAL(30,2) DEFAULT 0,
-                    tutorial_step INT DEFAULT 1,
-                    ticket_normal INT DEFAULT 1,
-                    ticket_gold INT DEFAULT 0,
-                    ticket_rainbow INT DEFAULT 0,
-                    last_checkin_date DATE DEFAULT NULL,
-                    consecutive_checkins INT DEFAULT 0,
-                    memory_tickets INT DEFAULT 0,
-                    current_event JSON DEFAULT NULL,
-                    event_expire_time INT DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    INDEX idx_user_id (user_id),
-                    INDEX idx_player_id (player_id),
-                    INDEX idx_group_id (group_id),
-                    INDEX idx_total_income (total_income)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            ''',
-            'player_booths': '''
-                CREATE TABLE IF NOT EXISTS player_booths (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    user_id VARCHAR(128) NOT NULL,
-                    booth_name VARCHAR(50) NOT NULL,
-                    unlocked BOOLEAN DEFAULT FALSE,
-                    assistant_name VARCHAR(100) DEFAULT NULL,
-                    assistant_level INT DEFAULT 1,
-                    assistant_star INT DEFAULT 1,
-                    last_collect INT DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    UNIQUE KEY unique_user_booth (user_id, booth_name),
-                    INDEX idx_user_id (user_id),
-                    FOREIGN KEY (user_id) REFERENCES players(user_id) ON DELETE CASCADE
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            ''',
-            'player_assistants': '''
-                CREATE TABLE IF NOT EXISTS player_assistants (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    user_id VARCHAR(128) NOT NULL,
-                    assistant_name VARCHAR(100) NOT NULL,
-                    level INT DEFAULT 1,
-                    star INT DEFAULT 1,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    UNIQUE KEY unique_user_assistant (user_id, assistant_name),
-                    INDEX idx_user_id (user_id),
-                    FOREIGN KEY (user_id) REFERENCES players(user_id) ON DELETE CASCADE
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            ''',
-            'player_fragments': '''
-                CREATE TABLE IF NOT EXISTS player_fragments (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    user_id VARCHAR(128) NOT NULL,
-                    assistant_name VARCHAR(100) NOT NULL,
-                    count INT DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    UNIQUE KEY unique_user_fragment (user_id, assistant_name),
-                    INDEX idx_user_id (user_id),
-                    FOREIGN KEY (user_id) REFERENCES players(user_id) ON DELETE CASCADE
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            ''',
-            'player_memory_parts': '''
-                CREATE TABLE IF NOT EXISTS player_memory_parts (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    user_id VARCHAR(128) NOT NULL,
-                    card_part_key VARCHAR(150) NOT NULL,
-                    count INT DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    UNIQUE KEY unique_user_memory_part (user_id, card_part_key),
-                    INDEX idx_user_id (user_id),
-                    FOREIGN KEY (user_id) REFERENCES players(user_id) ON DELETE CASCADE
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            ''',
-            'player_memory_cards': '''
-                CREATE TABLE IF NOT EXISTS player_memory_cards (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    user_id VARCHAR(128) NOT NULL,
-                    card_name VARCHAR(100) NOT NULL,
-                    count INT DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    UNIQUE KEY unique_user_memory_card (user_id, card_name),
-                    INDEX idx_user_id (user_id),
-                    FOREIGN KEY (user_id) REFERENCES players(user_id) ON DELETE CASCADE
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            ''',
-            'world_ranking': '''
-                CREATE TABLE IF NOT EXISTS world_ranking (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    user_id VARCHAR(128) NOT NULL UNIQUE,
-                    name VARCHAR(100) NOT NULL,
-                    gold DECIMAL(30,2) DEFAULT 0,
-                    total_income DECIMAL(30,2) DEFAULT 0,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    INDEX idx_total_income (total_income DESC),
-                    FOREIGN KEY (user_id) REFERENCES players(user_id) ON DELETE CASCADE
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            ''',
-            'player_friends': '''
-                CREATE TABLE IF NOT EXISTS player_friends (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    user_id VARCHAR(128) NOT NULL,
-                    friend_user_id VARCHAR(128) NOT NULL,
-                    friend_player_id INT NOT NULL,
-                    status ENUM('pending', 'accepted', 'blocked') DEFAULT 'pending',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    UNIQUE KEY unique_friendship (user_id, friend_user_id),
-                    INDEX idx_user_id (user_id),
-                    INDEX idx_friend_player_id (friend_player_id),
-                    INDEX idx_status (status),
-                    FOREIGN KEY (user_id) REFERENCES players(user_id) ON DELETE CASCADE,
-                    FOREIGN KEY (friend_user_id) REFERENCES players(user_id) ON DELETE CASCADE
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            '''
-        }
-        conn = None
+    # 并发启动的多个进程通过命名锁串行执行迁移
+    MIGRATION_LOCK_NAME = 'wolrd_schema_migration'
+    MIGRATION_LOCK_TIMEOUT = 60
+
+    def schema_version(self, cur):
+        """返回已执行的最新迁移版本号，迁移表不存在时返回0"""
         try:
-            conn = self._pool.get_connection()
-            with conn.cursor() as cur:
-                for table, sql in tables.items():
-                    try:
-                        cur.execute(sql)
-                        print(f"表 {table} 创建成功")
-                    except Exception as e:
-                        print(f"创建表 {table} 失败: {e}")
-                        raise
-            conn.commit()
-        finally:
-            if conn:
-                self._pool.return_connection(conn)
+            cur.execute("SELECT MAX(version) FROM schema_migrations")
+        except pymysql.err.ProgrammingError as e:
+            # 1146: 表不存在，说明是首次使用迁移的库
+            if e.args[0] != 1146:
+                raise
+            return 0
+        row = cur.fetchone()
+        return int(row[0]) if row and row[0] is not None else 0
+
+    def migrate(self):
+        """执行尚未执行的迁移步骤，已是最新版本时只有一次版本查询"""
+        latest = MYSQL_MIGRATIONS[-1][0]
+        with self.cursor() as cur:
+            if self.schema_version(cur) >= latest:
+                return
+            cur.execute("SELECT GET_LOCK(%s, %s)", (self.MIGRATION_LOCK_NAME, self.MIGRATION_LOCK_TIMEOUT))
+            if not cur.fetchone()[0]:
+                raise RuntimeError("等待数据库迁移锁超时")
+            try:
+                cur.execute('''
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version INT NOT NULL PRIMARY KEY,
+                        description VARCHAR(200) NOT NULL,
+                        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+                ''')
+                # 拿到锁后重新读取，其他进程可能已经执行完
+                current = self.schema_version(cur)
+                for version, description, steps in MYSQL_MIGRATIONS:
+                    if version <= current:
+                        continue
+                    # DDL 在 MySQL 中会隐式提交，无法放进事务；每个步骤都可重复执行，
+                    # 中途失败时下次启动从该步骤重新开始
+                    for step in steps:
+                        if callable(step):
+                            step(cur)
+                        else:
+                            cur.execute(step)
+                    cur.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                                (version, description))
+                    print(f"数据库迁移 {version}: {description} 完成")
+            finally:
+                cur.execute("SELECT RELEASE_LOCK(%s)", (self.MIGRATION_LOCK_NAME,))
+                cur.fetchone()
 
     @staticmethod
     def get_user_id(e):
@@ -379,39 +1888,45 @@ class IdleTycoonDatabase:
     def parse_user_id(user_id):
         return {'group_id': None, 'user_id': user_id}
 
-    def load_player(self, user_id):
+    # 一次发送的玩家数据查询，结果集顺序与 parse_player_results 对应
+    LOAD_PLAYER_SQL = """
+        SELECT player_id, name, gold, diamond, city_level, total_income, tutorial_step,
+               ticket_normal, ticket_gold, ticket_rainbow, last_checkin_date,
+               consecutive_checkins, memory_tickets, current_event, event_expire_time, version, document
+          FROM players WHERE user_id = %(user_id)s;
+        SELECT booth_name, unlocked, assistant_name, assistant_level, assistant_star, last_collect
+          FROM player_booths WHERE user_id = %(user_id)s;
+        SELECT assistant_name, level, star FROM player_assistants WHERE user_id = %(user_id)s;
+        SELECT assistant_name, count FROM player_fragments WHERE user_id = %(user_id)s AND count > 0;
+        SELECT card_part_key, count FROM player_memory_parts WHERE user_id = %(user_id)s AND count > 0;
+        SELECT card_name, count FROM player_memory_cards WHERE user_id = %(user_id)s AND count > 0
+    """
+
+    def load_player(self, user_id, read_only=False):
+        """加载完整玩家数据
+
+        六条查询合并为一次请求，在同一个连接上依次读取各结果集，
+        只占用一次连接、一次网络往返。read_only 为True时可从只读副本读取。
+        文档存储模式下先只读 players 一行，尚未转换为文档的玩家再按子表读取。
+        """
         try:
-            with self.cursor() as cur:
-                cur.execute("SELECT * FROM players WHERE user_id = %s", (user_id,))
-                player = cur.fetchone()
-                if not player:
-                    return None
-                playerData = {
-                    'name': player[4],
-                    'player_id': int(player[2]),
-                    'gold': float(player[5]),
-                    'diamond': int(player[6]),
-                    'city_level': int(player[7]),
-                    'total_income': float(player[8]),
-                    'tutorial_step': int(player[9]),
-                    'tickets': {
-                        '普通': int(player[10]),
-                        '黄金': int(player[11]),
-                        '炫彩': int(player[12])
-                    },
-                    'last_checkin_date': player[13],
-                    'consecutive_checkins': int(player[14]),
-                    'memory_tickets': int(player[15]),
-                    'current_event': json.loads(player[16]) if player[16] else None,
-                    'event_expire_time': int(player[17])
-                }
-                playerData['booths'] = self.load_player_booths(user_id)
-                playerData['assistants'] = self.load_player_assistants(user_id)
-                playerData['fragments'] = self.load_player_fragments(user_id)
-                playerData['memory_parts'] = self.load_player_memory_parts(user_id)
-                playerData['memory_cards'] = self.load_player_memory_cards(user_id)
-                playerData['memory_effects'] = []
-                return playerData
+            with (self.read_cursor(user_id) if read_only else self.cursor()) as cur:
+                if self.STORAGE_MODE == 'document':
+                    cur.execute("SELECT version, document FROM players WHERE user_id = %s", (user_id,))
+                    row = cur.fetchone()
+                    if row is None:
+                        return None
+                    if row[1] is not None:
+                        return decode_player_document(row[1], row[0])
+                cur.execute(self.LOAD_PLAYER_SQL, {'user_id': user_id})
+                results = [cur.fetchall()]
+                while cur.nextset():
+                    results.append(cur.fetchall())
+            if results[0] and results[0][0][-1] is not None:
+                # 以文档布局保存的玩家
+                return decode_player_document(results[0][0][-1], results[0][0][-2])
+            results[0] = [row[:-1] for row in results[0]]
+            return parse_player_results(results)
         except Exception as e:
             print(f"加载玩家数据失败: {e}")
             return None
@@ -422,25 +1937,37 @@ class IdleTycoonDatabase:
         start_time = time.time()
         
         try:
-            # 设置连接超时
+            # 新玩家在事务开始前分配ID：预留ID段使用独立连接，不能等待本连接持有的锁
+            if not player_data.get('player_id'):
+                player_data['player_id'] = self.get_next_player_id()
             conn = self._pool.get_connection()
             
-            # 设置事务隔离级别为READ COMMITTED，减少锁等待
-            conn.query("SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED")
-            
-            # 使用较短的锁等待超时（30秒）
-            conn.query("SET SESSION innodb_lock_wait_timeout = 30")
-            
             # 开始事务
             conn.begin()
             
             user_info = self.parse_user_id(user_id)
+            rows = build_player_rows(player_data)
+            changes = player_data.changes(rows) if isinstance(player_data, PlayerRecord) else None
             
-            # 优化：使用批量操作，减少SQL执行次数
-            self._save_player_optimized(conn, user_id, user_info, player_data)
+            if self.STORAGE_MODE == 'document':
+                version = self._save_player_document(conn, user_id, user_info, rows, player_data, changes)
+            elif changes is None:
+                # 没有持久化快照（新玩家或普通字典），插入新玩家，玩家已存在时抛出PlayerVersionConflict
+                version = self._save_player_optimized(conn, user_id, user_info, rows)
+            elif player_data.layout == 'document':
+                # 读取自文档布局，子表中没有数据，需要完整写入各子表
+                version = self._save_player_optimized(conn, user_id, user_info, rows, player_data.version)
+            else:
+                # 只写入变更的列和子表记录，版本号不一致时抛出PlayerVersionConflict
+                version = self._save_player_changes(conn, user_id, changes, player_data.version)
             
             # 提交事务
             conn.commit()
+            self._mark_written(user_id)
+            if isinstance(player_data, PlayerRecord):
+                player_data.mark_persisted(rows)
+                player_data.version = version
+                player_data.layout = self.STORAGE_MODE
             
             # 记录执行时间
             execution_time = time.time() - start_time
@@ -449,6 +1976,14 @@ class IdleTycoonDatabase:
             
             return True
             
+        except PlayerVersionConflict:
+            if conn:
+                try:
+                    conn.rollback()
+                except:
+                    pass
+            raise
+            
         except Exception as e:
             if conn:
                 try:
@@ -468,141 +2003,121 @@ class IdleTycoonDatabase:
             
         finally:
             if conn:
-                try:
-                    # 重置会话设置
-                    conn.query("SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ")
-                    conn.query("SET SESSION innodb_lock_wait_timeout = 50")
-                except:
-                    pass
                 self._pool.return_connection(conn)
 
-    def _save_player_optimized(self, conn, user_id, user_info, player_data):
-        """优化的批量保存方法，减少数据库交互次数"""
+    def _save_player_optimized(self, conn, user_id, user_info, rows, version=None):
+        """完整写入玩家数据：写入players表，并重建所有子表记录
+
+        version 为 None 时插入新玩家，玩家已存在时抛出 PlayerVersionConflict，不会覆盖已有数据；
+        否则按版本号比较并交换更新 players 行。
+        :return: 写入后的版本号
+        """
         with conn.cursor() as cur:
             # 1. 保存基础玩家信息
-            player_id = player_data.get('player_id') or self.get_next_player_id()
-            tickets = player_data.get('tickets', {'普通': 1, '黄金': 0, '炫彩': 0})
-            
-            # 使用REPLACE INTO替代INSERT ... ON DUPLICATE KEY UPDATE，性能更好
-            cur.execute('''REPLACE INTO players (
-                user_id, player_id, group_id, name, gold, diamond, city_level, total_income,
-                tutorial_step, ticket_normal, ticket_gold, ticket_rainbow,
-                last_checkin_date, consecutive_checkins, memory_tickets,
-                current_event, event_expire_time
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''', [
-                user_id, player_id, user_info['group_id'],
-                player_data.get('name', '未知玩家'),
-                player_data.get('gold', 0), player_data.get('diamond', 0),
-                player_data.get('city_level', 1), player_data.get('total_income', 0),
-                player_data.get('tutorial_step', 1),
-                tickets.get('普通', 1), tickets.get('黄金', 0), tickets.get('炫彩', 0),
-                player_data.get('last_checkin_date'),
-                player_data.get('consecutive_checkins', 0),
-                player_data.get('memory_tickets', 0),
-                json.dumps(player_data.get('current_event')) if player_data.get('current_event') else None,
-                player_data.get('event_expire_time', 0)
-            ])
-            
-            # 2. 批量删除旧的子表数据
-            delete_queries = [
-                "DELETE FROM player_booths WHERE user_id = %s",
-                "DELETE FROM player_assistants WHERE user_id = %s", 
-                "DELETE FROM player_fragments WHERE user_id = %s",
-                "DELETE FROM player_memory_parts WHERE user_id = %s",
-                "DELETE FROM player_memory_cards WHERE user_id = %s"
-            ]
-            
-            for query in delete_queries:
-                cur.execute(query, (user_id,))
-            
-            # 3. 批量插入摊位数据
-            booths = player_data.get('booths', {})
-            if booths:
-                booth_values = []
-                for booth_name, booth_data in booths.items():
-                    assistant = booth_data.get('assistant')
-                    unlocked_value = booth_data.get('unlocked', False)
-                    unlocked = 1 if (unlocked_value and unlocked_value not in ('', None, 'false', '0')) else 0
-                    
-                    booth_values.append([
-                        user_id, booth_name, unlocked,
-                        assistant['name'] if assistant else None,
-                        assistant.get('level', 1) if assistant else 1,
-                        assistant.get('star', 1) if assistant else 1,
-                        booth_data.get('last_collect', 0)
-                    ])
-                
-                if booth_values:
-                    cur.executemany('''INSERT INTO player_booths (
-                        user_id, booth_name, unlocked, assistant_name, assistant_level, assistant_star, last_collect
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s)''', booth_values)
-            
-            # 4. 批量插入助理数据
-            assistants = player_data.get('assistants', [])
-            if assistants:
-                assistant_values = [[user_id, assistant.get('name', '未知助理'), 
-                                   assistant.get('level', 1), assistant.get('star', 1)] 
-                                  for assistant in assistants]
-                cur.executemany('''INSERT INTO player_assistants 
-                    (user_id, assistant_name, level, star) VALUES (%s, %s, %s, %s)''', assistant_values)
-            
-            # 5. 批量插入碎片数据
-            fragments = player_data.get('fragments', {})
-            if fragments:
-                fragment_values = [[user_id, name, count] for name, count in fragments.items() if count > 0]
-                if fragment_values:
-                    cur.executemany('''INSERT INTO player_fragments 
-                        (user_id, assistant_name, count) VALUES (%s, %s, %s)''', fragment_values)
-            
-            # 6. 批量插入记忆碎片数据
-            memory_parts = player_data.get('memory_parts', {})
-            if memory_parts:
-                memory_part_values = [[user_id, key, count] for key, count in memory_parts.items() if count > 0]
-                if memory_part_values:
-                    cur.executemany('''INSERT INTO player_memory_parts 
-                        (user_id, card_part_key, count) VALUES (%s, %s, %s)''', memory_part_values)
+            player_row = rows['players']
+            if version is None:
+                self._insert_player(cur, user_id, ('user_id', 'group_id') + PLAYER_COLUMNS,
+                                    [user_id, user_info['group_id']] + [player_row[col] for col in PLAYER_COLUMNS])
+                version = 0
+            else:
+                assignments = [f'{col} = %s' for col in PLAYER_COLUMNS] + ['version = version + 1', 'document = NULL']
+                cur.execute(
+                    f"UPDATE players SET {', '.join(assignments)} WHERE user_id = %s AND version = %s",
+                    [player_row[col] for col in PLAYER_COLUMNS] + [user_id, version]
+                )
+                if cur.rowcount == 0:
+                    raise PlayerVersionConflict(user_id)
+                version += 1
             
-            # 7. 批量插入记忆卡片数据  
-            memory_cards = player_data.get('memory_cards', {})
-            if memory_cards:
-                memory_card_values = [[user_id, name, count] for name, count in memory_cards.items() if count > 0]
-                if memory_card_values:
-                    cur.executemany('''INSERT INTO player_memory_cards 
-                        (user_id, card_name, count) VALUES (%s, %s, %s)''', memory_card_values)
+            # 2. 删除旧的子表数据并批量插入
+            for table, (key_column, value_columns) in CHILD_TABLES.items():
+                cur.execute(f"DELETE FROM {table} WHERE user_id = %s", (user_id,))
+                values = [[user_id, key, *value] for key, value in rows[table].items()]
+                if values:
+                    columns = ('user_id', key_column) + value_columns
+                    cur.executemany(
+                        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})",
+                        values
+                    )
+        return version
 
-    def save_player_with_retry(self, user_id, player_data, max_retries=3):
-        """带重试机制的保存方法，处理锁等待问题"""
-        for attempt in range(max_retries):
-            try:
-                result = self.save_player(user_id, player_data)
-                if result:
-                    return True
-                    
-                # 如果失败，短暂等待后重试
-                if attempt < max_retries - 1:
-                    wait_time = 0.1 * (2 ** attempt)  # 指数退避：0.1s, 0.2s, 0.4s
-                    print(f"保存失败，{wait_time}秒后重试 (第{attempt + 1}次)")
-                    time.sleep(wait_time)
-                    
-            except Exception as e:
-                if "Lock wait timeout" in str(e) and attempt < max_retries - 1:
-                    wait_time = 0.5 * (2 ** attempt)  # 锁超时时等待更长时间
-                    print(f"锁等待超时，{wait_time}秒后重试 (第{attempt + 1}次)")
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    print(f"保存失败，不再重试: {e}")
-                    break
-                    
-        print(f"用户 {user_id} 数据保存失败，已尝试 {max_retries} 次")
-        return False
+    def _insert_player(self, cur, user_id, columns, values):
+        """插入新玩家的 players 行，玩家已存在（重复创建或读取失败后当作新玩家）时抛出 PlayerVersionConflict"""
+        try:
+            cur.execute(f"INSERT INTO players ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})",
+                        values)
+        except pymysql.err.IntegrityError as e:
+            # 1062: 唯一键重复
+            if e.args[0] != 1062:
+                raise
+            cur.execute("SELECT 1 FROM players WHERE user_id = %s", (user_id,))
+            if cur.fetchone() is None:
+                raise
+            raise PlayerVersionConflict(user_id)
 
-    def save_player_async_queue(self, user_id, player_data):
-        """将保存任务加入异步队列（可选实现）"""
-        # 这里可以实现一个异步保存队列
-        # 避免在主线程中等待数据库锁
-        # 可以使用线程池或异步任务队列
-        pass
+    def _save_player_document(self, conn, user_id, user_info, rows, player_data, changes):
+        """文档布局写入：完整数据压缩后写入 players.document，只更新一行
+
+        :return: 写入后的版本号
+        """
+        document = encode_player_document(rows)
+        hot_values = [rows['players'][col] for col in DOCUMENT_COLUMNS]
+        with conn.cursor() as cur:
+            if changes is None:
+                self._insert_player(cur, user_id, ('user_id', 'group_id') + DOCUMENT_COLUMNS + ('document',),
+                                    [user_id, user_info['group_id']] + hot_values + [document])
+                return 0
+            player_changes, upserts, deletes = changes
+            if player_data.layout == 'document' and not (player_changes or upserts or deletes):
+                return player_data.version
+            assignments = [f'{col} = %s' for col in DOCUMENT_COLUMNS] + ['document = %s', 'version = version + 1']
+            cur.execute(
+                f"UPDATE players SET {', '.join(assignments)} WHERE user_id = %s AND version = %s",
+                hot_values + [document, user_id, player_data.version]
+            )
+            if cur.rowcount == 0:
+                raise PlayerVersionConflict(user_id)
+            if player_data.layout != 'document':
+                # 从子表布局转换过来，旧的子表记录不再使用
+                for table in CHILD_TABLES:
+                    cur.execute(f"DELETE FROM {table} WHERE user_id = %s", (user_id,))
+        return player_data.version + 1
+
+    def _save_player_changes(self, conn, user_id, changes, version):
+        """差量写入：只更新变化的列，按主键写入或删除变化的子表记录
+
+        players 行按版本号比较并交换，读取后被其他操作修改过时抛出 PlayerVersionConflict。
+        :return: 写入后的版本号
+        """
+        player_changes, upserts, deletes = changes
+        if not (player_changes or upserts or deletes):
+            return version
+        with conn.cursor() as cur:
+            # 子表的修改同样递增版本号，players 行的更新也让后续写入在同一玩家上串行
+            assignments = [f'{col} = %s' for col in player_changes] + ['version = version + 1']
+            cur.execute(
+                f"UPDATE players SET {', '.join(assignments)} WHERE user_id = %s AND version = %s",
+                list(player_changes.values()) + [user_id, version]
+            )
+            if cur.rowcount == 0:
+                raise PlayerVersionConflict(user_id)
+            
+            for table, records in upserts.items():
+                key_column, value_columns = CHILD_TABLES[table]
+                columns = ('user_id', key_column) + value_columns
+                cur.executemany(
+                    f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+                    f"ON DUPLICATE KEY UPDATE {', '.join(f'{col}=VALUES({col})' for col in value_columns)}",
+                    [[user_id, key, *value] for key, value in records.items()]
+                )
+            
+            for table, keys in deletes.items():
+                key_column = CHILD_TABLES[table][0]
+                cur.execute(
+                    f"DELETE FROM {table} WHERE user_id = %s AND {key_column} IN ({', '.join(['%s'] * len(keys))})",
+                    [user_id] + list(keys)
+                )
+        return version + 1
 
     def load_player_booths(self, user_id):
         with self.cursor() as cur:
@@ -682,10 +2197,10 @@ class IdleTycoonDatabase:
                     player_id,
                     user_info['group_id'],
                     player_data.get('name', '未知玩家'),
-                    player_data.get('gold', 0),
+                    gold_code(player_data.get('gold', 0)),
                     player_data.get('diamond', 0),
                     player_data.get('city_level', 1),
-                    player_data.get('total_income', 0),
+                    gold_code(player_data.get('total_income', 0)),
                     player_data.get('tutorial_step', 1),
                     tickets.get('普通', 1),
                     tickets.get('黄金', 0),
@@ -703,10 +2218,10 @@ class IdleTycoonDatabase:
                     player_id,
                     user_info['group_id'],
                     player_data.get('name', '未知玩家'),
-                    player_data.get('gold', 0),
+                    gold_code(player_data.get('gold', 0)),
                     player_data.get('diamond', 0),
                     player_data.get('city_level', 1),
-                    player_data.get('total_income', 0),
+                    gold_code(player_data.get('total_income', 0)),
                     player_data.get('tutorial_step', 1),
                     tickets.get('普通', 1),
                     tickets.get('黄金', 0),
@@ -860,41 +2375,289 @@ class IdleTycoonDatabase:
                     if count > 0:
                         cur.execute(sql, [user_id, card_name, count])
 
-    def load_world_ranking(self):
+    def _query_world_ranking(self, limit):
         with self.cursor() as cur:
-            cur.execute("SELECT name, gold, total_income FROM world_ranking ORDER BY total_income DESC LIMIT 50")
-            return [
-                {'name': row[0], 'gold': float(row[1]), 'total_income': float(row[2])}
-                for row in cur.fetchall()
-            ]
+            cur.execute("SELECT user_id, name, gold, total_income FROM world_ranking ORDER BY total_income DESC LIMIT %s",
+                        (limit,))
+            return cur.fetchall()
 
-    def update_world_ranking(self, user_id, name, gold, total_income):
-        """更新世界排行榜数据"""
+    def _write_world_ranking_batch(self, entries):
+        """用一条多行 INSERT ... ON DUPLICATE KEY UPDATE 写入一批排行数据"""
         conn = None
         try:
             conn = self._pool.get_connection()
-            sql = '''INSERT INTO world_ranking (user_id, name, gold, total_income)
-                     VALUES (%s, %s, %s, %s)
-                     ON DUPLICATE KEY UPDATE
-                        name=VALUES(name), gold=VALUES(gold), total_income=VALUES(total_income)'''
+            sql = f'''INSERT INTO world_ranking (user_id, name, gold, total_income)
+                      VALUES {', '.join(['(%s, %s, %s, %s)'] * len(entries))}
+                      ON DUPLICATE KEY UPDATE
+                         name=VALUES(name), gold=VALUES(gold), total_income=VALUES(total_income)'''
             with conn.cursor() as cur:
-                cur.execute(sql, [user_id, name, gold, total_income])
-            conn.commit()  # 重要：提交事务
+                cur.execute(sql, [value for entry in entries for value in entry])
             return True
         except Exception as e:
-            if conn:
-                conn.rollback()
             print(f"更新世界排行榜失败: {e}")
             return False
         finally:
             if conn:
                 self._pool.return_connection(conn)
 
-    def get_next_player_id(self):
+    def _reserve_player_id_block(self, size):
+        """在 id_sequences 中原子地预留一段玩家ID，返回第一个ID"""
+        conn = None
+        try:
+            conn = self._pool.get_connection()
+            with conn.cursor() as cur:
+                # LAST_INSERT_ID(expr) 按连接保存，单条UPDATE即可完成“加并取值”
+                sql = "UPDATE id_sequences SET next_value = LAST_INSERT_ID(next_value + %s) WHERE name = 'player_id'"
+                cur.execute(sql, (size,))
+                if cur.rowcount == 0:
+                    # 首次使用，从现有最大玩家ID之后开始
+                    cur.execute('''INSERT IGNORE INTO id_sequences (name, next_value)
+                                   SELECT 'player_id', COALESCE(MAX(player_id), 0) + 1 FROM players''')
+                    cur.execute(sql, (size,))
+                cur.execute("SELECT LAST_INSERT_ID()")
+                end = int(cur.fetchone()[0])
+            conn.commit()
+            return end - size
+        except Exception:
+            if conn:
+                conn.rollback()
+            raise
+        finally:
+            if conn:
+                self._pool.return_connection(conn)
+
+    # 批量导入时每条 INSERT 语句最多包含的行数
+    IMPORT_ROWS_PER_STATEMENT = 2000
+
+    def iter_players(self, batch_size=500):
+        """流式读取全部玩家
+
+        players 表通过无缓冲的服务端游标逐行读取，客户端只保留当前一批玩家；
+        每凑满一批，在另一个连接上按 user_id 一次查询各子表。
+        """
+        stream_conn = self._pool.get_connection()
+        stream = None
+        try:
+            stream = stream_conn.cursor(pymysql.cursors.SSCursor)
+            stream.execute(f"SELECT user_id, {', '.join(PLAYER_COLUMNS)}, version, document FROM players")
+            while True:
+                player_rows = stream.fetchmany(batch_size)
+                if not player_rows:
+                    break
+                yield from self._assemble_player_batch(player_rows)
+        finally:
+            if stream:
+                stream.close()
+            self._pool.return_connection(stream_conn)
+
+    def _assemble_player_batch(self, player_rows):
+        documents = [(row[0], decode_player_document(row[-1], row[-2])) for row in player_rows if row[-1] is not None]
+        player_rows = [row[:-1] for row in player_rows if row[-1] is None]
+        if not player_rows:
+            return documents
+        user_ids = [row[0] for row in player_rows]
+        placeholders = ', '.join(['%s'] * len(user_ids))
+        child_groups = []
+        with self.cursor() as cur:
+            for table, (key_column, value_columns) in CHILD_TABLES.items():
+                sql = f"SELECT user_id, {', '.join((key_column,) + value_columns)} FROM {table} WHERE user_id IN ({placeholders})"
+                if value_columns == ('count',):
+                    sql += " AND count > 0"
+                cur.execute(sql, user_ids)
+                child_groups.append(group_child_rows(cur.fetchall()))
+        return documents + assemble_players(player_rows, child_groups)
+
+    def convert_layout(self, target, batch_size=500):
+        """将全部玩家改写为目标存储布局（tables / document），需在插件停用时执行
+
+        :return: 改写的玩家数
+        """
+        if target not in ('tables', 'document'):
+            raise ValueError(f"未知的存储布局: {target}")
+        count = 0
+        batch = []
+        for user_id, player_data in self.iter_players(batch_size):
+            batch.append((user_id, player_data))
+            if len(batch) >= batch_size:
+                count += self._convert_batch(target, batch)
+                batch = []
+        if batch:
+            count += self._convert_batch(target, batch)
+        return count
+
+    def _convert_batch(self, target, batch):
+        conn = self._pool.get_connection()
+        try:
+            conn.begin()
+            for user_id, player_data in batch:
+                rows = build_player_rows(player_data)
+                if target == 'document':
+                    with conn.cursor() as cur:
+                        cur.execute(
+                            f"UPDATE players SET {', '.join(f'{col} = %s' for col in DOCUMENT_COLUMNS)}, "
+                            f"document = %s, version = version + 1 WHERE user_id = %s",
+                            [rows['players'][col] for col in DOCUMENT_COLUMNS] + [encode_player_document(rows), user_id]
+                        )
+                        for table in CHILD_TABLES:
+                            cur.execute(f"DELETE FROM {table} WHERE user_id = %s", (user_id,))
+                else:
+                    # 完整写入各子表并清空 document
+                    self._save_player_optimized(conn, user_id, self.parse_user_id(user_id), rows, player_data.version)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._pool.return_connection(conn)
+        return len(batch)
+
+    def import_player_batch(self, records):
+        """在一个事务中写入一批玩家，每张表用多行 INSERT 写入，每条语句上千行"""
+        rows_by_user = []
+        for user_id, player_data in records:
+            if not player_data.get('player_id'):
+                player_data['player_id'] = self.get_next_player_id()
+            rows_by_user.append((user_id, build_player_rows(player_data)))
+        if not rows_by_user:
+            return 0
+        user_ids = [user_id for user_id, _ in rows_by_user]
+        conn = self._pool.get_connection()
+        try:
+            conn.begin()
+            with conn.cursor() as cur:
+                columns = ('user_id',) + PLAYER_COLUMNS
+                values = [[user_id] + [rows['players'][col] for col in PLAYER_COLUMNS] for user_id, rows in rows_by_user]
+                for chunk in chunked(values, self.IMPORT_ROWS_PER_STATEMENT):
+                    cur.execute(
+                        f"INSERT INTO players ({', '.join(columns)}) "
+                        f"VALUES {', '.join(['(' + ', '.join(['%s'] * len(columns)) + ')'] * len(chunk))} "
+                        f"ON DUPLICATE KEY UPDATE {', '.join(f'{col}=VALUES({col})' for col in PLAYER_COLUMNS)}, "
+                        f"version = version + 1, document = NULL",
+                        [value for row in chunk for value in row]
+                    )
+                # 重新登记导入玩家的名称，名称已被其他玩家使用时不登记
+                cur.execute(f"DELETE FROM player_names WHERE user_id IN ({', '.join(['%s'] * len(user_ids))})", user_ids)
+                names = [[normalize_name(rows['players']['name']), user_id] for user_id, rows in rows_by_user]
+                for chunk in chunked(names, self.IMPORT_ROWS_PER_STATEMENT):
+                    placeholders = ', '.join(["(%s, %s, 'taken')"] * len(chunk))
+                    cur.execute(f"INSERT IGNORE INTO player_names (name_key, user_id, status) VALUES {placeholders}",
+                                [value for row in chunk for value in row])
+                for table, (key_column, value_columns) in CHILD_TABLES.items():
+                    cur.execute(f"DELETE FROM {table} WHERE user_id IN ({', '.join(['%s'] * len(user_ids))})", user_ids)
+                    columns = ('user_id', key_column) + value_columns
+                    values = [[user_id, key, *value] for user_id, rows in rows_by_user for key, value in rows[table].items()]
+                    for chunk in chunked(values, self.IMPORT_ROWS_PER_STATEMENT):
+                        cur.execute(
+                            f"INSERT INTO {table} ({', '.join(columns)}) "
+                            f"VALUES {', '.join(['(' + ', '.join(['%s'] * len(columns)) + ')'] * len(chunk))}",
+                            [value for row in chunk for value in row]
+                        )
+                ranking = [
+                    [user_id, rows['players']['name'], rows['players']['gold'], rows['players']['total_income']]
+                    for user_id, rows in rows_by_user
+                ]
+                for chunk in chunked(ranking, self.IMPORT_ROWS_PER_STATEMENT):
+                    cur.execute(
+                        f"INSERT INTO world_ranking (user_id, name, gold, total_income) "
+                        f"VALUES {', '.join(['(%s, %s, %s, %s)'] * len(chunk))} "
+                        f"ON DUPLICATE KEY UPDATE name=VALUES(name), gold=VALUES(gold), total_income=VALUES(total_income)",
+                        [value for row in chunk for value in row]
+                    )
+                # 导入的玩家自带ID，ID序列需要越过其中的最大值
+                cur.execute('''INSERT INTO id_sequences (name, next_value)
+                               SELECT 'player_id', COALESCE(MAX(player_id), 0) + 1 FROM players
+                               ON DUPLICATE KEY UPDATE next_value = GREATEST(next_value, VALUES(next_value))''')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._pool.return_connection(conn)
+        for user_id, rows in rows_by_user:
+            self._remember_name_key(normalize_name(rows['players']['name']))
+        self.ranking_index.invalidate()
+        return len(rows_by_user)
+
+    def _name_key_exists(self, name_key):
+        with self.cursor() as cur:
+            cur.execute('SELECT 1 FROM player_names WHERE name_key = %s', (name_key,))
+            return cur.fetchone() is not None
+
+    def _count_names(self):
+        with self.cursor() as cur:
+            cur.execute('SELECT COUNT(*) FROM player_names')
+            return int(cur.fetchone()[0])
+
+    def _iter_name_keys(self):
+        conn = self._pool.get_connection()
+        try:
+            with conn.cursor(pymysql.cursors.SSCursor) as cur:
+                cur.execute('SELECT name_key FROM player_names')
+                for (name_key,) in cur:
+                    yield name_key
+        finally:
+            self._pool.return_connection(conn)
+
+    def _reserve_name_key(self, user_id, name_key, now):
+        """插入名称表即完成预留；名称已存在时在行锁内判断能否接管"""
+        conn = None
+        try:
+            conn = self._pool.get_connection()
+            conn.begin()
+            with conn.cursor() as cur:
+                cur.execute('''INSERT INTO player_names (name_key, user_id, status, reserved_at)
+                               VALUES (%s, %s, 'reserved', %s)
+                               ON DUPLICATE KEY UPDATE name_key = name_key''', (name_key, user_id, now))
+                if cur.rowcount == 1:
+                    conn.commit()
+                    return True
+                cur.execute('SELECT user_id, status, reserved_at FROM player_names WHERE name_key = %s FOR UPDATE',
+                            (name_key,))
+                holder, status, reserved_at = cur.fetchone()
+                reserved = holder == user_id
+                if not reserved and status == 'reserved' and reserved_at < now - self.NAME_RESERVATION_TTL:
+                    # 预留者可能在保存玩家之后、确认名称之前中断，其玩家已使用该名称时补记为已使用
+                    cur.execute('SELECT name FROM players WHERE user_id = %s', (holder,))
+                    row = cur.fetchone()
+                    if row and normalize_name(row[0]) == name_key:
+                        cur.execute("UPDATE player_names SET status = 'taken' WHERE name_key = %s", (name_key,))
+                    else:
+                        cur.execute('UPDATE player_names SET user_id = %s, reserved_at = %s WHERE name_key = %s',
+                                    (user_id, now, name_key))
+                        reserved = True
+            conn.commit()
+            return reserved
+        except Exception:
+            if conn:
+                conn.rollback()
+            raise
+        finally:
+            if conn:
+                self._pool.return_connection(conn)
+
+    def _commit_name_key(self, user_id, name_key, old_key):
+        conn = None
+        try:
+            conn = self._pool.get_connection()
+            conn.begin()
+            with conn.cursor() as cur:
+                cur.execute("UPDATE player_names SET status = 'taken' WHERE name_key = %s AND user_id = %s",
+                            (name_key, user_id))
+                if old_key:
+                    cur.execute('DELETE FROM player_names WHERE name_key = %s AND user_id = %s', (old_key, user_id))
+            conn.commit()
+        except Exception:
+            if conn:
+                conn.rollback()
+            raise
+        finally:
+            if conn:
+                self._pool.return_connection(conn)
+
+    def _release_name_key(self, user_id, name_key):
         with self.cursor() as cur:
-            cur.execute('SELECT MAX(player_id) FROM players')
-            max_id = cur.fetchone()[0]
-            return (max_id or 0) + 1
+            cur.execute("DELETE FROM player_names WHERE name_key = %s AND user_id = %s AND status = 'reserved'",
+                        (name_key, user_id))
 
     def get_user_by_player_id(self, player_id):
         with self.cursor() as cur:
@@ -908,24 +2671,38 @@ class IdleTycoonDatabase:
             return int(result[0]) if result and result[0] else None
 
     def add_friend(self, user_id, friend_player_id):
+        """发送好友请求；对方已向自己发送过请求时直接成为好友
+
+        查找对方、检查已有关系和写入都在同一个连接上完成。
+        """
         conn = None
         try:
-            friend_user = self.get_user_by_player_id(friend_player_id)
-            if not friend_user:
-                return {'success': False, 'message': '玩家ID不存在'}
-            friend_user_id = friend_user[1]
-            
             conn = self._pool.get_connection()
+            conn.begin()
             with conn.cursor() as cur:
+                cur.execute('SELECT user_id FROM players WHERE player_id = %s', (friend_player_id,))
+                friend_user = cur.fetchone()
+                if not friend_user:
+                    conn.rollback()
+                    return {'success': False, 'message': '玩家ID不存在'}
+                friend_user_id = friend_user[0]
+                if friend_user_id == user_id:
+                    conn.rollback()
+                    return {'success': False, 'message': '不能添加自己为好友'}
                 cur.execute('SELECT status FROM player_friends WHERE user_id = %s AND friend_user_id = %s', (user_id, friend_user_id))
                 existing = cur.fetchone()
                 if existing:
+                    conn.rollback()
                     if existing[0] == 'accepted':
                         return {'success': False, 'message': '已经是好友了'}
                     elif existing[0] == 'pending':
                         return {'success': False, 'message': '好友请求已发送，等待对方同意'}
                     elif existing[0] == 'blocked':
                         return {'success': False, 'message': '无法添加此玩家为好友'}
+                if self._accept_request(cur, user_id, friend_user_id, friend_player_id):
+                    conn.commit()
+                    self.friend_graph.invalidate(user_id, friend_user_id)
+                    return {'success': True, 'message': '对方也向你发送过好友请求，你们已经成为好友'}
                 cur.execute('INSERT INTO player_friends (user_id, friend_user_id, friend_player_id, status) VALUES (%s, %s, %s, %s)', (user_id, friend_user_id, friend_player_id, 'pending'))
             conn.commit()
             return {'success': True, 'message': '好友请求已发送'}
@@ -938,9 +2715,79 @@ class IdleTycoonDatabase:
             if conn:
                 self._pool.return_connection(conn)
 
+    def _accept_request(self, cur, user_id, requester_user_id, requester_player_id):
+        """将 requester 发给 user 的待处理请求改为已同意，并写入反向关系，没有请求时返回False"""
+        cur.execute('''UPDATE player_friends SET status = 'accepted'
+                       WHERE user_id = %s AND friend_user_id = %s AND status = 'pending' ''', (requester_user_id, user_id))
+        if cur.rowcount == 0:
+            return False
+        cur.execute('''INSERT INTO player_friends (user_id, friend_user_id, friend_player_id, status)
+                       VALUES (%s, %s, %s, 'accepted')
+                       ON DUPLICATE KEY UPDATE status = 'accepted' ''', (user_id, requester_user_id, requester_player_id))
+        return True
+
+    def accept_friend(self, user_id, requester_player_id):
+        conn = None
+        try:
+            conn = self._pool.get_connection()
+            conn.begin()
+            with conn.cursor() as cur:
+                cur.execute('SELECT user_id FROM players WHERE player_id = %s', (requester_player_id,))
+                requester = cur.fetchone()
+                if not requester or not self._accept_request(cur, user_id, requester[0], requester_player_id):
+                    conn.rollback()
+                    return {'success': False, 'message': '没有来自该玩家的好友请求'}
+            conn.commit()
+            self.friend_graph.invalidate(user_id, requester[0])
+            return {'success': True, 'message': '已同意好友请求'}
+        except Exception as e:
+            if conn:
+                conn.rollback()
+            print(f"同意好友请求失败: {e}")
+            return {'success': False, 'message': '同意好友请求失败'}
+        finally:
+            if conn:
+                self._pool.return_connection(conn)
+
+    def remove_friend(self, user_id, friend_player_id):
+        conn = None
+        try:
+            conn = self._pool.get_connection()
+            with conn.cursor() as cur:
+                cur.execute('SELECT user_id FROM players WHERE player_id = %s', (friend_player_id,))
+                friend_user = cur.fetchone()
+                if not friend_user:
+                    return {'success': False, 'message': '玩家ID不存在'}
+                cur.execute('''DELETE FROM player_friends
+                               WHERE status = 'accepted' AND ((user_id = %s AND friend_user_id = %s)
+                                                           OR (user_id = %s AND friend_user_id = %s))''',
+                            (user_id, friend_user[0], friend_user[0], user_id))
+                if cur.rowcount == 0:
+                    return {'success': False, 'message': '你们还不是好友'}
+            self.friend_graph.invalidate(user_id, friend_user[0])
+            return {'success': True, 'message': '已删除好友'}
+        except Exception as e:
+            print(f"删除好友失败: {e}")
+            return {'success': False, 'message': '删除好友失败'}
+        finally:
+            if conn:
+                self._pool.return_connection(conn)
+
+    def _query_friend_ids(self, user_id):
+        with self.read_cursor(user_id) as cur:
+            cur.execute('''SELECT friend_user_id, created_at FROM player_friends
+                           WHERE user_id = %s AND status = 'accepted' ''', (user_id,))
+            return cur.fetchall()
+
+    def _query_profiles(self, user_ids):
+        with self.read_cursor() as cur:
+            cur.execute(f'''SELECT user_id, player_id, name, city_level, total_income FROM players
+                            WHERE user_id IN ({', '.join(['%s'] * len(user_ids))})''', list(user_ids))
+            return cur.fetchall()
+
     def get_friends(self, user_id):
         try:
-            with self.cursor() as cur:
+            with self.read_cursor(user_id) as cur:
                 cur.execute('''SELECT p.player_id, p.name, p.city_level, p.total_income, pf.created_at as friend_since
                                FROM player_friends pf
                                JOIN players p ON pf.friend_user_id = p.user_id
@@ -953,7 +2800,7 @@ class IdleTycoonDatabase:
 
     def get_friend_requests(self, user_id):
         try:
-            with self.cursor() as cur:
+            with self.read_cursor(user_id) as cur:
                 cur.execute('''SELECT p.player_id, p.name, p.city_level, p.total_income, pf.created_at as request_time
                                FROM player_friends pf
                                JOIN players p ON pf.user_id = p.user_id
@@ -967,20 +2814,26 @@ class IdleTycoonDatabase:
     def get_pool_status(self):
         """获取连接池状态信息"""
         if self._pool:
-            with self._pool._lock:
-                return {
-                    'pool_size': self._pool.pool_size,
-                    'max_overflow': self._pool.max_overflow,
-                    'created_connections': self._pool._created_connections,
-                    'available_connections': self._pool._pool.qsize()
-                }
+            return self._pool.status()
         return None
 
+    def close(self):
+        """写回缓存数据并关闭连接池，之后 get_instance 会创建新的实例"""
+        self.close_pool()
+        with IdleTycoonDatabase._instance_lock:
+            if IdleTycoonDatabase._instance is self:
+                IdleTycoonDatabase._instance = None
+
     def close_pool(self):
         """关闭连接池"""
+        # 关闭前写回缓存中的数据
+        StorageBackend.close(self)
         if self._pool:
             self._pool.close_all()
             IdleTycoonDatabase._pool = None
+        if self._replica_pool:
+            self._replica_pool.close_all()
+            IdleTycoonDatabase._replica_pool = None
 
     @classmethod
     def recreate_pool(cls):
@@ -988,5 +2841,137 @@ class IdleTycoonDatabase:
         if cls._pool:
             cls._pool.close_all()
         cls._pool = None
+        if cls._replica_pool:
+            cls._replica_pool.close_all()
+        cls._replica_pool = None
         if cls._instance:
             cls._instance.__init__()
+
+
+class AsyncIdleTycoonDatabase:
+    """存储后端（StorageBackend）的异步访问层
+
+    pymysql/sqlite3 都是阻塞驱动，所有数据库调用都放到专用的有界线程池中执行，
+    事件循环只等待结果，单个慢查询不会拖住其他群聊的消息处理。
+    """
+
+    # 工作线程数不超过连接池常驻连接数，多出的线程只会在连接池上排队
+    MAX_WORKERS = IdleTycoonDatabase.POOL_SIZE
+
+    def __init__(self, get_database=None, max_workers=None):
+        # get_database 在工作线程中调用，连接池的初始化同样不会阻塞事件循环
+        self._get_database = get_database or IdleTycoonDatabase.get_instance
+        self._resolved_database = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or self.MAX_WORKERS,
+            thread_name_prefix='idle_tycoon_db'
+        )
+
+    async def run(self, func, *args, **kwargs):
+        """在数据库线程池中执行任意阻塞函数"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def _call(self, method_name, *args, **kwargs):
+        def invoke():
+            if self._resolved_database is None:
+                self._resolved_database = self._get_database()
+            return getattr(self._resolved_database, method_name)(*args, **kwargs)
+        return await self.run(invoke)
+
+    async def _database(self):
+        if self._resolved_database is None:
+            self._resolved_database = await self.run(self._get_database)
+        return self._resolved_database
+
+    async def load_player(self, user_id, read_only=False):
+        """加载玩家数据，写回缓存命中时直接在事件循环中返回
+
+        :param read_only: 只读指令传True，缓存未命中时可从只读副本读取
+        """
+        database = await self._database()
+        if database.session_cache is not None:
+            player_data = database.session_cache.get(user_id)
+            if player_data is not None:
+                return player_data
+        return await self.run(database.load_player_cached, user_id, read_only)
+
+    async def save_player(self, user_id, player_data):
+        """保存玩家数据，已存在的玩家只写入缓存，由后台线程合并写库"""
+        database = await self._database()
+        if (database.session_cache is not None and isinstance(player_data, PlayerRecord)
+                and player_data.snapshot is not None):
+            # 只涉及内存操作，不必切换到线程池
+            return database.save_player_async_queue(user_id, player_data)
+        return await self.run(database.save_player_async_queue, user_id, player_data)
+
+    async def save_player_with_retry(self, user_id, player_data, max_retries=3):
+        return await self._call('save_player_with_retry', user_id, player_data, max_retries)
+
+    async def save_player_now(self, user_id, player_data):
+        """保存玩家数据并等待写入数据库"""
+        return await self._call('save_player_now', user_id, player_data)
+
+    async def load_world_ranking(self):
+        database = await self._database()
+        if database.ranking_index.loaded:
+            return database.ranking_index.top(50)
+        return await self.run(database.load_world_ranking)
+
+    async def render_world_ranking(self, renderer):
+        """返回排行榜文本，索引已加载时直接在事件循环中读取内存数据"""
+        database = await self._database()
+        if not database.ranking_index.loaded:
+            await self.run(database.warm_ranking_index)
+        return database.ranking_index.render(renderer)
+
+    async def update_world_ranking(self, user_id, name, gold, total_income):
+        """只更新内存索引和写缓冲，不必切换到线程池"""
+        database = await self._database()
+        return database.update_world_ranking(user_id, name, gold, total_income)
+
+    async def check_name_exists(self, name):
+        return await self._call('check_name_exists', name)
+
+    async def reserve_name(self, user_id, name):
+        return await self._call('reserve_name', user_id, name)
+
+    async def commit_name(self, user_id, name, old_name=None):
+        return await self._call('commit_name', user_id, name, old_name)
+
+    async def release_name(self, user_id, name):
+        return await self._call('release_name', user_id, name)
+
+    async def get_next_player_id(self):
+        return await self._call('get_next_player_id')
+
+    async def get_player_id_by_user_id(self, user_id):
+        return await self._call('get_player_id_by_user_id', user_id)
+
+    async def add_friend(self, user_id, friend_player_id):
+        return await self._call('add_friend', user_id, friend_player_id)
+
+    async def accept_friend(self, user_id, requester_player_id):
+        return await self._call('accept_friend', user_id, requester_player_id)
+
+    async def remove_friend(self, user_id, friend_player_id):
+        return await self._call('remove_friend', user_id, friend_player_id)
+
+    async def get_friend_requests(self, user_id):
+        return await self._call('get_friend_requests', user_id)
+
+    async def list_friends(self, user_id):
+        return await self._call('list_friends', user_id)
+
+    async def friend_leaderboard(self, user_id, limit=20):
+        return await self._call('friend_leaderboard', user_id, limit)
+
+    def close(self):
+        """关闭线程池，等待正在执行的数据库操作完成，再关闭存储后端
+
+        后端的 close 写回缓存中的玩家数据和排行数据，停止后台写库线程并释放连接。
+        """
+        self._executor.shutdown(wait=True)
+        if self._resolved_database is not None:
+            self._resolved_database.close()
+            self._resolved_database = None
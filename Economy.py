@@ -0,0 +1,736 @@
+"""收入计算使用的预编译规则
+
+助理特质等静态数据中的文字描述在加载时解析一次，编译为数值规则；
+指令中计算收入时只做查表和乘法，不再逐次匹配文本。
+"""
+import math
+import random
+import re
+
+# ---- 数值配置，插件和离线模拟器共用 ----
+
+# 展台：所属展区、解锁费用、每秒基础收入
+BOOTHS = {
+    '咖啡馆': {'area': '消费展区', 'unlock_cost': '10K', 'base_income': '1K', 'unlocked': False},
+    '便利店': {'area': '消费展区', 'unlock_cost': '100K', 'base_income': '5K', 'unlocked': False},
+    '服装店': {'area': '消费展区', 'unlock_cost': '1M', 'base_income': '20K', 'unlocked': False},
+    '电玩城': {'area': '趣味展区', 'unlock_cost': '10M', 'base_income': '100K', 'unlocked': False},
+    'KTV': {'area': '趣味展区', 'unlock_cost': '100M', 'base_income': '500K', 'unlocked': False},
+    '电影院': {'area': '趣味展区', 'unlock_cost': '1G', 'base_income': '2M', 'unlocked': False},
+    '书店': {'area': '纪念展区', 'unlock_cost': '10G', 'base_income': '10M', 'unlocked': False},
+    '培训班': {'area': '纪念展区', 'unlock_cost': '100G', 'base_income': '50M', 'unlocked': False},
+    '科技馆': {'area': '纪念展区', 'unlock_cost': '1AA', 'base_income': '200M', 'unlocked': False},
+}
+# 邀约卡池：每次消耗的钻石和各稀有度概率
+ASSISTANT_POOLS = {
+    '普通': {'cost': 100, 'rates': {'见习': 0.8, '熟练': 0.18, '资深': 0.02}},
+    '黄金': {'cost': 300, 'rates': {'见习': 0.5, '熟练': 0.4, '资深': 0.1}},
+    '炫彩': {'cost': 500, 'rates': {'见习': 0.2, '熟练': 0.5, '资深': 0.3}},
+}
+# 邀约的额外奖励：当前收入速率的比例和钻石
+GACHA_REWARDS = {
+    '普通': {'gold_rate': 0.001, 'diamond': 5},
+    '黄金': {'gold_rate': 0.005, 'diamond': 10},
+    '炫彩': {'gold_rate': 0.01, 'diamond': 30},
+}
+# 十连邀约的次数
+MULTI_PULL_COUNT = 10
+# 回忆卡抽取：每张卡分为A/B/C三部分，集齐后合成；稀有卡概率、钻石价格和单条指令的最多抽取次数
+MEMORY_CARD_PARTS = ('A', 'B', 'C')
+MEMORY_CARD_RARE_RATE = 0.3
+MEMORY_CARD_DRAW_COST = 100
+MEMORY_CARD_MAX_BATCH = 100
+# 升星所需碎片：当前星级 -> 碎片数
+STAR_UPGRADE_COST = {1: 3, 2: 10, 3: 20}
+# 助理升级费用 = 初始费用 × 倍率 ^ (当前等级 - 1)
+LEVEL_UPGRADE_BASE_COST = 1000
+LEVEL_UPGRADE_MULTIPLIER = 1.13
+# 收入加成：助理每升1级、每升1星、展会每升1级增加的基础倍率
+LEVEL_INCOME_BONUS = 1.0
+STAR_INCOME_BONUS = 2.0
+CITY_LEVEL_INCOME_BONUS = 1.0
+# 展会等级 -> 所需总收入
+CITY_LEVEL_THRESHOLDS = {1: 0, 2: 1e12, 3: 1e13, 4: 1e14, 5: 1e15, 6: 1e16, 7: 1e17, 8: 1e18, 9: 1e19, 10: 1e20}
+# 金币单位，每级为上一级的1000倍
+UNITS = ['', 'K', 'M', 'G', 'AA', 'BB', 'CC', 'DD', 'EE', 'FF', 'GG', 'HH', 'II', 'JJ', 'KK', 'LL', 'MM', 'NN', 'OO',
+         'PP', 'QQ', 'RR', 'SS', 'TT', 'UU', 'VV', 'WW', 'XX', 'YY', 'ZZ']
+
+
+UNIT_VALUES = {unit: 1000.0 ** power for power, unit in enumerate(UNITS)}
+AMOUNT_PATTERN = re.compile(r'^\s*([0-9.]+)\s*([A-Za-z]*)\s*$')
+
+
+def parse_amount(text):
+    """解析 '10K' 这样带单位的金额，单位不区分大小写；未知单位按1计，格式错误返回0"""
+    match = AMOUNT_PATTERN.match(text)
+    if not match:
+        return 0
+    return float(match.group(1)) * UNIT_VALUES.get(match.group(2).upper(), 1.0)
+
+
+# ---- 金币数值 ----
+
+# 1000 的整数次幂，下标即金币单位在 UNITS 中的位置；直接由十进制字面量得到，没有连乘误差
+POWERS_OF_1000 = [float(f'1e{3 * power}') for power in range(103)]
+UNIT_POWERS = {unit: power for power, unit in enumerate(UNITS)}
+# 数据库编码：尾数保留12位小数，每个指数占 1000 × 10^12 个编码值
+GOLD_CODE_SCALE = 10 ** 12
+GOLD_CODE_BLOCK = 1000 * GOLD_CODE_SCALE
+GOLD_CODE_MAX_EXPONENT = (2 ** 63 - 1) // GOLD_CODE_BLOCK - 1
+
+
+def _power_of_1000(power):
+    if 0 <= power < len(POWERS_OF_1000):
+        return POWERS_OF_1000[power]
+    return 1000.0 ** power
+
+
+def _normalize(mantissa, exponent):
+    """把尾数调整到 [1, 1000) 内（指数为0时允许小于1）"""
+    size = abs(mantissa)
+    if size < 1000.0 and (size >= 1.0 or exponent == 0):
+        return mantissa, exponent
+    if size == 0.0:
+        return 0.0, 0
+    if size != size or size == math.inf:
+        raise ValueError(f"金币数值必须是有限数：{mantissa}")
+    shift = max(math.floor(math.log10(size) / 3), -exponent)
+    if shift > 0:
+        mantissa /= _power_of_1000(shift)
+    elif shift < 0:
+        mantissa *= _power_of_1000(-shift)
+    exponent += shift
+    # 修正 log10 的舍入误差
+    size = abs(mantissa)
+    if size >= 1000.0:
+        mantissa /= 1000.0
+        exponent += 1
+    elif size < 1.0 and exponent > 0:
+        mantissa *= 1000.0
+        exponent -= 1
+    return mantissa, exponent
+
+
+class Gold:
+    """金币数值：尾数 × 1000^指数
+
+    尾数的绝对值在 [1, 1000) 内（指数为0时可以小于1），指数就是金币单位在 UNITS 中的下标，
+    格式化和解析都只需一次查表。数值范围不受浮点数和数据库 DECIMAL 列的限制。
+    实例不可变，可以直接与 int/float 做加减乘除和比较。
+    """
+
+    __slots__ = ('mantissa', 'exponent')
+
+    def __init__(self, value=0):
+        self.mantissa, self.exponent = _normalize(float(value), 0)
+
+    @classmethod
+    def _make(cls, mantissa, exponent):
+        gold = object.__new__(cls)
+        gold.mantissa, gold.exponent = _normalize(mantissa, exponent)
+        return gold
+
+    @classmethod
+    def coerce(cls, value):
+        """将 int/float/Decimal 转换为 Gold，已是 Gold 时原样返回"""
+        if value.__class__ is cls:
+            return value
+        return cls(value or 0)
+
+    @classmethod
+    def parse(cls, text):
+        """解析 '1.5AA' 这样带单位的金额，单位不区分大小写；未知单位按1计，格式错误返回0"""
+        match = AMOUNT_PATTERN.match(text)
+        if not match:
+            return cls()
+        try:
+            mantissa = float(match.group(1))
+        except ValueError:
+            return cls()
+        return cls._make(mantissa, UNIT_POWERS.get(match.group(2).upper(), 0))
+
+    def format(self):
+        """带单位的整数文本，超出单位表时使用最大单位"""
+        last = len(UNITS) - 1
+        if self.exponent <= last:
+            return str(int(self.mantissa)) + UNITS[self.exponent]
+        digits = int(self.mantissa * GOLD_CODE_SCALE) * 10 ** (3 * (self.exponent - last))
+        return str(digits // GOLD_CODE_SCALE) + UNITS[last]
+
+    def encode(self):
+        """编码为定长的64位整数：指数 × 10^15 + 尾数 × 10^12，负数取相反数
+
+        编码值的大小顺序与金额一致，数据库可以直接按编码列排序和建索引。
+        """
+        digits = round(abs(self.mantissa) * GOLD_CODE_SCALE)
+        exponent = self.exponent
+        if digits >= GOLD_CODE_BLOCK:
+            digits, exponent = GOLD_CODE_SCALE, exponent + 1
+        if exponent > GOLD_CODE_MAX_EXPONENT:
+            digits, exponent = GOLD_CODE_BLOCK - 1, GOLD_CODE_MAX_EXPONENT
+        code = exponent * GOLD_CODE_BLOCK + digits
+        return -code if self.mantissa < 0 else code
+
+    @classmethod
+    def decode(cls, code):
+        """由 encode 的编码值还原"""
+        code = int(code)
+        exponent, digits = divmod(abs(code), GOLD_CODE_BLOCK)
+        mantissa = digits / GOLD_CODE_SCALE
+        return cls._make(-mantissa if code < 0 else mantissa, exponent)
+
+    def _other(self, other):
+        if other.__class__ is Gold:
+            return other
+        if isinstance(other, (int, float)):
+            return Gold(other)
+        try:
+            return Gold(float(other))
+        except (TypeError, ValueError):
+            return None
+
+    def __add__(self, other):
+        other = self._other(other)
+        if other is None:
+            return NotImplemented
+        if not other.mantissa:
+            return self
+        if not self.mantissa:
+            return other
+        high, low = (self, other) if self.exponent >= other.exponent else (other, self)
+        gap = high.exponent - low.exponent
+        # 相差 10^18 倍以上时较小的一方低于尾数精度
+        if gap > 6:
+            return high
+        return Gold._make(high.mantissa + low.mantissa / POWERS_OF_1000[gap], high.exponent)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        other = self._other(other)
+        if other is None:
+            return NotImplemented
+        return self + (-other)
+
+    def __rsub__(self, other):
+        other = self._other(other)
+        if other is None:
+            return NotImplemented
+        return other + (-self)
+
+    def __mul__(self, other):
+        if other.__class__ is Gold:
+            return Gold._make(self.mantissa * other.mantissa, self.exponent + other.exponent)
+        if isinstance(other, (int, float)):
+            return Gold._make(self.mantissa * other, self.exponent)
+        return NotImplemented
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        """除以数值得到 Gold，两个 Gold 相除得到比值（float）"""
+        if other.__class__ is Gold:
+            return self.mantissa / other.mantissa * 1000.0 ** (self.exponent - other.exponent)
+        if isinstance(other, (int, float)):
+            return Gold._make(self.mantissa / other, self.exponent)
+        return NotImplemented
+
+    def __neg__(self):
+        return Gold._make(-self.mantissa, self.exponent)
+
+    def __pos__(self):
+        return self
+
+    def __abs__(self):
+        return self if self.mantissa >= 0 else -self
+
+    def __bool__(self):
+        return self.mantissa != 0.0
+
+    def __float__(self):
+        try:
+            return self.mantissa * _power_of_1000(self.exponent)
+        except OverflowError:
+            return math.copysign(math.inf, self.mantissa)
+
+    def __int__(self):
+        if self.exponent <= 5:
+            return int(float(self))
+        return int(self.mantissa * GOLD_CODE_SCALE) * 10 ** (3 * self.exponent) // GOLD_CODE_SCALE
+
+    def _order(self):
+        if self.mantissa > 0:
+            return 1, self.exponent, self.mantissa
+        if self.mantissa < 0:
+            return -1, -self.exponent, self.mantissa
+        return 0, 0, 0.0
+
+    # 与普通数值比较时转换为 float，超出浮点范围的值为 ±inf，比较结果仍然正确
+    def __eq__(self, other):
+        if other.__class__ is Gold:
+            return self.mantissa == other.mantissa and self.exponent == other.exponent
+        if isinstance(other, (int, float)):
+            return float(self) == other
+        return NotImplemented
+
+    def __lt__(self, other):
+        if other.__class__ is Gold:
+            return self._order() < other._order()
+        if isinstance(other, (int, float)):
+            return float(self) < other
+        return NotImplemented
+
+    def __le__(self, other):
+        if other.__class__ is Gold:
+            return self._order() <= other._order()
+        if isinstance(other, (int, float)):
+            return float(self) <= other
+        return NotImplemented
+
+    def __gt__(self, other):
+        if other.__class__ is Gold:
+            return self._order() > other._order()
+        if isinstance(other, (int, float)):
+            return float(self) > other
+        return NotImplemented
+
+    def __ge__(self, other):
+        if other.__class__ is Gold:
+            return self._order() >= other._order()
+        if isinstance(other, (int, float)):
+            return float(self) >= other
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(float(self))
+
+    # 不可变对象，复制时直接共享
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return Gold._make, (self.mantissa, self.exponent)
+
+    def __str__(self):
+        return self.format()
+
+    def __repr__(self):
+        return f"Gold({self.mantissa!r}e{3 * self.exponent})"
+
+
+def gold_code(value):
+    """金额的数据库编码，value 可以是 Gold 或普通数值"""
+    return Gold.coerce(value).encode()
+
+
+def level_upgrade_cost(level, count=1):
+    """助理从 level 级连升 count 级的总费用（等比数列求和），超出浮点范围时为无穷大"""
+    if count <= 0:
+        return 0.0
+    r = LEVEL_UPGRADE_MULTIPLIER
+    try:
+        return LEVEL_UPGRADE_BASE_COST * r ** (level - 1) * (r ** count - 1) / (r - 1)
+    except OverflowError:
+        return math.inf
+
+
+def max_affordable_levels(level, gold):
+    """gold 最多能让 level 级助理连升几级
+
+    由 gold >= 首级费用 × (r^n - 1) / (r - 1) 解出 n = ⌊log_r(1 + gold × (r - 1) / 首级费用)⌋，
+    在对数空间计算避免高等级时溢出，再按实际费用校正浮点误差。
+    """
+    if gold <= 0:
+        return 0
+    r = LEVEL_UPGRADE_MULTIPLIER
+    log_first = math.log(LEVEL_UPGRADE_BASE_COST) + (level - 1) * math.log(r)
+    ratio = math.exp(min(math.log(gold * (r - 1)) - log_first, 700))
+    count = int(math.log1p(ratio) / math.log(r))
+    while count > 0 and level_upgrade_cost(level, count) > gold:
+        count -= 1
+    while level_upgrade_cost(level, count + 1) <= gold:
+        count += 1
+    return count
+
+
+def plan_level_upgrades(levels, gold):
+    """用 gold 尽量多地升级一组助理，优先升级等级最低的，使各助理等级尽量平均
+
+    二分查找最高的目标等级 L，使所有低于 L 的助理升到 L 的总费用不超过 gold；
+    剩余金币再依次让停在 L 的助理各升一级。
+    :param levels: 各助理当前等级列表
+    :return: (各助理升级后的等级列表, 总费用)
+    """
+    if not levels:
+        return [], 0.0
+
+    def cost_to(target):
+        return sum(level_upgrade_cost(level, target - level) for level in levels if level < target)
+
+    low = min(levels)
+    high = low + max_affordable_levels(low, gold) + 1
+    # 不变式：cost_to(low) <= gold < cost_to(high)
+    while high - low > 1:
+        mid = (low + high) // 2
+        if cost_to(mid) <= gold:
+            low = mid
+        else:
+            high = mid
+    new_levels = [max(level, low) for level in levels]
+    spent = cost_to(low)
+    for i in sorted(range(len(levels)), key=lambda i: new_levels[i]):
+        if new_levels[i] != low:
+            break
+        cost = level_upgrade_cost(low)
+        if spent + cost > gold:
+            break
+        new_levels[i] += 1
+        spent += cost
+    return new_levels, spent
+
+
+def city_level_for(total_income):
+    """按总收入计算展会等级"""
+    level = 1
+    for lv, need in CITY_LEVEL_THRESHOLDS.items():
+        if total_income >= need:
+            level = lv
+    return level
+
+
+def city_buff(level):
+    """展会等级带来的收入倍率，level 也可以是 NumPy 数组"""
+    return 1 + (level - 1) * CITY_LEVEL_INCOME_BONUS
+
+
+def level_multiplier(level):
+    """助理等级带来的收入倍率，level 也可以是 NumPy 数组"""
+    return 1 + (level - 1) * LEVEL_INCOME_BONUS
+
+
+def star_multiplier(star):
+    """助理星级带来的收入倍率，star 也可以是 NumPy 数组"""
+    return 1 + (star - 1) * STAR_INCOME_BONUS
+
+
+# 特质文本格式，按从具体到宽泛的顺序匹配
+TRAIT_PATTERNS = (
+    ('event', re.compile(r'^所有展会事件收入增加(\d+(?:\.\d+)?)%$')),
+    ('global', re.compile(r'^所有展台收入增加(\d+(?:\.\d+)?)%$')),
+    ('area', re.compile(r'^(.+展区)收入增加(\d+(?:\.\d+)?)%$')),
+    ('bond', re.compile(r'^(.+)收入增加(\d+(?:\.\d+)?)%$')),
+)
+
+
+class TraitEffect:
+    """一条特质编译后的效果
+
+    kind 为 bond（目标助理在任一已解锁展台工作时生效）、area（目标展区的展台生效）、
+    global（所有展台生效）或 event（展会事件收入，不参与展台收入）；
+    multiplier 为生效时的收入倍率。
+    """
+
+    __slots__ = ('kind', 'target', 'multiplier')
+
+    def __init__(self, kind, target, multiplier):
+        self.kind = kind
+        self.target = target
+        self.multiplier = multiplier
+
+    def __repr__(self):
+        return f"TraitEffect({self.kind!r}, {self.target!r}, {self.multiplier!r})"
+
+
+def compile_trait(trait):
+    """将一条特质文本编译为 TraitEffect，无法识别时返回None"""
+    for kind, pattern in TRAIT_PATTERNS:
+        match = pattern.match(trait.strip())
+        if match:
+            *target, percent = match.groups()
+            return TraitEffect(kind, target[0] if target else None, 1 + float(percent) / 100)
+    return None
+
+
+class AssistantTraits:
+    """一名助理全部特质合并后的效果
+
+    同类的全局、展区效果预先相乘，羁绊效果保留为 (目标助理, 倍率) 列表。
+    """
+
+    __slots__ = ('global_multiplier', 'area_multipliers', 'bonds', 'event_multiplier')
+
+    def __init__(self, effects):
+        self.global_multiplier = 1.0
+        self.event_multiplier = 1.0
+        self.area_multipliers = {}
+        bonds = []
+        for effect in effects:
+            if effect.kind == 'global':
+                self.global_multiplier *= effect.multiplier
+            elif effect.kind == 'event':
+                self.event_multiplier *= effect.multiplier
+            elif effect.kind == 'area':
+                self.area_multipliers[effect.target] = self.area_multipliers.get(effect.target, 1.0) * effect.multiplier
+            else:
+                bonds.append((effect.target, effect.multiplier))
+        self.bonds = tuple(bonds)
+
+
+def working_assistants(booths):
+    """已解锁展台中正在工作的助理名称集合，羁绊检查只需查集合
+
+    :param booths: 玩家展台数据，{展台名: 展台数据} 或展台数据列表
+    """
+    values = booths.values() if isinstance(booths, dict) else booths
+    return frozenset(
+        booth['assistant']['name'] for booth in values
+        if booth.get('unlocked') and booth.get('assistant') and booth['assistant'].get('name')
+    )
+
+
+class TraitEngine:
+    """按助理名称索引的静态数据和编译后的特质"""
+
+    def __init__(self, assistant_data):
+        self.details = {}
+        self.traits = {}
+        self.unknown_traits = []
+        for data in assistant_data or []:
+            name = data.get('name')
+            if not name:
+                continue
+            effects = []
+            for trait in data.get('traits', []):
+                effect = compile_trait(trait)
+                if effect is None:
+                    self.unknown_traits.append((name, trait))
+                else:
+                    effects.append(effect)
+            self.details[name] = data
+            self.traits[name] = AssistantTraits(effects)
+
+    def assistant_bonus(self, assistant, area, working):
+        """助理对所在展台的收入倍率
+
+        :param assistant: 展台中的助理数据 {'name', 'level', 'star'}
+        :param area: 展台所属展区
+        :param working: working_assistants 返回的在岗助理集合
+        """
+        traits = self.traits.get(assistant['name'])
+        if traits is None:
+            return 1.0
+        bonus = level_multiplier(assistant.get('level', 1)) * star_multiplier(assistant.get('star', 1))
+        bonus *= traits.global_multiplier * traits.area_multipliers.get(area, 1.0)
+        for target, multiplier in traits.bonds:
+            if target in working:
+                bonus *= multiplier
+        return bonus
+
+
+class AliasTable:
+    """Walker 别名表：按给定权重抽取下标，构建 O(n)，每次抽取 O(1)"""
+
+    __slots__ = ('prob', 'alias')
+
+    def __init__(self, weights):
+        count = len(weights)
+        total = float(sum(weights))
+        if count == 0 or total <= 0:
+            raise ValueError("别名表至少需要一个正权重")
+        scaled = [weight * count / total for weight in weights]
+        self.prob = [1.0] * count
+        self.alias = list(range(count))
+        small = [i for i, value in enumerate(scaled) if value < 1.0]
+        large = [i for i, value in enumerate(scaled) if value >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            (small if scaled[more] < 1.0 else large).append(more)
+        # 剩下的格子只差浮点误差，概率按1处理
+
+    def sample(self, rng=random):
+        """抽取一个下标：均匀选一格，再按该格的概率决定取自身还是别名"""
+        position = rng.random() * len(self.prob)
+        index = int(position)
+        return index if position - index < self.prob[index] else self.alias[index]
+
+
+class GachaPool:
+    """一个邀约卡池：先按概率抽稀有度、再在该稀有度内均匀抽助理，合并为一张别名表
+
+    outcomes 为 (稀有度, 助理)；某稀有度没有助理时助理为None，该稀有度的概率保持不变。
+    """
+
+    __slots__ = ('outcomes', 'table')
+
+    def __init__(self, rates, members):
+        """
+        :param rates: {稀有度: 概率}（ASSISTANT_POOLS 中的 rates）
+        :param members: {稀有度: 该稀有度的助理序列}
+        """
+        outcomes = []
+        weights = []
+        for rarity, rate in rates.items():
+            bucket = members.get(rarity) or ()
+            if bucket:
+                outcomes += [(rarity, member) for member in bucket]
+                weights += [rate / len(bucket)] * len(bucket)
+            else:
+                outcomes.append((rarity, None))
+                weights.append(rate)
+        self.outcomes = tuple(outcomes)
+        self.table = AliasTable(weights)
+
+    def draw(self, rng=random):
+        return self.outcomes[self.table.sample(rng)]
+
+
+class MemoryCardPool:
+    """一个区域的回忆卡抽取池：稀有卡共占 MEMORY_CARD_RARE_RATE，其余为普通卡，部分A/B/C均匀抽取
+
+    区域只有一种稀有度时在全部卡中均匀抽取。outcomes 为 (回忆卡, 部分)。
+    """
+
+    __slots__ = ('outcomes', 'table')
+
+    def __init__(self, normal_cards, rare_cards):
+        normal_cards, rare_cards = tuple(normal_cards), tuple(rare_cards)
+        if normal_cards and rare_cards:
+            buckets = ((normal_cards, 1 - MEMORY_CARD_RARE_RATE), (rare_cards, MEMORY_CARD_RARE_RATE))
+        else:
+            buckets = ((normal_cards or rare_cards, 1.0),)
+        outcomes = []
+        weights = []
+        for cards, rate in buckets:
+            for card in cards:
+                outcomes += [(card, part) for part in MEMORY_CARD_PARTS]
+                weights += [rate / len(cards) / len(MEMORY_CARD_PARTS)] * len(MEMORY_CARD_PARTS)
+        self.outcomes = tuple(outcomes)
+        self.table = AliasTable(weights)
+
+    def draw(self, rng=random):
+        return self.outcomes[self.table.sample(rng)]
+
+
+# 回忆卡加成的作用目标：所有展台、各展区、展会事件
+MEMORY_CARD_BONUS_KEYS = ('all', '消费展区', '趣味展区', '纪念展区', 'event')
+MEMORY_CARD_EFFECT_PATTERN = re.compile(r'^(.+?)的收入增加(\d+(?:\.\d+)?)%$')
+
+
+def compile_memory_card_effect(text):
+    """将回忆卡的集齐效果文本编译为 (加成目标, 百分比)，无法识别时返回None"""
+    match = MEMORY_CARD_EFFECT_PATTERN.match(text.strip())
+    if not match:
+        return None
+    subject, percent = match.groups()
+    if subject.startswith('所有展会事件'):
+        target = 'event'
+    elif subject == '所有展台':
+        target = 'all'
+    elif subject in MEMORY_CARD_BONUS_KEYS:
+        target = subject
+    else:
+        return None
+    return target, float(percent)
+
+
+class MemoryCardTable:
+    """按名称索引的回忆卡数据和编译后的集齐效果"""
+
+    def __init__(self, card_data):
+        self.cards = {}
+        self.effects = {}
+        self.unknown_effects = []
+        for data in card_data or []:
+            name = data.get('名称')
+            if not name:
+                continue
+            self.cards[name] = data
+            effect = compile_memory_card_effect(data.get('集齐效果', ''))
+            if effect is None:
+                self.unknown_effects.append((name, data.get('集齐效果', '')))
+            else:
+                self.effects[name] = effect
+
+    def bonus(self, memory_cards):
+        """按持有数量加权求和各目标的加成百分比，返回 {目标: 收入倍率}"""
+        percents = dict.fromkeys(MEMORY_CARD_BONUS_KEYS, 0.0)
+        for card_name, count in (memory_cards or {}).items():
+            effect = self.effects.get(card_name)
+            if effect is not None:
+                percents[effect[0]] += effect[1] * count
+        # 百分比转换为倍率（例如：100% -> 2.0倍）
+        return {target: 1.0 + percent / 100 for target, percent in percents.items()}
+
+
+def income_fingerprint(player, city_level):
+    """影响收入速率的玩家状态：各展台的解锁状态和在岗助理、完整回忆卡、展会等级
+
+    状态不变时可以复用上次计算的收入速率。
+    """
+    booths = tuple(
+        (name, bool(info.get('unlocked')),
+         (info['assistant'].get('name'), info['assistant'].get('level', 1), info['assistant'].get('star', 1))
+         if info.get('assistant') else None)
+        for name, info in player['booths'].items()
+    )
+    cards = tuple(sorted((player.get('memory_cards') or {}).items()))
+    return city_level, booths, cards
+
+
+class IncomeSnapshot:
+    """玩家某一状态下的收入速率（每秒）
+
+    booth_rates 为各在岗展台的速率，total_rate 为其合计，event_multiplier 为
+    展会事件加成（回忆卡和在岗助理的事件特质），只在收取时作用于合计收入。
+    """
+
+    __slots__ = ('fingerprint', 'city_level', 'booth_rates', 'total_rate', 'event_multiplier')
+
+    def __init__(self, fingerprint, city_level, booth_rates, event_multiplier):
+        self.fingerprint = fingerprint
+        self.city_level = city_level
+        self.booth_rates = booth_rates
+        self.total_rate = sum(booth_rates.values())
+        self.event_multiplier = event_multiplier
+
+
+class IncomeEngine:
+    """统一的展台收入公式
+
+    展台速率 = 基础收入 × 展会等级加成 × 助理加成 × 回忆卡全局加成 × 回忆卡展区加成
+    """
+
+    def __init__(self, booths, trait_engine):
+        """
+        :param booths: {展台名: 展台记录}，记录带有数值的 base_income 和 area（见 Catalog.BoothRecord）
+        """
+        self.base_income = {name: booth.base_income for name, booth in booths.items()}
+        self.area = {name: booth.area for name, booth in booths.items()}
+        self.trait_engine = trait_engine
+
+    def booth_rate(self, booth_name, assistant, city_buff, card_bonus, working):
+        """一个展台在给定助理下的每秒收入"""
+        area = self.area[booth_name]
+        return (self.base_income[booth_name] * city_buff
+                * self.trait_engine.assistant_bonus(assistant, area, working)
+                * card_bonus['all'] * card_bonus.get(area, 1.0))
+
+    def snapshot(self, player, city_level, city_buff, card_bonus, fingerprint=None):
+        working = working_assistants(player['booths'])
+        booth_rates = {
+            name: self.booth_rate(name, info['assistant'], city_buff, card_bonus, working)
+            for name, info in player['booths'].items()
+            if info.get('unlocked') and info.get('assistant') and name in self.base_income
+        }
+        event_multiplier = card_bonus.get('event', 1.0)
+        for name in working:
+            traits = self.trait_engine.traits.get(name)
+            if traits is not None:
+                event_multiplier *= traits.event_multiplier
+        return IncomeSnapshot(fingerprint, city_level, booth_rates, event_multiplier)
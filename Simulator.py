@@ -0,0 +1,327 @@
+"""经济数值离线模拟器
+
+按 Economy.py 中的数值配置和收入公式，用 NumPy 数组同时推进大量虚拟玩家：
+每一步按当前收入速率累计金币，依次做解锁展台、升级助理的决策，每天签到领钻石
+并按卡池概率邀约。输出达到各展会等级、解锁各展台所需天数的分布，用于评估
+解锁费用、升级倍率、升星碎片和展会等级阈值的调整效果。
+
+模型简化：
+- 助理按“倍率最高的助理放在基础收入最高的展台”贪心分配，考虑星级、等级、全局/展区特质和羁绊，
+  每天和解锁展台后重新分配
+- 不模拟回忆卡和展会事件；邀约的额外金币、钻石奖励按插件公式计算
+- 每一步把可用金币先用于解锁下一个展台，剩余的按比例用于升级等级最低的在岗助理
+
+需要 numpy，在 AstrBot 根目录下执行：
+    python -m data.plugins.astrbot_plugin_srwolrd.Simulator --players 10000 --days 30 --workers 4
+"""
+import argparse
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:
+    # 插件运行不需要numpy，只有模拟器需要
+    np = None
+
+from .Economy import (
+    ASSISTANT_POOLS,
+    BOOTHS,
+    CITY_LEVEL_THRESHOLDS,
+    GACHA_REWARDS,
+    LEVEL_UPGRADE_BASE_COST,
+    LEVEL_UPGRADE_MULTIPLIER,
+    STAR_UPGRADE_COST,
+    TraitEngine,
+    city_buff,
+    level_multiplier,
+    parse_amount,
+    star_multiplier,
+)
+
+MAX_STAR = 4
+
+
+def load_assistant_data(path=None):
+    path = path or os.path.join(os.path.dirname(__file__), '[星铁Wolrd]助理名单.json')
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class EconomyModel:
+    """模拟使用的数值表，由数值配置和助理数据编译为数组"""
+
+    def __init__(self, assistant_data, pool='普通', booths=None, level_multiplier=LEVEL_UPGRADE_MULTIPLIER,
+                 level_base_cost=LEVEL_UPGRADE_BASE_COST, star_costs=None, city_thresholds=None):
+        booths = booths or BOOTHS
+        # 展台按解锁费用排序，模拟中按此顺序解锁
+        names = sorted(booths, key=lambda name: parse_amount(booths[name]['unlock_cost']))
+        areas = sorted({booths[name]['area'] for name in names})
+        self.booth_names = names
+        self.unlock_cost = np.array([parse_amount(booths[name]['unlock_cost']) for name in names])
+        self.base_income = np.array([parse_amount(booths[name]['base_income']) for name in names])
+        self.booth_area = np.array([areas.index(booths[name]['area']) for name in names])
+
+        engine = TraitEngine(assistant_data)
+        self.assistant_names = list(engine.traits)
+        index = {name: i for i, name in enumerate(self.assistant_names)}
+        self.global_multiplier = np.array([engine.traits[name].global_multiplier for name in self.assistant_names])
+        # [助理, 展区] 的展区特质倍率
+        self.area_multiplier = np.array([
+            [engine.traits[name].area_multipliers.get(area, 1.0) for area in areas] for name in self.assistant_names
+        ])
+        # 羁绊：(拥有特质的助理, 目标助理, 倍率)，目标不在助理名单中的羁绊不会生效
+        bonds = [(index[name], index[target], multiplier)
+                 for name in self.assistant_names for target, multiplier in engine.traits[name].bonds if target in index]
+        self.bond_source = np.array([b[0] for b in bonds], dtype=np.int64)
+        self.bond_target = np.array([b[1] for b in bonds], dtype=np.int64)
+        self.bond_multiplier = np.array([b[2] for b in bonds])
+
+        # 卡池：各稀有度的累计概率和该稀有度的助理下标
+        self.pool = pool
+        self.pool_cost = ASSISTANT_POOLS[pool]['cost']
+        rarities = list(ASSISTANT_POOLS[pool]['rates'])
+        self.rarity_cumulative = np.cumsum([ASSISTANT_POOLS[pool]['rates'][r] for r in rarities])
+        self.rarity_members = [
+            np.array([index[data['name']] for data in assistant_data if data.get('level') == rarity and data.get('name') in index],
+                     dtype=np.int64)
+            for rarity in rarities
+        ]
+
+        self.level_multiplier = level_multiplier
+        self.level_base_cost = level_base_cost
+        star_costs = star_costs or STAR_UPGRADE_COST
+        # 按星级查升星碎片，最高星级为无穷大
+        self.star_cost = np.array([np.inf] + [star_costs.get(star, np.inf) for star in range(1, MAX_STAR)] + [np.inf])
+        thresholds = city_thresholds or CITY_LEVEL_THRESHOLDS
+        self.city_levels = np.array(sorted(thresholds))
+        self.city_thresholds = np.array([thresholds[level] for level in self.city_levels])
+
+
+class PlayerArrays:
+    """一批虚拟玩家的状态，每个属性是以玩家为第一维的数组"""
+
+    def __init__(self, model, count):
+        booths = len(model.booth_names)
+        assistants = len(model.assistant_names)
+        self.gold = np.zeros(count)
+        self.total_income = np.zeros(count)
+        self.diamond = np.zeros(count)
+        self.normal_tickets = np.ones(count)
+        self.consecutive_days = np.zeros(count, dtype=np.int64)
+        self.unlocked = np.zeros(count, dtype=np.int64)
+        self.unlocked[:] = 1  # 初始解锁第一个展台
+        self.owned = np.zeros((count, assistants), dtype=bool)
+        self.level = np.ones((count, assistants))
+        self.star = np.ones((count, assistants), dtype=np.int64)
+        self.fragments = np.zeros((count, assistants), dtype=np.int64)
+        # 各展台在岗助理的下标，-1 表示空缺
+        self.assignment = np.full((count, booths), -1, dtype=np.int64)
+
+
+class Simulation:
+    """按固定步长推进一批虚拟玩家"""
+
+    def __init__(self, model, players, seed=None, step_seconds=3600, upgrade_ratio=0.5):
+        self.model = model
+        self.rng = np.random.default_rng(seed)
+        self.state = PlayerArrays(model, players)
+        self.step_seconds = step_seconds
+        self.upgrade_ratio = upgrade_ratio
+        self.elapsed = 0.0
+        # 达成各里程碑的时间（秒），未达成为无穷大
+        self.city_level_time = np.full((players, len(model.city_levels)), np.inf)
+        self.city_level_time[:, 0] = 0
+        self.booth_time = np.full((players, len(model.booth_names)), np.inf)
+        self.booth_time[:, 0] = 0
+
+    def assign(self):
+        """贪心分配：展台按基础收入从高到低，依次选择对该展台倍率最高的空闲助理"""
+        model, state = self.model, self.state
+        players = np.arange(len(state.gold))
+        multiplier = level_multiplier(state.level) * star_multiplier(state.star) * model.global_multiplier
+        free = state.owned.copy()
+        state.assignment[:] = -1
+        for booth in np.argsort(-model.base_income):
+            score = np.where(free, multiplier * model.area_multiplier[:, model.booth_area[booth]], -1.0)
+            best = np.argmax(score, axis=1)
+            ok = (score[players, best] > 0) & (booth < state.unlocked)
+            state.assignment[ok, booth] = best[ok]
+            free[players[ok], best[ok]] = False
+
+    def booth_rates(self):
+        """各展台每秒收入，公式与 IncomeEngine 相同（不含回忆卡）"""
+        model, state = self.model, self.state
+        players = np.arange(len(state.gold))[:, None]
+        working = np.zeros_like(state.owned)
+        assigned = state.assignment >= 0
+        working[np.nonzero(assigned)[0], state.assignment[assigned]] = True
+        bond = np.ones(state.owned.shape)
+        for source, target, multiplier in zip(model.bond_source, model.bond_target, model.bond_multiplier):
+            bond[:, source] *= np.where(working[:, target], multiplier, 1.0)
+        index = np.maximum(state.assignment, 0)
+        bonus = (level_multiplier(state.level[players, index]) * star_multiplier(state.star[players, index])
+                 * model.global_multiplier[index] * model.area_multiplier[index, model.booth_area] * bond[players, index])
+        city_level = model.city_levels[np.searchsorted(model.city_thresholds, state.total_income, side='right') - 1]
+        buff = city_buff(city_level)
+        return np.where(assigned, model.base_income * bonus * buff[:, None], 0.0)
+
+    def unlock_and_upgrade(self):
+        """解锁下一个展台并升级助理，返回是否有玩家解锁了展台"""
+        model, state = self.model, self.state
+        # 解锁下一个展台
+        can_unlock = state.unlocked < len(model.booth_names)
+        cost = model.unlock_cost[np.minimum(state.unlocked, len(model.booth_names) - 1)]
+        unlock = can_unlock & (state.gold >= cost)
+        state.gold[unlock] -= cost[unlock]
+        self.booth_time[unlock, state.unlocked[unlock]] = self.elapsed
+        state.unlocked[unlock] += 1
+        # 用部分金币升级等级最低的在岗助理，按等比数列求和公式一次算出可升的级数
+        players = np.arange(len(state.gold))
+        assigned = state.assignment >= 0
+        levels = np.where(assigned, state.level[players[:, None], np.maximum(state.assignment, 0)], np.inf)
+        slot = np.argmin(levels, axis=1)
+        has = assigned.any(axis=1)
+        who = state.assignment[players, slot]
+        budget = state.gold * self.upgrade_ratio
+        r = model.level_multiplier
+        current = np.where(has, levels[players, slot], 1.0)
+        next_cost = model.level_base_cost * r ** (current - 1)
+        # budget >= next_cost × (r^n - 1) / (r - 1)
+        count = np.floor(np.log1p(budget * (r - 1) / next_cost) / math.log(r))
+        count = np.where(has, np.maximum(count, 0), 0)
+        spent = next_cost * (r ** count - 1) / (r - 1)
+        state.gold -= spent
+        state.level[players[has], who[has]] += count[has]
+        return unlock.any()
+
+    def daily(self):
+        """签到领钻石，并用邀约卡和钻石在卡池中邀约"""
+        model, state = self.model, self.state
+        state.consecutive_days += 1
+        # 基础100钻石加连续签到奖励，与 daily_check_in 一致
+        rewards = np.select(
+            [state.consecutive_days >= 30, state.consecutive_days >= 14, state.consecutive_days >= 7,
+             state.consecutive_days >= 3], [600, 400, 300, 200], 100)
+        state.diamond += rewards
+        income_rate = self.booth_rates().sum(axis=1)
+        reward = GACHA_REWARDS.get(model.pool, {'gold_rate': 0, 'diamond': 0})
+        while True:
+            use_ticket = state.normal_tickets > 0 if model.pool == '普通' else np.zeros(len(state.gold), dtype=bool)
+            draw = use_ticket | (state.diamond >= model.pool_cost)
+            if not draw.any():
+                break
+            state.normal_tickets[use_ticket] -= 1
+            state.diamond[draw & ~use_ticket] -= model.pool_cost
+            state.gold[draw] += income_rate[draw] * reward['gold_rate']
+            state.diamond[draw] += reward['diamond']
+            self.draw(np.nonzero(draw)[0])
+
+    def draw(self, players):
+        """为给定玩家各抽一次：先按概率抽稀有度，再在该稀有度中等概率抽助理"""
+        model, state = self.model, self.state
+        rarity = np.searchsorted(model.rarity_cumulative, self.rng.random(len(players)), side='right')
+        rarity = np.minimum(rarity, len(model.rarity_members) - 1)
+        picked = np.empty(len(players), dtype=np.int64)
+        valid = np.zeros(len(players), dtype=bool)
+        for r, members in enumerate(model.rarity_members):
+            mask = rarity == r
+            if len(members) and mask.any():
+                picked[mask] = members[self.rng.integers(0, len(members), mask.sum())]
+                valid |= mask
+        players, picked = players[valid], picked[valid]
+        owned = state.owned[players, picked]
+        # 新助理
+        state.owned[players[~owned], picked[~owned]] = True
+        # 已拥有转为碎片，够数时自动升星
+        dup_players, dup = players[owned], picked[owned]
+        state.fragments[dup_players, dup] += 1
+        need = model.star_cost[state.star[dup_players, dup]]
+        up = state.fragments[dup_players, dup] >= need
+        state.fragments[dup_players[up], dup[up]] -= need[up].astype(np.int64)
+        state.star[dup_players[up], dup[up]] += 1
+
+    def run(self, days):
+        steps_per_day = max(1, int(round(86400 / self.step_seconds)))
+        # 助理分配在每天邀约后和有玩家解锁展台后重新计算，其余步骤沿用
+        reassign = True
+        for step in range(days * steps_per_day):
+            if step % steps_per_day == 0:
+                self.daily()
+                reassign = True
+            if reassign:
+                self.assign()
+            earned = self.booth_rates().sum(axis=1) * self.step_seconds
+            self.state.gold += earned
+            self.state.total_income += earned
+            self.elapsed += self.step_seconds
+            reassign = self.unlock_and_upgrade()
+            reached = self.state.total_income[:, None] >= self.model.city_thresholds
+            first = reached & np.isinf(self.city_level_time)
+            self.city_level_time[first] = self.elapsed
+        return self
+
+
+def simulate_chunk(args):
+    """进程池中执行的一批玩家，返回 (展会等级达成时间, 展台解锁时间)"""
+    players, days, seed, step_seconds, pool, upgrade_ratio = args
+    model = EconomyModel(load_assistant_data(), pool=pool)
+    sim = Simulation(model, players, seed=seed, step_seconds=step_seconds, upgrade_ratio=upgrade_ratio).run(days)
+    return sim.city_level_time, sim.booth_time
+
+
+def simulate(players=10000, days=30, workers=None, seed=0, step_seconds=3600, pool='普通', upgrade_ratio=0.5):
+    """把玩家分成多批，在进程池中并行模拟后合并结果"""
+    workers = workers or os.cpu_count() or 1
+    chunks = [players // workers + (1 if i < players % workers else 0) for i in range(workers)]
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    tasks = [(count, days, s, step_seconds, pool, upgrade_ratio) for count, s in zip(chunks, seeds) if count]
+    if len(tasks) == 1:
+        results = [simulate_chunk(tasks[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=len(tasks)) as executor:
+            results = list(executor.map(simulate_chunk, tasks))
+    return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
+
+
+def summarize(times, labels):
+    """各里程碑的达成比例和达成天数的 P10/P50/P90"""
+    lines = []
+    for column, label in enumerate(labels):
+        values = times[:, column]
+        done = values[np.isfinite(values)] / 86400
+        if len(done):
+            p10, p50, p90 = np.percentile(done, [10, 50, 90])
+            lines.append(f"{label:<10} 达成 {len(done) / len(values):7.2%}  P10 {p10:8.2f}天  P50 {p50:8.2f}天  P90 {p90:8.2f}天")
+        else:
+            lines.append(f"{label:<10} 达成 {0:7.2%}")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='星铁World 经济数值模拟')
+    parser.add_argument('--players', type=int, default=10000)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--workers', type=int, default=None, help='进程数，默认为CPU核数')
+    parser.add_argument('--step', type=int, default=3600, help='模拟步长（秒）')
+    parser.add_argument('--pool', choices=list(ASSISTANT_POOLS), default='普通', help='每日邀约使用的卡池')
+    parser.add_argument('--upgrade-ratio', type=float, default=0.5, help='每步用于升级助理的金币比例')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    if np is None:
+        parser.error('模拟器需要 numpy，请先执行 pip install numpy')
+
+    city_times, booth_times = simulate(args.players, args.days, args.workers, args.seed, args.step, args.pool,
+                                       args.upgrade_ratio)
+    model = EconomyModel(load_assistant_data(), pool=args.pool)
+    print(f"{args.players} 个玩家，模拟 {args.days} 天")
+    print("【展会等级】")
+    print(summarize(city_times, [f"Lv.{level}" for level in model.city_levels]))
+    print("【展台解锁】")
+    print(summarize(booth_times, model.booth_names))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,944 @@
+import copy
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from .Database import (
+    CHILD_TABLES,
+    PLAYER_COLUMNS,
+    IdleTycoonDatabase,
+    PlayerRecord,
+    PlayerVersionConflict,
+    StorageBackend,
+    assemble_players,
+    build_player_rows,
+    group_child_rows,
+    normalize_name,
+    parse_player_rows,
+    parse_player_results,
+    report_name_collisions,
+)
+from .Economy import gold_code
+
+
+def _sqlite_create_player_names(conn):
+    """名称表：规范名称为主键，已有玩家按 players.id 顺序登记，规范化后重名的只登记最早的一个"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS player_names (
+            name_key TEXT NOT NULL PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'reserved' CHECK (status IN ('reserved', 'taken')),
+            reserved_at INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_player_names_user ON player_names (user_id)")
+    players = conn.execute("SELECT user_id, name FROM players ORDER BY id").fetchall()
+    conn.executemany("INSERT OR IGNORE INTO player_names (name_key, user_id, status) VALUES (?, ?, 'taken')",
+                     [(normalize_name(name), user_id) for user_id, name in players])
+    report_name_collisions(players, dict(conn.execute("SELECT name_key, user_id FROM player_names")))
+    # 重名检查改为查询名称表；更早的插件版本在迁移2中建过 players.name 上的索引，这里删除
+    conn.execute("DROP INDEX IF EXISTS idx_players_name")
+
+
+def _sqlite_encode_gold_columns(conn):
+    """gold/total_income 由 REAL 改为 Gold 的整数编码
+
+    REAL 列会把写入的整数转换为浮点数，编码值超过 2^53 后会丢失精度，需要换成 INTEGER 列。
+    SQLite 不能修改列类型，按官方文档的做法新建表、复制并转换数据、删除旧表再改名，
+    只用到所有版本都支持的语句（不依赖 3.35 才有的 DROP COLUMN）。新库的第1步迁移
+    已经建成 INTEGER 列，这里直接跳过。编码值的大小顺序与金额一致，排行榜仍然直接按 total_income 列排序。
+    """
+    for table in ('players', 'world_ranking'):
+        column_types = {row[1]: row[2].upper() for row in conn.execute(f"PRAGMA table_info({table})")}
+        if column_types['gold'] == 'INTEGER':
+            continue
+        create_sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()[0]
+        create_sql = re.sub(r'\b(gold|total_income) REAL DEFAULT 0', r'\1 INTEGER NOT NULL DEFAULT 0', create_sql)
+        create_sql = re.sub(rf'^CREATE TABLE (IF NOT EXISTS )?"?{table}"?', f'CREATE TABLE {table}_new', create_sql)
+        # 表上的索引随旧表一起删除，改名后重新创建
+        index_sql = [sql for (sql,) in conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table,))]
+        conn.execute(create_sql)
+        cursor = conn.execute(f"SELECT * FROM {table}")
+        columns = [description[0] for description in cursor.description]
+        positions = [columns.index('gold'), columns.index('total_income')]
+        rows = []
+        for row in cursor:
+            row = list(row)
+            for position in positions:
+                row[position] = gold_code(row[position] or 0)
+            rows.append(row)
+        conn.executemany(f"INSERT INTO {table}_new ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})",
+                         rows)
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+        for sql in index_sql:
+            conn.execute(sql)
+
+
+class SQLiteDatabase(StorageBackend):
+    """单机部署使用的SQLite存储后端
+
+    数据库文件开启WAL模式，读操作不阻塞写操作；每个线程使用自己的连接，
+    没有网络往返，适合只服务少量群聊的部署。
+    """
+
+    # 写锁等待秒数
+    BUSY_TIMEOUT = 5.0
+    # 差量写入和排行榜批量写入使用 INSERT ... ON CONFLICT DO UPDATE，需要 SQLite 3.24
+    MIN_SQLITE_VERSION = (3, 24, 0)
+
+    # 表结构迁移：(版本号, 说明, 脚本或接收连接的函数)，已执行到的版本号记录在 PRAGMA user_version 中
+    MIGRATIONS = [
+        (1, '创建玩家数据表', '''
+        CREATE TABLE IF NOT EXISTS players (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL UNIQUE,
+            player_id INTEGER NOT NULL UNIQUE,
+            group_id TEXT DEFAULT NULL,
+            name TEXT NOT NULL,
+            gold INTEGER NOT NULL DEFAULT 0,
+            diamond INTEGER DEFAULT 0,
+            city_level INTEGER DEFAULT 1,
+            total_income INTEGER NOT NULL DEFAULT 0,
+            tutorial_step INTEGER DEFAULT 1,
+            ticket_normal INTEGER DEFAULT 1,
+            ticket_gold INTEGER DEFAULT 0,
+            ticket_rainbow INTEGER DEFAULT 0,
+            last_checkin_date TEXT DEFAULT NULL,
+            consecutive_checkins INTEGER DEFAULT 0,
+            memory_tickets INTEGER DEFAULT 0,
+            current_event TEXT DEFAULT NULL,
+            event_expire_time INTEGER DEFAULT 0,
+            version INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_players_total_income ON players (total_income);
+        CREATE TABLE IF NOT EXISTS player_booths (
+            user_id TEXT NOT NULL REFERENCES players(user_id) ON DELETE CASCADE,
+            booth_name TEXT NOT NULL,
+            unlocked INTEGER DEFAULT 0,
+            assistant_name TEXT DEFAULT NULL,
+            assistant_level INTEGER DEFAULT 1,
+            assistant_star INTEGER DEFAULT 1,
+            last_collect INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, booth_name)
+        );
+        CREATE TABLE IF NOT EXISTS player_assistants (
+            user_id TEXT NOT NULL REFERENCES players(user_id) ON DELETE CASCADE,
+            assistant_name TEXT NOT NULL,
+            level INTEGER DEFAULT 1,
+            star INTEGER DEFAULT 1,
+            PRIMARY KEY (user_id, assistant_name)
+        );
+        CREATE TABLE IF NOT EXISTS player_fragments (
+            user_id TEXT NOT NULL REFERENCES players(user_id) ON DELETE CASCADE,
+            assistant_name TEXT NOT NULL,
+            count INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, assistant_name)
+        );
+        CREATE TABLE IF NOT EXISTS player_memory_parts (
+            user_id TEXT NOT NULL REFERENCES players(user_id) ON DELETE CASCADE,
+            card_part_key TEXT NOT NULL,
+            count INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, card_part_key)
+        );
+        CREATE TABLE IF NOT EXISTS player_memory_cards (
+            user_id TEXT NOT NULL REFERENCES players(user_id) ON DELETE CASCADE,
+            card_name TEXT NOT NULL,
+            count INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, card_name)
+        );
+        CREATE TABLE IF NOT EXISTS world_ranking (
+            user_id TEXT NOT NULL PRIMARY KEY REFERENCES players(user_id) ON DELETE CASCADE,
+            name TEXT NOT NULL,
+            gold INTEGER NOT NULL DEFAULT 0,
+            total_income INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_world_ranking_total_income ON world_ranking (total_income DESC);
+        CREATE TABLE IF NOT EXISTS id_sequences (
+            name TEXT NOT NULL PRIMARY KEY,
+            next_value INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS player_friends (
+            user_id TEXT NOT NULL REFERENCES players(user_id) ON DELETE CASCADE,
+            friend_user_id TEXT NOT NULL REFERENCES players(user_id) ON DELETE CASCADE,
+            friend_player_id INTEGER NOT NULL,
+            status TEXT DEFAULT 'pending' CHECK (status IN ('pending', 'accepted', 'blocked')),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, friend_user_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_player_friends_friend ON player_friends (friend_user_id, status);
+        '''),
+        # 名称索引已由第3步的名称表取代，保留版本号，新库不再创建
+        (2, '补充重名检查的名称索引', ''),
+        (3, '创建名称表', _sqlite_create_player_names),
+        (4, '金额列改为整数编码', _sqlite_encode_gold_columns),
+    ]
+
+    def __init__(self, path, session_cache=None):
+        if sqlite3.sqlite_version_info < self.MIN_SQLITE_VERSION:
+            raise RuntimeError(f"SQLite存储后端需要SQLite {'.'.join(map(str, self.MIN_SQLITE_VERSION))} 及以上，"
+                               f"当前Python使用的是 {sqlite3.sqlite_version}")
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self.migrate()
+        self._init_services(session_cache)
+
+    def _connection(self):
+        """获取当前线程的连接，首次使用时创建"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # isolation_level=None：由我们显式发出 BEGIN/COMMIT
+            conn = sqlite3.connect(self.path, timeout=self.BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA foreign_keys = ON")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def migrate(self):
+        """执行尚未执行的迁移，已是最新版本时只读取一次 user_version"""
+        conn = self._connection()
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= self.MIGRATIONS[-1][0]:
+            return
+        # 重建表时删除旧表不能级联删除子表数据，迁移期间关闭外键约束（只能在事务外切换），提交前再检查
+        conn.execute("PRAGMA foreign_keys = OFF")
+        try:
+            self._run_migrations(conn)
+        finally:
+            conn.execute("PRAGMA foreign_keys = ON")
+
+    def _run_migrations(self, conn):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 拿到写锁后重新读取，其他进程可能已经执行完
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+            for version, description, script in self.MIGRATIONS:
+                if version <= current:
+                    continue
+                if callable(script):
+                    script(conn)
+                else:
+                    # executescript 会先提交当前事务，这里逐条执行以保证迁移和版本号一起提交
+                    for statement in script.split(';'):
+                        if statement.strip():
+                            conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {int(version)}")
+                print(f"数据库迁移 {version}: {description} 完成")
+            if conn.execute("PRAGMA foreign_key_check").fetchone() is not None:
+                raise RuntimeError("数据库迁移后外键检查失败")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def load_player(self, user_id, read_only=False):
+        """在同一个读快照中读取玩家主表和各子表"""
+        conn = self._connection()
+        try:
+            conn.execute("BEGIN")
+            try:
+                results = [conn.execute(
+                    f"SELECT {', '.join(PLAYER_COLUMNS)}, version FROM players WHERE user_id = ?", (user_id,)
+                ).fetchall()]
+                for table, (key_column, value_columns) in CHILD_TABLES.items():
+                    sql = f"SELECT {', '.join((key_column,) + value_columns)} FROM {table} WHERE user_id = ?"
+                    if value_columns == ('count',):
+                        sql += " AND count > 0"
+                    results.append(conn.execute(sql, (user_id,)).fetchall())
+            finally:
+                conn.execute("COMMIT")
+            return parse_player_results(results)
+        except Exception as e:
+            print(f"加载玩家数据失败: {e}")
+            return None
+
+    def save_player(self, user_id, player_data):
+        conn = self._connection()
+        start_time = time.time()
+        try:
+            # 新玩家在事务开始前分配ID：预留ID段使用独立连接，不能等待本连接持有的写锁
+            if not player_data.get('player_id'):
+                player_data['player_id'] = self.get_next_player_id()
+            # IMMEDIATE 在事务开始时就取得写锁，避免读后升级写锁时的死锁
+            conn.execute("BEGIN IMMEDIATE")
+            rows = build_player_rows(player_data)
+            changes = player_data.changes(rows) if isinstance(player_data, PlayerRecord) else None
+            if changes is None:
+                version = self._save_player_full(conn, user_id, rows)
+            else:
+                version = self._save_player_changes(conn, user_id, changes, player_data.version)
+            conn.execute("COMMIT")
+            if isinstance(player_data, PlayerRecord):
+                player_data.mark_persisted(rows)
+                player_data.version = version
+            execution_time = time.time() - start_time
+            if execution_time > 2.0:
+                print(f"警告: save_player执行时间较长: {execution_time:.2f}秒")
+            return True
+        except PlayerVersionConflict:
+            conn.execute("ROLLBACK")
+            raise
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            print(f"保存玩家数据失败: {e}")
+            return False
+
+    def _save_player_full(self, conn, user_id, rows):
+        """插入新玩家并写入所有子表记录，玩家已存在时抛出 PlayerVersionConflict，不会覆盖已有数据"""
+        player_row = rows['players']
+        columns = ('user_id',) + PLAYER_COLUMNS
+        try:
+            conn.execute(f"INSERT INTO players ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})",
+                         [user_id] + [player_row[col] for col in PLAYER_COLUMNS])
+        except sqlite3.IntegrityError:
+            if conn.execute("SELECT 1 FROM players WHERE user_id = ?", (user_id,)).fetchone() is None:
+                raise
+            raise PlayerVersionConflict(user_id)
+        for table, (key_column, value_columns) in CHILD_TABLES.items():
+            conn.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+            columns = ('user_id', key_column) + value_columns
+            conn.executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})",
+                [[user_id, key, *value] for key, value in rows[table].items()]
+            )
+        return 0
+
+    def _save_player_changes(self, conn, user_id, changes, version):
+        """差量写入，players 行按版本号比较并交换"""
+        player_changes, upserts, deletes = changes
+        if not (player_changes or upserts or deletes):
+            return version
+        assignments = [f'{col} = ?' for col in player_changes] + ['version = version + 1', 'updated_at = CURRENT_TIMESTAMP']
+        cur = conn.execute(
+            f"UPDATE players SET {', '.join(assignments)} WHERE user_id = ? AND version = ?",
+            list(player_changes.values()) + [user_id, version]
+        )
+        if cur.rowcount == 0:
+            raise PlayerVersionConflict(user_id)
+        for table, records in upserts.items():
+            key_column, value_columns = CHILD_TABLES[table]
+            columns = ('user_id', key_column) + value_columns
+            conn.executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))}) "
+                f"ON CONFLICT(user_id, {key_column}) DO UPDATE SET "
+                f"{', '.join(f'{col}=excluded.{col}' for col in value_columns)}",
+                [[user_id, key, *value] for key, value in records.items()]
+            )
+        for table, keys in deletes.items():
+            key_column = CHILD_TABLES[table][0]
+            conn.execute(
+                f"DELETE FROM {table} WHERE user_id = ? AND {key_column} IN ({', '.join(['?'] * len(keys))})",
+                [user_id] + list(keys)
+            )
+        return version + 1
+
+    def _query_world_ranking(self, limit):
+        return self._connection().execute(
+            "SELECT user_id, name, gold, total_income FROM world_ranking ORDER BY total_income DESC LIMIT ?", (limit,)
+        ).fetchall()
+
+    def _write_world_ranking_batch(self, entries):
+        conn = self._connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                '''INSERT INTO world_ranking (user_id, name, gold, total_income) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(user_id) DO UPDATE SET
+                       name=excluded.name, gold=excluded.gold, total_income=excluded.total_income,
+                       updated_at=CURRENT_TIMESTAMP''',
+                entries
+            )
+            conn.execute("COMMIT")
+            return True
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            print(f"更新世界排行榜失败: {e}")
+            return False
+
+    def _reserve_player_id_block(self, size):
+        """在独立连接的独立事务中预留一段玩家ID并立即提交
+
+        预留结果由 IdBlockAllocator 在内存中继续使用，不能随某次保存的事务一起回滚，
+        否则回滚后同一段ID会被再次预留。调用方不能持有当前线程连接上的写事务。
+        """
+        conn = sqlite3.connect(self.path, timeout=self.BUSY_TIMEOUT, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute('''INSERT OR IGNORE INTO id_sequences (name, next_value)
+                                SELECT 'player_id', COALESCE(MAX(player_id), 0) + 1 FROM players''')
+                start = conn.execute("SELECT next_value FROM id_sequences WHERE name = 'player_id'").fetchone()[0]
+                conn.execute("UPDATE id_sequences SET next_value = next_value + ? WHERE name = 'player_id'", (size,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            return int(start)
+        finally:
+            conn.close()
+
+    def iter_players(self, batch_size=500):
+        """流式读取全部玩家，sqlite3 游标本身按需取行，内存中只保留当前一批"""
+        # 使用独立连接，避免与当前线程上的其他读写共享事务
+        conn = sqlite3.connect(self.path, timeout=self.BUSY_TIMEOUT, isolation_level=None)
+        try:
+            conn.execute("BEGIN")
+            stream = conn.execute(f"SELECT user_id, {', '.join(PLAYER_COLUMNS)}, version FROM players")
+            while True:
+                player_rows = stream.fetchmany(batch_size)
+                if not player_rows:
+                    break
+                user_ids = [row[0] for row in player_rows]
+                placeholders = ', '.join(['?'] * len(user_ids))
+                child_groups = []
+                for table, (key_column, value_columns) in CHILD_TABLES.items():
+                    sql = f"SELECT user_id, {', '.join((key_column,) + value_columns)} FROM {table} WHERE user_id IN ({placeholders})"
+                    if value_columns == ('count',):
+                        sql += " AND count > 0"
+                    child_groups.append(group_child_rows(conn.execute(sql, user_ids).fetchall()))
+                yield from assemble_players(player_rows, child_groups)
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def import_player_batch(self, records):
+        """在一个事务中写入一批玩家
+
+        SQLite 没有网络往返，executemany 逐行执行即可，不需要拼接多行 INSERT。
+        """
+        rows_by_user = []
+        for user_id, player_data in records:
+            if not player_data.get('player_id'):
+                player_data['player_id'] = self.get_next_player_id()
+            rows_by_user.append((user_id, build_player_rows(player_data)))
+        if not rows_by_user:
+            return 0
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            columns = ('user_id',) + PLAYER_COLUMNS
+            conn.executemany(
+                f"INSERT INTO players ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))}) "
+                f"ON CONFLICT(user_id) DO UPDATE SET {', '.join(f'{col}=excluded.{col}' for col in PLAYER_COLUMNS)}, "
+                f"version = version + 1, updated_at = CURRENT_TIMESTAMP",
+                [[user_id] + [rows['players'][col] for col in PLAYER_COLUMNS] for user_id, rows in rows_by_user]
+            )
+            for table, (key_column, value_columns) in CHILD_TABLES.items():
+                conn.executemany(f"DELETE FROM {table} WHERE user_id = ?", [(user_id,) for user_id, _ in rows_by_user])
+                columns = ('user_id', key_column) + value_columns
+                conn.executemany(
+                    f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})",
+                    [[user_id, key, *value] for user_id, rows in rows_by_user for key, value in rows[table].items()]
+                )
+            conn.executemany(
+                '''INSERT INTO world_ranking (user_id, name, gold, total_income) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(user_id) DO UPDATE SET
+                       name=excluded.name, gold=excluded.gold, total_income=excluded.total_income''',
+                [[user_id, rows['players']['name'], rows['players']['gold'], rows['players']['total_income']]
+                 for user_id, rows in rows_by_user]
+            )
+            # 重新登记导入玩家的名称，名称已被其他玩家使用时不登记
+            conn.executemany("DELETE FROM player_names WHERE user_id = ?", [(user_id,) for user_id, _ in rows_by_user])
+            conn.executemany("INSERT OR IGNORE INTO player_names (name_key, user_id, status) VALUES (?, ?, 'taken')",
+                             [(normalize_name(rows['players']['name']), user_id) for user_id, rows in rows_by_user])
+            # 导入的玩家自带ID，ID序列需要越过其中的最大值
+            conn.execute('''INSERT INTO id_sequences (name, next_value)
+                            SELECT 'player_id', COALESCE(MAX(player_id), 0) + 1 FROM players WHERE true
+                            ON CONFLICT(name) DO UPDATE SET next_value = MAX(next_value, excluded.next_value)''')
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        for user_id, rows in rows_by_user:
+            self._remember_name_key(normalize_name(rows['players']['name']))
+        self.ranking_index.invalidate()
+        return len(rows_by_user)
+
+    def _name_key_exists(self, name_key):
+        row = self._connection().execute("SELECT 1 FROM player_names WHERE name_key = ?", (name_key,)).fetchone()
+        return row is not None
+
+    def _count_names(self):
+        return self._connection().execute("SELECT COUNT(*) FROM player_names").fetchone()[0]
+
+    def _iter_name_keys(self):
+        for (name_key,) in self._connection().execute("SELECT name_key FROM player_names"):
+            yield name_key
+
+    def _reserve_name_key(self, user_id, name_key, now):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cur = conn.execute("INSERT OR IGNORE INTO player_names (name_key, user_id, status, reserved_at) VALUES (?, ?, 'reserved', ?)",
+                               (name_key, user_id, now))
+            reserved = cur.rowcount == 1
+            if not reserved:
+                holder, status, reserved_at = conn.execute(
+                    "SELECT user_id, status, reserved_at FROM player_names WHERE name_key = ?", (name_key,)).fetchone()
+                reserved = holder == user_id
+                if not reserved and status == 'reserved' and reserved_at < now - self.NAME_RESERVATION_TTL:
+                    # 预留者可能在保存玩家之后、确认名称之前中断，其玩家已使用该名称时补记为已使用
+                    row = conn.execute("SELECT name FROM players WHERE user_id = ?", (holder,)).fetchone()
+                    if row and normalize_name(row[0]) == name_key:
+                        conn.execute("UPDATE player_names SET status = 'taken' WHERE name_key = ?", (name_key,))
+                    else:
+                        conn.execute("UPDATE player_names SET user_id = ?, reserved_at = ? WHERE name_key = ?",
+                                     (user_id, now, name_key))
+                        reserved = True
+            conn.execute("COMMIT")
+            return reserved
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _commit_name_key(self, user_id, name_key, old_key):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("UPDATE player_names SET status = 'taken' WHERE name_key = ? AND user_id = ?", (name_key, user_id))
+            if old_key:
+                conn.execute("DELETE FROM player_names WHERE name_key = ? AND user_id = ?", (old_key, user_id))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _release_name_key(self, user_id, name_key):
+        self._connection().execute("DELETE FROM player_names WHERE name_key = ? AND user_id = ? AND status = 'reserved'",
+                                   (name_key, user_id))
+
+    def get_player_id_by_user_id(self, user_id):
+        row = self._connection().execute("SELECT player_id FROM players WHERE user_id = ?", (user_id,)).fetchone()
+        return int(row[0]) if row and row[0] else None
+
+    def add_friend(self, user_id, friend_player_id):
+        """发送好友请求；对方已向自己发送过请求时直接成为好友"""
+        conn = self._connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            friend_user = conn.execute("SELECT user_id FROM players WHERE player_id = ?", (friend_player_id,)).fetchone()
+            if not friend_user:
+                conn.execute("ROLLBACK")
+                return {'success': False, 'message': '玩家ID不存在'}
+            friend_user_id = friend_user[0]
+            if friend_user_id == user_id:
+                conn.execute("ROLLBACK")
+                return {'success': False, 'message': '不能添加自己为好友'}
+            existing = conn.execute(
+                "SELECT status FROM player_friends WHERE user_id = ? AND friend_user_id = ?", (user_id, friend_user_id)
+            ).fetchone()
+            if existing:
+                conn.execute("ROLLBACK")
+                if existing[0] == 'accepted':
+                    return {'success': False, 'message': '已经是好友了'}
+                elif existing[0] == 'pending':
+                    return {'success': False, 'message': '好友请求已发送，等待对方同意'}
+                elif existing[0] == 'blocked':
+                    return {'success': False, 'message': '无法添加此玩家为好友'}
+            if self._accept_request(conn, user_id, friend_user_id, friend_player_id):
+                conn.execute("COMMIT")
+                self.friend_graph.invalidate(user_id, friend_user_id)
+                return {'success': True, 'message': '对方也向你发送过好友请求，你们已经成为好友'}
+            conn.execute(
+                "INSERT INTO player_friends (user_id, friend_user_id, friend_player_id, status) VALUES (?, ?, ?, 'pending')",
+                (user_id, friend_user_id, friend_player_id)
+            )
+            conn.execute("COMMIT")
+            return {'success': True, 'message': '好友请求已发送'}
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            print(f"添加好友失败: {e}")
+            return {'success': False, 'message': '添加好友失败'}
+
+    def _accept_request(self, conn, user_id, requester_user_id, requester_player_id):
+        cur = conn.execute(
+            '''UPDATE player_friends SET status = 'accepted', updated_at = CURRENT_TIMESTAMP
+               WHERE user_id = ? AND friend_user_id = ? AND status = 'pending' ''', (requester_user_id, user_id)
+        )
+        if cur.rowcount == 0:
+            return False
+        conn.execute(
+            '''INSERT INTO player_friends (user_id, friend_user_id, friend_player_id, status) VALUES (?, ?, ?, 'accepted')
+               ON CONFLICT(user_id, friend_user_id) DO UPDATE SET status = 'accepted' ''',
+            (user_id, requester_user_id, requester_player_id)
+        )
+        return True
+
+    def accept_friend(self, user_id, requester_player_id):
+        conn = self._connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            requester = conn.execute("SELECT user_id FROM players WHERE player_id = ?", (requester_player_id,)).fetchone()
+            if not requester or not self._accept_request(conn, user_id, requester[0], requester_player_id):
+                conn.execute("ROLLBACK")
+                return {'success': False, 'message': '没有来自该玩家的好友请求'}
+            conn.execute("COMMIT")
+            self.friend_graph.invalidate(user_id, requester[0])
+            return {'success': True, 'message': '已同意好友请求'}
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            print(f"同意好友请求失败: {e}")
+            return {'success': False, 'message': '同意好友请求失败'}
+
+    def remove_friend(self, user_id, friend_player_id):
+        conn = self._connection()
+        try:
+            friend_user = conn.execute("SELECT user_id FROM players WHERE player_id = ?", (friend_player_id,)).fetchone()
+            if not friend_user:
+                return {'success': False, 'message': '玩家ID不存在'}
+            cur = conn.execute(
+                '''DELETE FROM player_friends
+                   WHERE status = 'accepted' AND ((user_id = ? AND friend_user_id = ?) OR (user_id = ? AND friend_user_id = ?))''',
+                (user_id, friend_user[0], friend_user[0], user_id)
+            )
+            if cur.rowcount == 0:
+                return {'success': False, 'message': '你们还不是好友'}
+            self.friend_graph.invalidate(user_id, friend_user[0])
+            return {'success': True, 'message': '已删除好友'}
+        except Exception as e:
+            print(f"删除好友失败: {e}")
+            return {'success': False, 'message': '删除好友失败'}
+
+    def _query_friend_ids(self, user_id):
+        return self._connection().execute(
+            "SELECT friend_user_id, created_at FROM player_friends WHERE user_id = ? AND status = 'accepted'", (user_id,)
+        ).fetchall()
+
+    def _query_profiles(self, user_ids):
+        return self._connection().execute(
+            f'''SELECT user_id, player_id, name, city_level, total_income FROM players
+                WHERE user_id IN ({', '.join(['?'] * len(user_ids))})''', list(user_ids)
+        ).fetchall()
+
+    def get_friends(self, user_id):
+        try:
+            return self._connection().execute(
+                '''SELECT p.player_id, p.name, p.city_level, p.total_income, pf.created_at AS friend_since
+                   FROM player_friends pf
+                   JOIN players p ON pf.friend_user_id = p.user_id
+                   WHERE pf.user_id = ? AND pf.status = 'accepted'
+                   ORDER BY pf.created_at DESC''', (user_id,)
+            ).fetchall()
+        except Exception as e:
+            print(f"获取好友列表失败: {e}")
+            return []
+
+    def get_friend_requests(self, user_id):
+        try:
+            return self._connection().execute(
+                '''SELECT p.player_id, p.name, p.city_level, p.total_income, pf.created_at AS request_time
+                   FROM player_friends pf
+                   JOIN players p ON pf.user_id = p.user_id
+                   WHERE pf.friend_user_id = ? AND pf.status = 'pending'
+                   ORDER BY pf.created_at DESC''', (user_id,)
+            ).fetchall()
+        except Exception as e:
+            print(f"获取好友请求失败: {e}")
+            return []
+
+    def close(self):
+        """写回缓存数据并关闭所有线程的连接"""
+        StorageBackend.close(self)
+        with self._connections_lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            self._connections.clear()
+        self._local = threading.local()
+
+
+class MemoryDatabase(StorageBackend):
+    """纯内存存储后端，用于单元测试和基准测试
+
+    按行数据（build_player_rows 的结果）保存玩家，读写路径与数据库后端一致，
+    同样做版本号比较，进程退出后数据即丢失。
+    """
+
+    # 数据本身就在内存中，写回缓存没有意义
+    SESSION_CACHE_ENABLED = False
+
+    def __init__(self, session_cache=None):
+        self._lock = threading.RLock()
+        # user_id -> {'players': {...}, 子表名: {...}, 'version': int}
+        self._players = {}
+        self._ranking = {}
+        # (user_id, friend_user_id) -> (status, created_at)
+        self._friends = {}
+        # 规范名称 -> (user_id, 'reserved'/'taken', 预留时间)
+        self._names = {}
+        self._next_player_id = 1
+        self._init_services(session_cache)
+
+    def load_player(self, user_id, read_only=False):
+        with self._lock:
+            stored = self._players.get(user_id)
+            if stored is None:
+                return None
+            return parse_player_rows(stored, stored['version'])
+
+    def save_player(self, user_id, player_data):
+        with self._lock:
+            if not player_data.get('player_id'):
+                player_data['player_id'] = self.get_next_player_id()
+            rows = build_player_rows(player_data)
+            changes = player_data.changes(rows) if isinstance(player_data, PlayerRecord) else None
+            stored = self._players.get(user_id)
+            if changes is None and stored is not None:
+                # 没有快照的数据只能创建新玩家，不覆盖已有玩家
+                raise PlayerVersionConflict(user_id)
+            if stored is None:
+                version = 0
+                self._players[user_id] = dict(copy.deepcopy(rows), version=version)
+            else:
+                if stored['version'] != player_data.version:
+                    raise PlayerVersionConflict(user_id)
+                player_changes, upserts, deletes = changes
+                version = stored['version']
+                if player_changes or upserts or deletes:
+                    stored['players'].update(player_changes)
+                    for table, records in upserts.items():
+                        stored[table].update(records)
+                    for table, keys in deletes.items():
+                        for key in keys:
+                            stored[table].pop(key, None)
+                    version += 1
+                    stored['version'] = version
+        if isinstance(player_data, PlayerRecord):
+            player_data.mark_persisted(rows)
+            player_data.version = version
+        return True
+
+    def _query_world_ranking(self, limit):
+        with self._lock:
+            rows = [(user_id, *entry) for user_id, entry in self._ranking.items()]
+        rows.sort(key=lambda row: row[3], reverse=True)
+        return rows[:limit]
+
+    def _write_world_ranking_batch(self, entries):
+        with self._lock:
+            for user_id, name, gold, total_income in entries:
+                self._ranking[user_id] = (name, gold, total_income)
+        return True
+
+    def _reserve_player_id_block(self, size):
+        with self._lock:
+            if self._next_player_id == 1 and self._players:
+                self._next_player_id = max(stored['players']['player_id'] for stored in self._players.values()) + 1
+            start = self._next_player_id
+            self._next_player_id += size
+            return start
+
+    def iter_players(self, batch_size=500):
+        with self._lock:
+            user_ids = list(self._players)
+        for user_id in user_ids:
+            player_data = self.load_player(user_id)
+            if player_data is not None:
+                yield user_id, player_data
+
+    def import_player_batch(self, records):
+        with self._lock:
+            for user_id, player_data in records:
+                if not player_data.get('player_id'):
+                    player_data['player_id'] = self.get_next_player_id()
+                rows = build_player_rows(player_data)
+                stored = self._players.get(user_id)
+                self._players[user_id] = dict(rows, version=stored['version'] + 1 if stored else 0)
+                self._ranking[user_id] = (rows['players']['name'], rows['players']['gold'],
+                                          rows['players']['total_income'])
+                if stored:
+                    old_key = normalize_name(stored['players']['name'])
+                    if self._names.get(old_key, (None,))[0] == user_id:
+                        del self._names[old_key]
+                name_key = normalize_name(rows['players']['name'])
+                if name_key not in self._names:
+                    self._names[name_key] = (user_id, 'taken', 0)
+                    self._remember_name_key(name_key)
+                self._next_player_id = max(self._next_player_id, rows['players']['player_id'] + 1)
+        self.ranking_index.invalidate()
+        return len(records)
+
+    def _name_key_exists(self, name_key):
+        with self._lock:
+            return name_key in self._names
+
+    def _count_names(self):
+        return len(self._names)
+
+    def _iter_name_keys(self):
+        with self._lock:
+            return list(self._names)
+
+    def _reserve_name_key(self, user_id, name_key, now):
+        with self._lock:
+            entry = self._names.get(name_key)
+            if entry is None:
+                self._names[name_key] = (user_id, 'reserved', now)
+                return True
+            holder, status, reserved_at = entry
+            if holder == user_id:
+                return True
+            if status == 'reserved' and reserved_at < now - self.NAME_RESERVATION_TTL:
+                stored = self._players.get(holder)
+                if stored and normalize_name(stored['players']['name']) == name_key:
+                    self._names[name_key] = (holder, 'taken', reserved_at)
+                    return False
+                self._names[name_key] = (user_id, 'reserved', now)
+                return True
+            return False
+
+    def _commit_name_key(self, user_id, name_key, old_key):
+        with self._lock:
+            entry = self._names.get(name_key)
+            if entry and entry[0] == user_id:
+                self._names[name_key] = (user_id, 'taken', entry[2])
+            if old_key and self._names.get(old_key, (None,))[0] == user_id:
+                del self._names[old_key]
+
+    def _release_name_key(self, user_id, name_key):
+        with self._lock:
+            entry = self._names.get(name_key)
+            if entry and entry[0] == user_id and entry[1] == 'reserved':
+                del self._names[name_key]
+
+    def get_player_id_by_user_id(self, user_id):
+        with self._lock:
+            stored = self._players.get(user_id)
+            return stored['players']['player_id'] if stored else None
+
+    def _user_id_by_player_id(self, player_id):
+        for user_id, stored in self._players.items():
+            if stored['players']['player_id'] == player_id:
+                return user_id
+        return None
+
+    def add_friend(self, user_id, friend_player_id):
+        with self._lock:
+            friend_user_id = self._user_id_by_player_id(friend_player_id)
+            if friend_user_id is None:
+                return {'success': False, 'message': '玩家ID不存在'}
+            if friend_user_id == user_id:
+                return {'success': False, 'message': '不能添加自己为好友'}
+            existing = self._friends.get((user_id, friend_user_id))
+            if existing:
+                if existing[0] == 'accepted':
+                    return {'success': False, 'message': '已经是好友了'}
+                elif existing[0] == 'pending':
+                    return {'success': False, 'message': '好友请求已发送，等待对方同意'}
+                elif existing[0] == 'blocked':
+                    return {'success': False, 'message': '无法添加此玩家为好友'}
+            if self._accept_request(user_id, friend_user_id):
+                return {'success': True, 'message': '对方也向你发送过好友请求，你们已经成为好友'}
+            self._friends[(user_id, friend_user_id)] = ('pending', time.strftime('%Y-%m-%d %H:%M:%S'))
+            return {'success': True, 'message': '好友请求已发送'}
+
+    def _accept_request(self, user_id, requester_user_id):
+        request = self._friends.get((requester_user_id, user_id))
+        if not request or request[0] != 'pending':
+            return False
+        now = time.strftime('%Y-%m-%d %H:%M:%S')
+        self._friends[(requester_user_id, user_id)] = ('accepted', request[1])
+        self._friends[(user_id, requester_user_id)] = ('accepted', now)
+        self.friend_graph.invalidate(user_id, requester_user_id)
+        return True
+
+    def accept_friend(self, user_id, requester_player_id):
+        with self._lock:
+            requester_user_id = self._user_id_by_player_id(requester_player_id)
+            if requester_user_id is None or not self._accept_request(user_id, requester_user_id):
+                return {'success': False, 'message': '没有来自该玩家的好友请求'}
+            return {'success': True, 'message': '已同意好友请求'}
+
+    def remove_friend(self, user_id, friend_player_id):
+        with self._lock:
+            friend_user_id = self._user_id_by_player_id(friend_player_id)
+            if friend_user_id is None:
+                return {'success': False, 'message': '玩家ID不存在'}
+            removed = False
+            for key in ((user_id, friend_user_id), (friend_user_id, user_id)):
+                if self._friends.get(key, (None,))[0] == 'accepted':
+                    del self._friends[key]
+                    removed = True
+            if not removed:
+                return {'success': False, 'message': '你们还不是好友'}
+            self.friend_graph.invalidate(user_id, friend_user_id)
+            return {'success': True, 'message': '已删除好友'}
+
+    def _query_friend_ids(self, user_id):
+        with self._lock:
+            return [(to_user, created_at) for (from_user, to_user), (status, created_at) in self._friends.items()
+                    if from_user == user_id and status == 'accepted']
+
+    def _query_profiles(self, user_ids):
+        with self._lock:
+            rows = []
+            for user_id in user_ids:
+                stored = self._players.get(user_id)
+                if stored:
+                    player_row = stored['players']
+                    rows.append((user_id, player_row['player_id'], player_row['name'], player_row['city_level'],
+                                 player_row['total_income']))
+            return rows
+
+    def _friend_rows(self, user_id, status, incoming):
+        rows = []
+        for (from_user, to_user), (friend_status, created_at) in self._friends.items():
+            if friend_status != status or (to_user if incoming else from_user) != user_id:
+                continue
+            other = self._players.get(from_user if incoming else to_user)
+            if other:
+                player_row = other['players']
+                rows.append((player_row['player_id'], player_row['name'], player_row['city_level'],
+                             player_row['total_income'], created_at))
+        rows.sort(key=lambda row: row[4], reverse=True)
+        return rows
+
+    def get_friends(self, user_id):
+        with self._lock:
+            return self._friend_rows(user_id, 'accepted', incoming=False)
+
+    def get_friend_requests(self, user_id):
+        with self._lock:
+            return self._friend_rows(user_id, 'pending', incoming=True)
+
+
+def create_backend(config):
+    """根据配置创建存储后端
+
+    :param config: db_config.json 的内容，backend 取 mysql / sqlite / memory
+    """
+    config = config or {}
+    backend = config.get('backend', 'mysql')
+    # 写回缓存配置作为构造参数传给实例，不修改后端类的默认值
+    cache_config = dict(config.get('session_cache', {}))
+    if backend == 'mysql':
+        IdleTycoonDatabase.configure(config.get('mysql', {}))
+        return IdleTycoonDatabase.get_instance(cache_config)
+    if backend == 'sqlite':
+        return SQLiteDatabase(config.get('sqlite', {}).get('path', 'data/plugins/astrbot_plugin_srwolrd/world.db'),
+                              cache_config)
+    if backend == 'memory':
+        # 数据本身就在内存中，配置文件不能为内存后端开启写回缓存
+        cache_config.pop('enabled', None)
+        return MemoryDatabase(cache_config)
+    raise ValueError(f"未知的存储后端: {backend}")
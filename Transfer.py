@@ -0,0 +1,166 @@
+"""玩家数据批量导出/导入
+
+导出文件为 JSON Lines，每行一个玩家 {"user_id": ..., "player": {...}}，
+文件名以 .gz 结尾时使用 gzip 压缩。导出和导入都按批流式处理，内存占用与玩家总数无关。
+导入时每批玩家在一个事务中批量写入，多个工作线程并行处理不同的批次；
+也可以导入旧版本按玩家保存的 save/user_<id>.json 文件。
+
+在 AstrBot 根目录下执行，执行前先停用插件（导入会覆盖已有玩家的数据）：
+    python -m data.plugins.astrbot_plugin_srwolrd.Transfer export players.jsonl.gz
+    python -m data.plugins.astrbot_plugin_srwolrd.Transfer import players.jsonl.gz --workers 4
+    python -m data.plugins.astrbot_plugin_srwolrd.Transfer import-legacy data/plugins/astrbot_plugin_srwolrd/save
+
+MySQL 后端切换存储布局（mysql.storage_mode）后，用 convert 改写存量玩家：
+    python -m data.plugins.astrbot_plugin_srwolrd.Transfer convert --to document
+导入总是写入子表布局，文档模式下导入后再执行一次 convert --to document。
+"""
+import argparse
+import gzip
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .Storage import SQLiteDatabase, create_backend
+
+# 旧版本按玩家保存的存档文件名
+LEGACY_SAVE_PATTERN = re.compile(r'^user_(.+)\.json$')
+
+
+def open_stream(path, mode):
+    """按扩展名打开普通或gzip压缩的文本文件"""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def export_players(database, path, batch_size=500):
+    """将全部玩家导出为 JSON Lines 文件，返回导出的玩家数"""
+    count = 0
+    with open_stream(path, 'w') as f:
+        for user_id, player_data in database.iter_players(batch_size):
+            # 金额（Gold）导出为普通数值，与旧版存档格式一致
+            f.write(json.dumps({'user_id': user_id, 'player': player_data}, ensure_ascii=False, default=float))
+            f.write('\n')
+            count += 1
+    return count
+
+
+def read_export(path):
+    """逐行读取导出文件，返回 (user_id, 玩家数据) 的生成器"""
+    with open_stream(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield record['user_id'], record['player']
+
+
+def read_legacy_saves(directory):
+    """逐个读取旧版本的 save/user_<id>.json 存档"""
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            match = LEGACY_SAVE_PATTERN.match(entry.name)
+            if not match or not entry.is_file():
+                continue
+            try:
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    player_data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"跳过无法读取的存档 {entry.name}: {e}")
+                continue
+            if isinstance(player_data, dict) and player_data.get('name'):
+                yield match.group(1), player_data
+
+
+def import_players(database, records, batch_size=1000, workers=4):
+    """按批并行导入玩家数据
+
+    主线程读取并分批，工作线程各自在一个事务中写入一批；同时在途的批次数有上限，
+    读取速度快于写入时主线程会等待，内存占用保持在 workers * 2 批以内。
+    :return: (导入成功的玩家数, 失败的玩家数)
+    """
+    if isinstance(database, SQLiteDatabase):
+        # SQLite 同一时刻只有一个写事务，多线程只会互相等待写锁
+        workers = 1
+    slots = threading.BoundedSemaphore(workers * 2)
+    totals = {'imported': 0, 'failed': 0}
+    totals_lock = threading.Lock()
+
+    def write_batch(batch):
+        try:
+            written = database.import_player_batch(batch)
+            with totals_lock:
+                totals['imported'] += written
+        except Exception as e:
+            print(f"导入一批玩家失败（{len(batch)}个，首个user_id={batch[0][0]}）: {e}")
+            with totals_lock:
+                totals['failed'] += len(batch)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='player_import') as executor:
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                slots.acquire()
+                executor.submit(write_batch, batch)
+                batch = []
+        if batch:
+            slots.acquire()
+            executor.submit(write_batch, batch)
+    return totals['imported'], totals['failed']
+
+
+def load_db_config(path=None):
+    path = path or os.path.join(os.path.dirname(__file__), 'db_config.json')
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f) or {}
+    return {'backend': 'mysql'}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='星铁World 玩家数据批量导出/导入')
+    parser.add_argument('--config', help='存储后端配置文件，默认为插件目录下的 db_config.json')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='导出全部玩家')
+    export_parser.add_argument('path', help='输出文件，.gz 结尾时压缩')
+    export_parser.add_argument('--batch-size', type=int, default=500)
+
+    for name, help_text in (('import', '导入 export 生成的文件'), ('import-legacy', '导入旧版本的 save/user_<id>.json 存档目录')):
+        import_parser = subparsers.add_parser(name, help=help_text)
+        import_parser.add_argument('path')
+        import_parser.add_argument('--batch-size', type=int, default=1000)
+        import_parser.add_argument('--workers', type=int, default=4)
+
+    convert_parser = subparsers.add_parser('convert', help='在子表布局和文档布局之间改写全部玩家（仅MySQL）')
+    convert_parser.add_argument('--to', dest='target', choices=('tables', 'document'), required=True)
+    convert_parser.add_argument('--batch-size', type=int, default=500)
+
+    args = parser.parse_args(argv)
+    config = load_db_config(args.config)
+    # 离线工具直接读写数据库，不需要写回缓存
+    config.setdefault('session_cache', {})['enabled'] = False
+    database = create_backend(config)
+    try:
+        if args.command == 'export':
+            count = export_players(database, args.path, args.batch_size)
+            print(f"已导出 {count} 个玩家到 {args.path}")
+        elif args.command == 'convert':
+            if not hasattr(database, 'convert_layout'):
+                parser.error('当前存储后端不支持文档布局')
+            count = database.convert_layout(args.target, args.batch_size)
+            print(f"已将 {count} 个玩家改写为 {args.target} 布局")
+        else:
+            records = read_export(args.path) if args.command == 'import' else read_legacy_saves(args.path)
+            imported, failed = import_players(database, records, args.batch_size, args.workers)
+            print(f"已导入 {imported} 个玩家，失败 {failed} 个")
+    finally:
+        database.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""玩家数据加载耗时对比
+
+对比逐表加载（旧路径：players + 5张子表各取一次连接）与单次往返加载
+（IdleTycoonDatabase.load_player）的耗时。需要可用的MySQL，连接参数取自
+db_config.json 的 mysql 段（与插件相同，未配置的项使用 IdleTycoonDatabase 的默认值），
+测试时不启用写回缓存，保存和加载都直接访问数据库。
+
+用法（在插件目录下执行）：
+    python benchmarks/bench_load_player.py --iterations 500
+    python benchmarks/bench_load_player.py --user-id 123456 --iterations 500
+    python benchmarks/bench_load_player.py --config /path/to/db_config.json
+"""
+import argparse
+import importlib
+import os
+import statistics
+import sys
+import time
+
+# Database 通过相对导入引用 Economy，需要把插件目录作为包导入
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(PLUGIN_DIR))
+IdleTycoonDatabase = importlib.import_module(f'{os.path.basename(PLUGIN_DIR)}.Database').IdleTycoonDatabase
+load_db_config = importlib.import_module(f'{os.path.basename(PLUGIN_DIR)}.Transfer').load_db_config
+
+
+def load_player_per_table(db, user_id):
+    """旧的加载方式：主表和每张子表分别取连接查询"""
+    with db.cursor() as cur:
+        cur.execute("SELECT * FROM players WHERE user_id = %s", (user_id,))
+        if not cur.fetchone():
+            return None
+    return {
+        'booths': db.load_player_booths(user_id),
+        'assistants': db.load_player_assistants(user_id),
+        'fragments': db.load_player_fragments(user_id),
+        'memory_parts': db.load_player_memory_parts(user_id),
+        'memory_cards': db.load_player_memory_cards(user_id),
+    }
+
+
+def create_bench_player(db, user_id):
+    """创建一个数据量接近后期玩家的测试账号"""
+    booth_names = ['咖啡馆', '便利店', '服装店', '电玩城', 'KTV', '电影院', '书店', '培训班', '科技馆']
+    assistants = [{'name': f'测试助理{i}', 'level': 50 + i, 'star': 1 + i % 4} for i in range(25)]
+    player = {
+        'name': f'bench_{user_id}',
+        'gold': 1e15,
+        'total_income': 1e16,
+        'booths': {
+            name: {'unlocked': True, 'assistant': assistants[i], 'last_collect': int(time.time())}
+            for i, name in enumerate(booth_names)
+        },
+        'assistants': assistants,
+        'fragments': {a['name']: 5 for a in assistants},
+        'memory_parts': {f'测试回忆{i}_{part}': 1 for i in range(20) for part in 'ABC'},
+        'memory_cards': {f'测试回忆{i}': 2 for i in range(20)},
+    }
+    if not db.save_player(user_id, player):
+        raise RuntimeError('创建测试玩家失败')
+
+
+def measure(func, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        'mean': statistics.mean(timings),
+        'p50': timings[len(timings) // 2],
+        'p95': timings[int(len(timings) * 0.95) - 1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='玩家数据加载耗时对比')
+    parser.add_argument('--user-id', help='使用已有玩家，不指定时创建临时测试玩家')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--config', help='存储后端配置文件，默认为插件目录下的 db_config.json')
+    args = parser.parse_args()
+
+    IdleTycoonDatabase.configure(load_db_config(args.config).get('mysql', {}))
+    db = IdleTycoonDatabase.get_instance({'enabled': False})
+    user_id = args.user_id or f'bench_{int(time.time())}'
+    created = not args.user_id
+    if created:
+        create_bench_player(db, user_id)
+
+    try:
+        # 预热连接池
+        for _ in range(10):
+            load_player_per_table(db, user_id)
+            db.load_player(user_id)
+
+        results = {
+            '逐表加载': measure(lambda: load_player_per_table(db, user_id), args.iterations),
+            '单次往返加载': measure(lambda: db.load_player(user_id), args.iterations),
+        }
+        for name, stats in results.items():
+            print(f"{name}: 平均 {stats['mean']:.2f}ms  p50 {stats['p50']:.2f}ms  p95 {stats['p95']:.2f}ms")
+        speedup = results['逐表加载']['mean'] / results['单次往返加载']['mean']
+        print(f"平均耗时降低为原来的 1/{speedup:.1f}")
+    finally:
+        if created:
+            with db.cursor() as cur:
+                cur.execute("DELETE FROM players WHERE user_id = %s", (user_id,))
+                cur.connection.commit()
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
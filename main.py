@@ -1,9 +1,38 @@
 import time
 import random
+import functools
 from astrbot.api.event import filter, AstrMessageEvent, MessageEventResult
 from astrbot.api.star import Context, Star, register
 from astrbot.api import logger
 
+# 保存时遇到版本冲突后重新执行指令的最大次数
+CONFLICT_RETRIES = 3
+
+
+def retry_on_conflict(handler):
+    """指令处理器装饰器：保存玩家数据发生版本冲突时，重新加载数据并重新执行整条指令
+
+    指令产生的回复先缓存起来，只有最终成功执行的那一次才会发送。
+    """
+    @functools.wraps(handler)
+    async def wrapper(self, event: AstrMessageEvent, *args, **kwargs):
+        from .Database import PlayerVersionConflict
+        for attempt in range(CONFLICT_RETRIES):
+            results = []
+            try:
+                async for result in handler(self, event, *args, **kwargs):
+                    results.append(result)
+            except PlayerVersionConflict as e:
+                logger.info(f"{e}，重新执行指令 (第{attempt + 1}次)")
+                continue
+            for result in results:
+                yield result
+            return
+        yield event.make_result().message("操作过于频繁，请稍后再试")
+
+    return wrapper
+
+
 @register("world", "ZY霆生", "星铁World", "1.0.0")
 class MyPlugin(Star):
     @filter.regex("^创建展会(.*)$")
@@ -15,7 +44,7 @@ class MyPlugin(Star):
             os.makedirs(self.savePath, 0o755, True)
 
         # 检查是否已创建过展会
-        player = self.load_player(event)
+        player = await self.load_player(event)
         if player:
             yield event.make_result().message(f"你已经创建过展会：{player['name']} 了。")
             return
@@ -41,14 +70,40 @@ class MyPlugin(Star):
             yield event.make_result().message("展会名称不能包含特殊字符，请重新输入")
             return
 
-        # 检查重名
-        if self.check_name_exists(name):
+        # 检查重名（布隆过滤器判定未使用的名称不查询数据库）
+        if await self.check_name_exists(name):
+            yield event.make_result().message(f"展会名称「{name}」已被占用，请更换另一个名字")
+            return
+
+        # 预留名称，同时创建同名展会时只有一方能预留成功
+        user_id = event.get_sender_id()
+        reserved = await self.reserve_name(user_id, name)
+        if reserved is None:
+            yield event.make_result().message("创建展会失败，请稍后再试")
+            return
+        if not reserved:
             yield event.make_result().message(f"展会名称「{name}」已被占用，请更换另一个名字")
             return
 
         # 创建展会
-        player = self.get_default_player(name)
-        self.save_player(event, player)
+        from .Database import PlayerVersionConflict
+        try:
+            player_id = await self.generate_player_id()
+            player = self.get_default_player(name, player_id)
+            saved = await self.save_player(event, player, immediate=True)
+        except PlayerVersionConflict:
+            # 新玩家只插入不覆盖：重复发送的创建指令，或读取玩家数据失败时误判为未创建
+            await self.release_name(user_id, name)
+            yield event.make_result().message("你已经创建过展会了。")
+            return
+        except BaseException:
+            await self.release_name(user_id, name)
+            raise
+        if not saved:
+            await self.release_name(user_id, name)
+            yield event.make_result().message("创建展会失败，请稍后再试")
+            return
+        await self.commit_name(user_id, name)
         yield event.make_result().message(
             f"展会创建成功！欢迎你，{name}。\n你已拥有第一个展台：咖啡馆。\n\n【新手引导】\n1️⃣ 首先，使用'普通邀约'来获得你的第一个助理\n2️⃣ 然后，使用'分配助理 助理名 咖啡馆'将助理分配到展区\n3️⃣ 最后，使用'一键收取'来获取收益\n\n如需帮助请输入'展会指令'查看指令。"
         )
@@ -64,56 +119,42 @@ class MyPlugin(Star):
         self.savePath = "data/plugins/astrbot_plugin_srwolrd/save" # 保存路径
         self.worldPath = "data/plugins/astrbot_plugin_srwolrd/world.json" # 世界路径
         self.database = None
-        self.booths = {
-            '咖啡馆': {'area': '消费展区', 'unlock_cost': '10K', 'base_income': '1K', 'unlocked': False},
-            '便利店': {'area': '消费展区', 'unlock_cost': '100K', 'base_income': '5K', 'unlocked': False},
-            '服装店': {'area': '消费展区', 'unlock_cost': '1M', 'base_income': '20K', 'unlocked': False},
-            '电玩城': {'area': '趣味展区', 'unlock_cost': '10M', 'base_income': '100K', 'unlocked': False},
-            'KTV': {'area': '趣味展区', 'unlock_cost': '100M', 'base_income': '500K', 'unlocked': False},
-            '电影院': {'area': '趣味展区', 'unlock_cost': '1G', 'base_income': '2M', 'unlocked': False},
-            '书店': {'area': '纪念展区', 'unlock_cost': '10G', 'base_income': '10M', 'unlocked': False},
-            '培训班': {'area': '纪念展区', 'unlock_cost': '100G', 'base_income': '50M', 'unlocked': False},
-            '科技馆': {'area': '纪念展区', 'unlock_cost': '1AA', 'base_income': '200M', 'unlocked': False},
-        }
-        self.assistant_pool = {
-            '普通': {'cost': 100, 'rates': {'见习': 0.8, '熟练': 0.18, '资深': 0.02}},
-            '黄金': {'cost': 300, 'rates': {'见习': 0.5, '熟练': 0.4, '资深': 0.1}},
-            '炫彩': {'cost': 500, 'rates': {'见习': 0.2, '熟练': 0.5, '资深': 0.3}},
-        }
-        self.star_upgrade_cost = {
-            1: 3,  # 1星升2星需要3个碎片
-            2: 10, # 2星升3星需要10个碎片
-            3: 20, # 3星升4星需要20个碎片
-        }
-        self.level_upgrade_base_cost = 1000  # 初始升级费用
-        self.level_upgrade_multiplier = 1.13  # 每级升级费用倍率
-        self.units = ['', 'K', 'M', 'G', 'AA', 'BB', 'CC', 'DD', 'EE', 'FF', 'GG', 'HH', 'II', 'JJ', 'KK', 'LL', 'MM', 'NN', 'OO', 'PP', 'QQ', 'RR', 'SS', 'TT', 'UU', 'VV', 'WW', 'XX', 'YY', 'ZZ']
-        self.all_assistant_data_cache = None
+        self.async_database = None
+        # 数值配置定义在 Economy.py，离线模拟器使用同一份
+        import copy
+        from .Economy import (
+            ASSISTANT_POOLS, LEVEL_UPGRADE_BASE_COST, LEVEL_UPGRADE_MULTIPLIER, STAR_UPGRADE_COST, UNITS
+        )
+        self.assistant_pool = copy.deepcopy(ASSISTANT_POOLS)
+        self.star_upgrade_cost = dict(STAR_UPGRADE_COST)  # 当前星级 -> 升星所需碎片
+        self.level_upgrade_base_cost = LEVEL_UPGRADE_BASE_COST  # 初始升级费用
+        self.level_upgrade_multiplier = LEVEL_UPGRADE_MULTIPLIER  # 每级升级费用倍率
+        self.units = list(UNITS)
+        # 静态游戏数据目录（助理、回忆卡、星海轶闻、展台），在 initialize 中加载
+        self.catalog = None
+        self.catalog_checked_at = 0.0
+        self.catalog_check_interval = 10.0  # 检查数据文件是否被修改的间隔（秒）
         self.banned_words_cache = None
         self.api_config_cache = None
+        self.db_config_cache = None
         self.api_result_cache = {}
         self.is_initialized = False  # 标记插件是否已初始化
         self.random = random  # 添加random引用
 
     def get_database(self):
         if self.database is None:
-            from .Database import IdleTycoonDatabase
-            self.database = IdleTycoonDatabase.get_instance()
-            # 确保数据库表已创建（备用机制）
-            try:
-                # 测试一个基础查询，如果失败说明表不存在
-                with self.database.cursor() as cur:
-                    cur.execute("SELECT COUNT(*) FROM players LIMIT 1")
-            except Exception as e:
-                # 如果查询失败，尝试创建表
-                try:
-                    print("检测到数据库表不存在，正在创建...")
-                    self.database.create_tables()
-                    print("数据库表创建完成")
-                except Exception as create_error:
-                    print(f"创建数据库表失败: {create_error}")
+            from .Storage import create_backend
+            # 存储后端由 db_config.json 的 backend 选择：mysql / sqlite / memory
+            self.database = create_backend(self.load_db_config())
         return self.database
 
+    async def get_async_database(self):
+        """获取异步数据库访问层，阻塞的数据库调用在独立线程池中执行"""
+        if self.async_database is None:
+            from .Database import AsyncIdleTycoonDatabase
+            self.async_database = AsyncIdleTycoonDatabase(self.get_database)
+        return self.async_database
+
     def load_banned_words(self):
         if self.banned_words_cache is None:
             import os
@@ -159,6 +200,20 @@ class MyPlugin(Star):
                 }
         return self.api_config_cache
         
+    def load_db_config(self):
+        if self.db_config_cache is None:
+            import os
+            import json
+            config_file = os.path.join(os.path.dirname(__file__), 'db_config.json')
+            if os.path.exists(config_file):
+                with open(config_file, 'r', encoding='utf-8') as f:
+                    config_data = json.load(f)
+                    self.db_config_cache = config_data if config_data else {}
+            else:
+                # 默认使用MySQL，连接参数取 IdleTycoonDatabase 中的默认值
+                self.db_config_cache = {'backend': 'mysql'}
+        return self.db_config_cache
+
     def check_banned_words_api(self, text):
         """使用API检测违禁词"""
         import time
@@ -263,37 +318,69 @@ class MyPlugin(Star):
         
         return False
         
-    def check_name_exists(self, name):
+    async def check_name_exists(self, name):
         """检查展会名称是否已存在"""
         try:
-            db = self.get_database()
-            with db.cursor() as cursor:
-                cursor.execute('SELECT COUNT(*) FROM players WHERE name = %s', (name,))
-                count = cursor.fetchone()[0]
-                
-                return count > 0
+            db = await self.get_async_database()
+            return await db.check_name_exists(name)
         except Exception as e:
             logger.info(f"检查名称重复失败: {str(e)}")
             return False
-            # 如果数据库查询失败，降级到文件检查
-            # return self.check_name_exists_in_files(name)
 
-    def save_player(self, event: AstrMessageEvent, player_data):
-        """保存玩家数据到数据库（优化版本）"""
+    async def reserve_name(self, user_id, name):
+        """原子地预留展会名称，名称已被占用时返回False，数据库出错时返回None"""
+        try:
+            db = await self.get_async_database()
+            return await db.reserve_name(user_id, name)
+        except Exception as e:
+            logger.error(f"预留名称失败: {str(e)}")
+            return None
+
+    async def commit_name(self, user_id, name, old_name=None):
+        """玩家数据保存成功后确认名称，改名时释放旧名称"""
         try:
-            db = self.get_database()
-            # 使用带重试机制的保存方法，提高并发环境下的成功率
-            return db.save_player_with_retry(event.get_sender_id(), player_data)
+            db = await self.get_async_database()
+            await db.commit_name(user_id, name, old_name)
+        except Exception as e:
+            logger.error(f"确认名称失败: {str(e)}")
+
+    async def release_name(self, user_id, name):
+        """玩家数据未保存时释放预留的名称"""
+        try:
+            db = await self.get_async_database()
+            await db.release_name(user_id, name)
+        except Exception as e:
+            logger.error(f"释放名称失败: {str(e)}")
+
+    async def save_player(self, event: AstrMessageEvent, player_data, immediate=False):
+        """保存玩家数据到数据库（优化版本）
+
+        :param immediate: 为True时等待数据写入数据库后才返回，用于创建展会、改名等
+                          保存成功后还要确认名称表的操作
+        """
+        from .Database import PlayerVersionConflict
+        try:
+            db = await self.get_async_database()
+            if immediate:
+                return await db.save_player_now(event.get_sender_id(), player_data)
+            # 已有玩家写入写回缓存，由后台合并写库；新玩家带重试立即落库
+            return await db.save_player(event.get_sender_id(), player_data)
+        except PlayerVersionConflict:
+            # 交给 retry_on_conflict 重新执行指令
+            raise
         except Exception as e:
             logger.info(f"保存玩家数据失败: {str(e)}")
             return False
             
-    def load_player(self, event: AstrMessageEvent):
-        """加载玩家数据"""
+    async def load_player(self, event: AstrMessageEvent, read_only=False):
+        """加载玩家数据
+
+        :param read_only: 指令只查看数据、不保存时传True，可由只读副本提供数据
+        """
         try:
-            db = self.get_database()
+            db = await self.get_async_database()
             user_id = event.get_sender_id()
-            return db.load_player(user_id)
+            return await db.load_player(user_id, read_only)
         except Exception as e:
             logger.info(f"加载玩家数据失败: {str(e)}")
             return None
@@ -302,79 +389,62 @@ class MyPlugin(Star):
         """获取消息发送者所属的save文件夹路径"""
         return self.savePath + f"/user_{event.get_sender_id()}.json"
 
-    def load_world(self):
+    async def load_world(self):
         """加载排行数据"""
         try:
-            db = self.get_database()
-            return db.load_world_ranking()
+            db = await self.get_async_database()
+            return await db.load_world_ranking()
         except Exception as e:
             logger.info(f"加载排行数据失败: {str(e)}")
             return []
 
-    def update_world_ranking(self, user_id, name, gold, totalIncome):
+    async def update_world_ranking(self, user_id, name, gold, totalIncome):
         """更新世界排行数据"""
         try:
-            db = self.get_database()
-            return db.update_world_ranking(user_id, name, gold, totalIncome)
+            db = await self.get_async_database()
+            return await db.update_world_ranking(user_id, name, gold, totalIncome)
         except Exception as e:
             logger.info(f"更新排行数据失败: {str(e)}")
             return False
             
     def format_gold(self, num):
-        """格式化金币数量，将数字转换为带单位的字符串"""
-        num = float(num)
-        unit = 0
-        while num >= 1000 and unit < len(self.units) - 1:
-            num /= 1000
-            unit += 1
-        return str(int(num)) + self.units[unit]
+        """格式化金币数量（Gold 或普通数值），转换为带单位的字符串"""
+        from .Economy import Gold
+        return Gold.coerce(num).format()
         
     def parse_gold(self, gold_str):
         """解析带单位的金币字符串，转换为数字"""
-        # 更宽松的正则匹配，允许前后空格和小写字母
-        import re
-        match = re.match(r'^\s*([0-9.]+)\s*([A-Za-z]*)\s*$', gold_str)
-        if match:
-            num = float(match.group(1))
-            unit_str = match.group(2).upper()
-            
-            if unit_str in self.units:
-                unit = self.units.index(unit_str)
-            else:
-                # 如果单位不存在但字符串不为空，记录警告
-                if unit_str:
-                    logger.info(f"[IdleTycoon] Unknown unit: {unit_str} in gold string: {gold_str}")
-                unit = 0
-                
-            result = num * (1000 ** unit)
-            return result
-            
-        return 0
+        from .Economy import AMOUNT_PATTERN, UNIT_POWERS, parse_amount
+        match = AMOUNT_PATTERN.match(gold_str)
+        if match and match.group(2) and match.group(2).upper() not in UNIT_POWERS:
+            logger.info(f"[IdleTycoon] Unknown unit: {match.group(2)} in gold string: {gold_str}")
+        return parse_amount(gold_str)
+
+    async def generate_player_id(self):
+        """生成新的玩家ID"""
+        try:
+            db = await self.get_async_database()
+            return await db.get_next_player_id()
+        except Exception as e:
+            logger.error(f"生成玩家ID失败: {e}")
+            # 如果数据库不可用，使用时间戳作为临时ID
+            return int(time.time()) % 1000000
 
-    def get_default_player(self, name):
+    def get_default_player(self, name, player_id=None):
         """
         获取默认玩家数据
         :param name: 玩家名称
+        :param player_id: 玩家ID，由generate_player_id生成
         :return: 包含默认玩家数据的字典
         """
         booths = {}
-        for booth, info in self.booths.items():
+        for booth in self.get_catalog().booths:
             booths[booth] = {
                 'unlocked': booth == '咖啡馆',
                 'assistant': None,
                 'last_collect': int(time.time())
             }
         
-        # 生成新的玩家ID
-        player_id = None
-        try:
-            db = self.get_database()
-            player_id = db.get_next_player_id()
-        except Exception as e:
-            logger.error(f"生成玩家ID失败: {e}")
-            # 如果数据库不可用，使用时间戳作为临时ID
-            player_id = int(time.time()) % 1000000
-        
         return {
             'name': name,
             'player_id': player_id,
@@ -403,247 +473,137 @@ class MyPlugin(Star):
             'event_expire_time': 0  # 事件过期时间
         }
         
-    def load_all_assistant_data(self):
-        """加载所有助理数据"""
-        if self.all_assistant_data_cache is None:
-            import os
-            import json
-            file_path = os.path.join(os.path.dirname(__file__), '[星铁Wolrd]助理名单.json')
-            if os.path.exists(file_path):
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        self.all_assistant_data_cache = json.load(f)
-                        if self.all_assistant_data_cache is None:  # JSON 解析错误
-                            self.all_assistant_data_cache = []
-                            logger.error(f"助理名单JSON解析错误: {file_path}")
-                except Exception as e:
-                    self.all_assistant_data_cache = []
-                    logger.error(f"加载助理名单失败: {str(e)}")
-            else:
-                self.all_assistant_data_cache = []  # 文件不存在
-                logger.error(f"助理名单文件不存在: {file_path}")
-        return self.all_assistant_data_cache
-
-    def load_memory_card_data(self):
-        """加载回忆卡数据"""
-        if not hasattr(self, '_memory_card_data'):
-            import os
-            import json
-            file_path = os.path.join(os.path.dirname(__file__), '[星铁Wolrd]回忆卡.json')
-            if os.path.exists(file_path):
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        self._memory_card_data = json.load(f)
-                        if self._memory_card_data is None:
-                            self._memory_card_data = {}
-                except Exception as e:
-                    self._memory_card_data = {}
-                    logger.error(f"加载回忆卡数据失败: {str(e)}")
-            else:
-                self._memory_card_data = {}
-                logger.error(f"回忆卡文件不存在: {file_path}")
-        return self._memory_card_data
+    def get_catalog(self):
+        """获取静态游戏数据目录
 
-    def load_star_sea_anecdotes(self):
-        """加载星海轶闻数据"""
-        if not hasattr(self, '_star_sea_anecdotes'):
-            import os
-            import json
-            file_path = os.path.join(os.path.dirname(__file__), '[星铁Wolrd]星海轶闻.json')
-            if os.path.exists(file_path):
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        self._star_sea_anecdotes = json.load(f)
-                        if self._star_sea_anecdotes is None:
-                            self._star_sea_anecdotes = []
-                except Exception as e:
-                    self._star_sea_anecdotes = []
-                    logger.error(f"加载星海轶闻数据失败: {str(e)}")
-            else:
-                self._star_sea_anecdotes = []
-                logger.error(f"星海轶闻文件不存在: {file_path}")
-        return self._star_sea_anecdotes
+        每隔 catalog_check_interval 秒检查一次数据文件，被修改过时重新加载，不需要重启。
+        :return: Catalog（按名称、稀有度、展区索引的只读记录，以及编译后的收入规则）
+        """
+        if self.catalog is None:
+            self.reload_catalog()
+        elif time.monotonic() - self.catalog_checked_at >= self.catalog_check_interval:
+            self.catalog_checked_at = time.monotonic()
+            if self.catalog.sources_changed():
+                self.reload_catalog()
+        return self.catalog
+
+    def reload_catalog(self):
+        """重新读取数据文件并替换目录，内容与缓存一致时直接使用缓存的编译结果"""
+        import os
+        from .Catalog import load_catalog
+        from .Economy import BOOTHS
+        catalog = load_catalog(os.path.dirname(__file__), BOOTHS, self.assistant_pool)
+        for problem in catalog.problems:
+            logger.warning(f"[IdleTycoon] {problem}")
+        if self.catalog is not None and catalog.digest != self.catalog.digest:
+            logger.info("[IdleTycoon] 静态数据已重新加载")
+        self.catalog = catalog
+        self.catalog_checked_at = time.monotonic()
+        return catalog
+
+    def get_trait_engine(self):
+        """获取按助理名称索引、特质已编译的助理数据"""
+        return self.get_catalog().trait_engine
 
     def get_assistant_static_details(self, assistant_name):
         """
-        根据助理名称获取助理的详细信息
+        根据助理名称获取助理的静态数据
         :param assistant_name: 助理名称
-        :return: 包含助理详细信息的字典，如果未找到则返回None
+        :return: AssistantRecord（name、rarity、bond、traits），如果未找到则返回None
         """
-        all_data = self.load_all_assistant_data()
-        for data in all_data:
-            if data['name'] == assistant_name:
-                return data
-        return None
+        return self.get_catalog().assistants_by_name.get(assistant_name)
+
+    def get_memory_card_table(self):
+        """获取按名称索引、集齐效果已编译的回忆卡数据"""
+        return self.get_catalog().memory_card_table
+
+    def get_player_derived(self, player):
+        """玩家数据上缓存的推导结果（PlayerRecord.derived），普通字典返回None
+
+        推导结果依赖静态数据，静态数据重新加载后全部作废。
+        """
+        derived = getattr(player, 'derived', None)
+        if derived is not None:
+            digest = self.get_catalog().digest
+            if derived.get('catalog') != digest:
+                derived.clear()
+                derived['catalog'] = digest
+        return derived
 
     def get_memory_card_bonus(self, player):
         """
         计算回忆卡的区域加成
         :param player: 玩家数据字典
-        :return: 包含各区域加成倍率的字典
+        :return: 包含各区域加成倍率的字典（all、各展区、event）
         """
-        # 初始化所有可能的区域加成（基础值为0%，即1.0倍率）
-        bonus = {
-            'all': 0.0,           # 所有展台加成百分比
-            '消费展区': 0.0,       # 消费展区加成百分比
-            '趣味展区': 0.0,       # 趣味展区加成百分比
-            '纪念展区': 0.0,       # 纪念展区加成百分比
-            'event': 0.0          # 展会事件加成百分比
-        }
+        # 结果缓存在玩家数据上，回忆卡变化时由 invalidate_memory_card_bonus 清除
+        derived = self.get_player_derived(player)
+        if derived is not None and 'memory_card_bonus' in derived:
+            return derived['memory_card_bonus']
+        bonus = self.get_memory_card_table().bonus(player.get('memory_cards'))
+        if derived is not None:
+            derived['memory_card_bonus'] = bonus
+        return bonus
 
-        # 加载回忆卡数据以获取每张卡的效果
-        memory_card_data = self.load_memory_card_data()
-        if not memory_card_data:
-            # 如果没有回忆卡数据，返回基础倍率
-            return {
-                'all': 1.0,
-                '消费展区': 1.0,
-                '趣味展区': 1.0,
-                '纪念展区': 1.0,
-                'event': 1.0
-            }
+    def invalidate_memory_card_bonus(self, player):
+        """玩家的完整回忆卡变化后清除缓存的回忆卡加成"""
+        derived = getattr(player, 'derived', None)
+        if derived is not None:
+            derived.pop('memory_card_bonus', None)
 
-        # 遍历玩家拥有的每张回忆卡，累加效果
-        if 'memory_cards' in player and player['memory_cards']:
-            for card_name, card_count in player['memory_cards'].items():
-                # 查找该回忆卡的效果
-                card_effect = None
-                for card_data in memory_card_data:
-                    if card_data['名称'] == card_name:
-                        card_effect = card_data['集齐效果']
-                        break
-
-                if card_effect:
-                    # 解析效果并累加，每张卡的效果独立计算
-                    for _ in range(card_count):
-                        if '所有展台的收入增加' in card_effect:
-                            percent = float(card_effect.replace('所有展台的收入增加', '').replace('%', ''))
-                            bonus['all'] += percent
-                        elif '消费展区的收入增加' in card_effect:
-                            percent = float(card_effect.replace('消费展区的收入增加', '').replace('%', ''))
-                            bonus['消费展区'] += percent
-                        elif '趣味展区的收入增加' in card_effect:
-                            percent = float(card_effect.replace('趣味展区的收入增加', '').replace('%', ''))
-                            bonus['趣味展区'] += percent
-                        elif '纪念展区的收入增加' in card_effect:
-                            percent = float(card_effect.replace('纪念展区的收入增加', '').replace('%', ''))
-                            bonus['纪念展区'] += percent
-                        elif '所有展会事件' in card_effect and '收入增加' in card_effect:
-                            percent = float(card_effect.replace('所有展会事件（帕姆快送、来宾事件、特别来宾）的收入增加', '').replace('%', ''))
-                            bonus['event'] += percent
-
-        # 将百分比转换为倍率（例如：100% -> 2.0倍，200% -> 3.0倍）
-        return {
-            'all': 1.0 + bonus['all'] / 100,
-            '消费展区': 1.0 + bonus['消费展区'] / 100,
-            '趣味展区': 1.0 + bonus['趣味展区'] / 100,
-            '纪念展区': 1.0 + bonus['纪念展区'] / 100,
-            'event': 1.0 + bonus['event'] / 100
-        }
+    def get_income_engine(self):
+        """获取统一的展台收入公式，展台基础收入已在目录中解析为数值"""
+        return self.get_catalog().income_engine
+
+    def get_income_snapshot(self, player):
+        """获取玩家当前的收入速率快照
+
+        快照缓存在玩家数据上，展台、助理、回忆卡和展会等级都没有变化时直接复用。
+        :return: IncomeSnapshot（booth_rates、total_rate、event_multiplier）
+        """
+        from .Economy import income_fingerprint
+        city_level = self.get_city_level(player['total_income'])
+        fingerprint = income_fingerprint(player, city_level)
+        derived = self.get_player_derived(player)
+        snapshot = derived.get('income_snapshot') if derived is not None else None
+        if snapshot is not None and snapshot.fingerprint == fingerprint:
+            return snapshot
+        snapshot = self.get_income_engine().snapshot(
+            player, city_level, self.get_city_buff(city_level), self.get_memory_card_bonus(player), fingerprint
+        )
+        if derived is not None:
+            derived['income_snapshot'] = snapshot
+        return snapshot
 
-    def calculate_assistant_bonus(self, assistant_in_booth, current_booth_name, all_player_booths):
+    def calculate_assistant_bonus(self, assistant_in_booth, current_booth_name, all_player_booths, working=None):
         """
         计算助理的加成效果
         :param assistant_in_booth: 展台中的助理数据
         :param current_booth_name: 当前展台名称
         :param all_player_booths: 所有玩家展台数据（字典格式：{booth_name: booth_data}）
+        :param working: 在岗助理名称集合，逐个展台计算时由调用方用 working_assistants 预先算好
         :return: 加成倍率
         """
-        bonus = 1.0
-
-        assistant_static_info = self.get_assistant_static_details(assistant_in_booth['name'])
-
-        if assistant_static_info:
-            level = assistant_in_booth.get('level', 1)
-            star = assistant_in_booth.get('star', 1)
-
-            # 计算等级加成
-            bonus *= (1 + (level - 1) * 1.0)
-
-            # 计算星级加成
-            bonus *= (1 + (star - 1) * 2.0)
-
-            # 计算特质加成
-            for trait in assistant_static_info['traits']:
-                # 检查是否是羁绊效果（包含"收入增加"的特质）
-                import re
-                if re.match(r'(.+)收入增加(\d+)%', trait):
-                    matches = re.match(r'(.+)收入增加(\d+)%', trait)
-                    target_name = matches.group(1)
-                    increase_percent = float(matches.group(2))
-
-                    # 检查目标助理是否在展台中工作
-                    target_found = False
-                    # all_player_booths 是一个字典，需要遍历其值
-                    if isinstance(all_player_booths, dict):
-                        for booth_name, booth_data in all_player_booths.items():
-                            if booth_data.get('unlocked') and booth_data.get('assistant') and booth_data['assistant'].get('name') == target_name:
-                                target_found = True
-                                break
-                    else:
-                        # 如果是列表格式（向后兼容）
-                        for booth_data in all_player_booths:
-                            if booth_data.get('unlocked') and booth_data.get('assistant') and booth_data['assistant'].get('name') == target_name:
-                                target_found = True
-                                break
-                    # 如果目标助理在工作，应用加成
-                    if target_found:
-                        bonus *= (1 + increase_percent / 100)
-                # 检查是否是区域加成
-                elif re.match(r'(.+)展区收入增加(\d+)%', trait):
-                    matches = re.match(r'(.+)展区收入增加(\d+)%', trait)
-                    trait_area_name = matches.group(1)
-                    increase_percent = float(matches.group(2))
-                    current_booth_actual_area = self.booths[current_booth_name]['area']
-                    if current_booth_actual_area == trait_area_name + "展区":
-                        bonus *= (1 + increase_percent / 100)
-                # 检查是否是全局加成
-                elif re.match(r'所有展台收入增加(\d+)%', trait):
-                    matches = re.match(r'所有展台收入增加(\d+)%', trait)
-                    increase_percent = float(matches.group(1))
-                    bonus *= (1 + increase_percent / 100)
-
-        return bonus
+        if working is None:
+            from .Economy import working_assistants
+            working = working_assistants(all_player_booths)
+        area = self.get_catalog().booths[current_booth_name].area
+        return self.get_trait_engine().assistant_bonus(assistant_in_booth, area, working)
 
     def get_city_level(self, total_income):
         """计算城市等级"""
-        thresholds = {
-            1: 0,
-            2: 1e12,
-            3: 1e13,
-            4: 1e14,
-            5: 1e15,
-            6: 1e16,
-            7: 1e17,
-            8: 1e18,
-            9: 1e19,
-            10: 1e20,
-        }
-        level = 1
-        for lv, need in thresholds.items():
-            if total_income >= need:
-                level = lv
-        return level
+        from .Economy import city_level_for
+        return city_level_for(total_income)
 
     def get_city_buff(self, level):
         """计算城市加成"""
-        return 1 + (level - 1) * 1.0
+        from .Economy import city_buff
+        return city_buff(level)
 
     def get_city_level_threshold(self, level):
         """获取城市等级阈值"""
-        thresholds = {
-            1: 0,
-            2: 1e12,
-            3: 1e13,
-            4: 1e14,
-            5: 1e15,
-            6: 1e16,
-            7: 1e17,
-            8: 1e18,
-            9: 1e19,
-            10: 1e20,
-        }
-        return thresholds.get(level, 1e14)
+        from .Economy import CITY_LEVEL_THRESHOLDS
+        return CITY_LEVEL_THRESHOLDS.get(level, 1e14)
 
     def calculate_reward_multiplier(self, selected_option, selected_branch):
         """计算奖励倍率"""
@@ -674,21 +634,8 @@ class MyPlugin(Star):
 
     def give_event_reward(self, player, reward_level, reward_multiplier=1.0):
         """根据奖励等级发放奖励"""
-        # 计算当前收入速率（用于B和A级奖励）
-        current_income_rate = 0
-        city_level = self.get_city_level(player['total_income'])
-        buff = self.get_city_buff(city_level)
-        memory_card_bonus = self.get_memory_card_bonus(player)
-
-        for booth_name, booth_info in player['booths'].items():
-            if booth_info['unlocked'] and booth_info['assistant']:
-                booth_base = self.booths[booth_name]['base_income']
-                assistant = booth_info['assistant']
-                assistant_bonus = self.calculate_assistant_bonus(assistant, booth_name, player['booths'])
-                booth_area = self.booths[booth_name]['area']
-                area_bonus = memory_card_bonus.get(booth_area, 1.0)
-                booth_income = self.parse_gold(booth_base) * buff * assistant_bonus * memory_card_bonus['all'] * area_bonus
-                current_income_rate += booth_income
+        # 当前收入速率（用于B和A级奖励）
+        current_income_rate = self.get_income_snapshot(player).total_rate
 
         reward_text = "未知奖励"
         if reward_level == 'B':
@@ -728,160 +675,166 @@ class MyPlugin(Star):
 
         return reward_text
 
-    @filter.regex("^(普通|黄金|炫彩)邀约$")
+    def draw_assistants(self, player, type_name, count, income_rate):
+        """
+        在内存中连续邀约 count 次：发放额外奖励、抽取助理，重复的助理转为碎片并自动升星
+        :param income_rate: 当前总收入速率，用于计算金币奖励
+        :return: 每次邀约的结果字典列表
+        """
+        from .Economy import GACHA_REWARDS
+        pool = self.get_catalog().gacha_pools[type_name]
+        reward_config = GACHA_REWARDS[type_name]
+        gold_reward = int(income_rate * reward_config['gold_rate'])
+        diamond_reward = reward_config['diamond']
+        # 按名称索引已拥有的助理，每次抽取不再扫描助理列表
+        owned = {assistant['name']: assistant for assistant in player['assistants']}
+
+        results = []
+        for _ in range(count):
+            player['gold'] += gold_reward
+            player['diamond'] += diamond_reward
+            rarity, assistant = pool.draw()
+            result = {'gold': gold_reward, 'diamond': diamond_reward, 'rarity': rarity,
+                      'name': assistant.name if assistant else None, 'new': False, 'star': None}
+            results.append(result)
+            if assistant is None:
+                continue
+
+            owned_assistant = owned.get(assistant.name)
+            if owned_assistant is None:
+                owned_assistant = {'name': assistant.name, 'level': 1, 'star': 1}
+                player['assistants'].append(owned_assistant)
+                owned[assistant.name] = owned_assistant
+                result['new'] = True
+                continue
+
+            # 转换为碎片，够数时自动升星
+            fragments = player['fragments'].get(assistant.name, 0) + 1
+            current_star = owned_assistant['star']
+            needed_fragments = self.star_upgrade_cost.get(current_star) if current_star < 4 else None
+            if needed_fragments is not None and fragments >= needed_fragments:
+                fragments -= needed_fragments
+                owned_assistant['star'] += 1
+                result['star'] = owned_assistant['star']
+            player['fragments'][assistant.name] = fragments
+            result['fragments'] = fragments
+            result['needed'] = needed_fragments
+        return results
+
+    @filter.regex("^(普通|黄金|炫彩)邀约(十连)?$")
+    @retry_on_conflict
     async def gacha_assistant(self, event: AstrMessageEvent):
-        """助理邀约系统"""
+        """助理邀约系统，十连模式一次完成10次邀约"""
         # 检查玩家是否存在
-        player = self.load_player(event)
+        player = await self.load_player(event)
         if not player:
             yield event.make_result().message("请先使用\"创建展会+名字\"创建展会")
             return
             
         # 匹配邀约类型
         import re
-        match = re.match(r'^(普通|黄金|炫彩)邀约$', event.message_str)
+        match = re.match(r'^(普通|黄金|炫彩)邀约(十连)?$', event.message_str)
         if not match:
-            yield event.make_result().message("格式错误，请使用：普通邀约/黄金邀约/炫彩邀约")
+            yield event.make_result().message("格式错误，请使用：普通邀约/黄金邀约/炫彩邀约，十连请在后面加上'十连'")
             return
             
+        from .Economy import MULTI_PULL_COUNT
         type_name = match.group(1)
+        multi_pull = bool(match.group(2))
         pool = self.assistant_pool[type_name]
         
-        gacha_count = 1  # 默认抽卡次数
-        used_tickets_this_gacha = 0
-        
-        # 检查是否有邀约卡，并确定抽卡次数
-        if player['tickets'][type_name] > 0:
-            gacha_count = min(player['tickets'][type_name], 3)  # 最多使用3张卡
+        # 确定抽卡次数：单抽最多使用3张邀约卡，没有卡时消耗钻石抽一次；
+        # 十连先用邀约卡，不足的次数用钻石补齐
+        tickets = player['tickets'][type_name]
+        if multi_pull:
+            gacha_count = MULTI_PULL_COUNT
+            used_tickets_this_gacha = min(tickets, gacha_count)
         else:
-            # 检查钻石是否足够
-            if player['diamond'] < pool['cost']:
-                yield event.make_result().message(f"钻石不足，需要{pool['cost']}钻石\n当前钻石：{player['diamond']}")
-                return
-            player['diamond'] -= pool['cost']
+            gacha_count = min(tickets, 3) if tickets > 0 else 1
+            used_tickets_this_gacha = gacha_count if tickets > 0 else 0
+        diamond_cost = (gacha_count - used_tickets_this_gacha) * pool['cost']
+        if player['diamond'] < diamond_cost:
+            yield event.make_result().message(
+                f"钻石不足，需要{diamond_cost}钻石"
+                + (f"（已有{used_tickets_this_gacha}张{type_name}邀约卡）" if used_tickets_this_gacha else "")
+                + f"\n当前钻石：{player['diamond']}"
+            )
+            return
             
-        # 加载所有助理的基础数据
-        assistant_data = self.load_all_assistant_data()
-        if not assistant_data:
+        # 助理静态数据（卡池的别名表在加载目录时已建好）
+        catalog = self.get_catalog()
+        if not catalog.assistants:
             yield event.make_result().message("助理数据加载失败，请稍后重试")
             return
-            
-        results = []  # 用于存储每次抽卡的结果
-        
-        # 计算当前总收入速率，用于邀约奖励
-        current_income_rate = 0
-        city_level_for_rate = self.get_city_level(player['total_income'])
-        buff_for_rate = self.get_city_buff(city_level_for_rate)
-        
-        for booth_name, booth_info in player['booths'].items():
-            if booth_info['unlocked'] and booth_info['assistant']:
-                booth_base = self.parse_gold(self.booths[booth_name]['base_income'])
-                assistant = booth_info['assistant']
-                assistant_bonus = self.calculate_assistant_bonus(assistant, booth_name, player['booths'])
-                current_income_rate += booth_base * buff_for_rate * assistant_bonus
-                
-        gacha_rewards_config = {
-            '普通': {'gold_rate': 0.001, 'diamond': 5},  # 0.1% 金币 + 5 钻石
-            '黄金': {'gold_rate': 0.005, 'diamond': 10},  # 0.5% 金币 + 10 钻石
-            '炫彩': {'gold_rate': 0.01, 'diamond': 30},   # 1% 金币 + 30 钻石
-        }
+
+        player['tickets'][type_name] -= used_tickets_this_gacha
+        player['diamond'] -= diamond_cost
+        tutorial_started = player['tutorial_step'] == 1 and not player['assistants']
         
-        for i in range(gacha_count):
-            current_gacha_result = ""
-            # 如果是使用邀约卡，则扣除
-            if player['tickets'][type_name] > 0:
-                player['tickets'][type_name] -= 1
-                used_tickets_this_gacha += 1
-            elif i > 0:  # 如果第一抽不是用卡（说明是用钻石），后续不再继续（因为钻石只够一次）
-                break
-                
-            # 发放邀约奖励
-            reward_config = gacha_rewards_config[type_name]
-            gold_reward = int(current_income_rate * reward_config['gold_rate'])
-            diamond_reward = reward_config['diamond']
-            
-            player['gold'] += gold_reward
-            player['diamond'] += diamond_reward
-            
-            current_gacha_result += f"✨ 额外奖励：获得 {self.format_gold(gold_reward)} 金币，{diamond_reward} 钻石！\n"
-            
-            # 抽卡：先抽等级 (稀有度)
-            import random
-            rand = random.random()
-            acc = 0
-            assistant_rarity = '见习'  # 默认稀有度
-            
-            for k, v in pool['rates'].items():
-                acc += v
-                if rand <= acc:
-                    assistant_rarity = k
-                    break
-                    
-            # 根据等级筛选助理
-            available_assistants = [a for a in assistant_data if a['level'] == assistant_rarity]
-            
-            if not available_assistants:
-                current_gacha_result += f"第 {i + 1} 次邀约：没有找到符合条件的助理。"
-                results.append(current_gacha_result)
-                continue
-                
-            # 随机选择一个助理
-            assistant = random.choice(available_assistants)
-            
-            # 检查是否已拥有该助理
-            owned_assistant = None
-            owned_assistant_index = -1
-            
-            for idx, pa in enumerate(player['assistants']):
-                if pa['name'] == assistant['name']:
-                    owned_assistant = pa
-                    owned_assistant_index = idx
-                    break
-                    
-            if owned_assistant:
-                # 转换为碎片
-                if assistant['name'] not in player['fragments']:
-                    player['fragments'][assistant['name']] = 0
-                player['fragments'][assistant['name']] += 1
-                
-                current_gacha_result += f"获得助理碎片：【{assistant['name']}】x1 (当前拥有 {player['fragments'][assistant['name']]} 个)"
-                
-                # 检查是否可以升星
-                current_star = player['assistants'][owned_assistant_index]['star']
-                if current_star < 4 and current_star in self.star_upgrade_cost:
-                    needed_fragments = self.star_upgrade_cost[current_star]
-                    if player['fragments'][assistant['name']] >= needed_fragments:
-                        # 自动升星
-                        player['fragments'][assistant['name']] -= needed_fragments
-                        player['assistants'][owned_assistant_index]['star'] += 1
-                        current_gacha_result += f"\n  🎉 恭喜！【{assistant['name']}】升到 {player['assistants'][owned_assistant_index]['star']} 星！(剩余碎片 {player['fragments'][assistant['name']]})"
-                    else:
-                        current_gacha_result += f" (距离升星还需 {needed_fragments - player['fragments'][assistant['name']]} 个)"
-            else:
-                # 新助理
-                player['assistants'].append({
-                    'name': assistant['name'],
-                    'level': 1,  # 初始等级为1
-                    'star': 1    # 初始星级为1
-                })
-                current_gacha_result += f"🎉 恭喜获得新助理：【{assistant['name']}】({assistant_rarity})！"
-                
-                # 更新新手引导步骤 (只在第一次获得助理时触发)
-                if player['tutorial_step'] == 1 and len(player['assistants']) == 1:
-                    player['tutorial_step'] = 2
-                    current_gacha_result += f"\n\n【新手引导】\n2️⃣ 现在使用'分配助理 {assistant['name']} 咖啡馆'将助理分配到展区"
-                else:
-                    current_gacha_result += "\n  请使用'分配助理'命令将其分配到展区。"
-                    
-            results.append(current_gacha_result)
-            
-        reply_msg = f"✨ {type_name}邀约结果 ✨\n"
+        # 当前总收入速率，用于邀约奖励
+        current_income_rate = self.get_income_snapshot(player).total_rate
+        draws = self.draw_assistants(player, type_name, gacha_count, current_income_rate)
+
+        # 更新新手引导步骤 (只在第一次获得助理时触发)
+        first_assistant = None
+        if tutorial_started and player['assistants']:
+            player['tutorial_step'] = 2
+            first_assistant = player['assistants'][0]['name']
+        tutorial_text = f"【新手引导】\n2️⃣ 现在使用'分配助理 {first_assistant} 咖啡馆'将助理分配到展区"
+
+        reply_msg = f"✨ {type_name}邀约{'十连' if multi_pull else ''}结果 ✨\n"
+        consumed = []
         if used_tickets_this_gacha > 0:
-            reply_msg += f"本次消耗 {used_tickets_this_gacha} 张{type_name}邀约卡。\n"
-        else:
-            reply_msg += f"本次消耗 {pool['cost']} 钻石。\n"
+            consumed.append(f"{used_tickets_this_gacha} 张{type_name}邀约卡")
+        if diamond_cost > 0:
+            consumed.append(f"{diamond_cost} 钻石")
+        reply_msg += f"本次消耗 {'、'.join(consumed)}。\n"
         reply_msg += "--------------------\n"
-        reply_msg += "\n--------------------\n".join(results)
+
+        if multi_pull:
+            lines = []
+            for i, draw in enumerate(draws, 1):
+                if draw['name'] is None:
+                    lines.append(f"{i}. 没有找到符合条件的助理")
+                elif draw['new']:
+                    lines.append(f"{i}. 🎉 新助理【{draw['name']}】({draw['rarity']})")
+                elif draw['star']:
+                    lines.append(f"{i}. 【{draw['name']}】碎片x1，升到 {draw['star']} 星！")
+                else:
+                    lines.append(f"{i}. 【{draw['name']}】碎片x1")
+            reply_msg += "\n".join(lines)
+            total_gold = sum(draw['gold'] for draw in draws)
+            total_diamond = sum(draw['diamond'] for draw in draws)
+            new_names = [draw['name'] for draw in draws if draw['new']]
+            reply_msg += f"\n--------------------\n✨ 额外奖励：共获得 {self.format_gold(total_gold)} 金币，{total_diamond} 钻石！"
+            if new_names:
+                reply_msg += f"\n新助理：{'、'.join(new_names)}"
+            if first_assistant:
+                reply_msg += f"\n\n{tutorial_text}"
+            elif new_names:
+                reply_msg += "\n请使用'分配助理'命令将新助理分配到展区。"
+        else:
+            results = []
+            for i, draw in enumerate(draws, 1):
+                current_gacha_result = f"✨ 额外奖励：获得 {self.format_gold(draw['gold'])} 金币，{draw['diamond']} 钻石！\n"
+                name = draw['name']
+                if name is None:
+                    current_gacha_result += f"第 {i} 次邀约：没有找到符合条件的助理。"
+                elif draw['new']:
+                    current_gacha_result += f"🎉 恭喜获得新助理：【{name}】({draw['rarity']})！"
+                    if name == first_assistant:
+                        current_gacha_result += f"\n\n{tutorial_text}"
+                    else:
+                        current_gacha_result += "\n  请使用'分配助理'命令将其分配到展区。"
+                elif draw['star']:
+                    current_gacha_result += f"获得助理碎片：【{name}】x1 (当前拥有 {draw['fragments'] + draw['needed']} 个)"
+                    current_gacha_result += f"\n  🎉 恭喜！【{name}】升到 {draw['star']} 星！(剩余碎片 {draw['fragments']})"
+                else:
+                    current_gacha_result += f"获得助理碎片：【{name}】x1 (当前拥有 {draw['fragments']} 个)"
+                    if draw['needed'] is not None:
+                        current_gacha_result += f" (距离升星还需 {draw['needed'] - draw['fragments']} 个)"
+                results.append(current_gacha_result)
+            reply_msg += "\n--------------------\n".join(results)
         
         # 显示剩余资源
         reply_msg += "\n\n【剩余资源】\n"
@@ -890,50 +843,30 @@ class MyPlugin(Star):
         for ticket_type, count in player['tickets'].items():
             reply_msg += f"- {ticket_type}邀约卡：{count}张\n"
             
-        self.save_player(event, player)
+        await self.save_player(event, player)
         yield event.make_result().message(reply_msg)
         
     @filter.regex("^一键收取$")
+    @retry_on_conflict
     async def collect_all(self, event: AstrMessageEvent):
         """一键收取所有展台收益"""
         # 检查玩家是否存在
-        player = self.load_player(event)
+        player = await self.load_player(event)
         if not player:
             yield event.make_result().message("请先使用\"创建展会+名字\"创建展会")
             return
             
         now = int(time.time())
         income = 0
-        city_level = self.get_city_level(player['total_income'])
-        buff = self.get_city_buff(city_level)
-        
-        # 计算回忆卡加成
-        memory_card_bonus = self.get_memory_card_bonus(player)
+        rates = self.get_income_snapshot(player)
         
-        for booth_name, info in player['booths'].items():
-            if not info['unlocked'] or not info['assistant']:
-                continue
-                
-            seconds = now - info['last_collect']
-            booth_base = self.parse_gold(self.booths[booth_name]['base_income'])
-            assistant = info['assistant']
-            
-            # 计算基础收入
-            base_income = seconds * booth_base * buff
-            
-            # 计算助理加成
-            assistant_bonus = self.calculate_assistant_bonus(assistant, booth_name, player['booths'])
-            
-            # 应用回忆卡加成（确保即使加成缺失也不影响总收入）
-            area = self.booths[booth_name]['area']
-            area_bonus = memory_card_bonus.get(area, 1.0)
-            booth_income = base_income * assistant_bonus * memory_card_bonus['all'] * area_bonus
-            
-            income += booth_income
+        for booth_name, rate in rates.booth_rates.items():
+            info = player['booths'][booth_name]
+            income += (now - info['last_collect']) * rate
             info['last_collect'] = now
             
         # 应用展会事件加成
-        final_income = income * memory_card_bonus.get('event', 1.0)
+        final_income = income * rates.event_multiplier
         player['gold'] += final_income
         player['total_income'] += final_income
         
@@ -953,13 +886,13 @@ class MyPlugin(Star):
             tutorial_msg = ''
             
         # 先保存玩家数据，确保players表中有记录
-        save_result = self.save_player(event, player)
+        save_result = await self.save_player(event, player)
         if not save_result:
             print(f"警告: 用户 {event.get_sender_id()} 数据保存失败，跳过排行榜更新")
         else:
             # 保存成功后更新世界排行榜
             user_id = event.get_sender_id()
-            ranking_updated = self.update_world_ranking(user_id, player['name'], player['gold'], player['total_income'])
+            ranking_updated = await self.update_world_ranking(user_id, player['name'], player['gold'], player['total_income'])
             if not ranking_updated:
                 print(f"警告: 用户 {user_id} ({player['name']}) 的排行榜更新失败")
         
@@ -972,18 +905,20 @@ class MyPlugin(Star):
         if player['current_event'] and now > player['event_expire_time']:
             player['current_event'] = None
             player['event_expire_time'] = 0
-            self.save_player(event, player)
+            await self.save_player(event, player)
             
         # 如果没有当前事件，有10%概率触发新事件
         if not player['current_event'] and (now % 10) < 1:  # 简单的10%概率实现
-            event_data = self.load_star_sea_anecdotes()
-            if event_data and '星海轶闻' in event_data and event_data['星海轶闻']:
+            anecdotes = self.get_catalog().anecdotes
+            if anecdotes:
+                import copy
                 import random
-                random_event = random.choice(event_data['星海轶闻'])
+                # 目录中的事件是共享的，玩家数据中保存副本
+                random_event = copy.deepcopy(random.choice(anecdotes))
                 player['current_event'] = random_event
                 player['event_expire_time'] = now + 3600  # 事件1小时后过期
                 event_triggered = True
-                self.save_player(event, player)
+                await self.save_player(event, player)
                 
         # 如果触发了事件或有当前事件，显示提示
         if event_triggered:
@@ -998,10 +933,11 @@ class MyPlugin(Star):
         yield event.stop_event()
 
     @filter.regex("^解锁(.*)$")
+    @retry_on_conflict
     async def unlock_booth(self, event: AstrMessageEvent):
         """解锁展台"""
         # 检查玩家是否存在
-        player = self.load_player(event)
+        player = await self.load_player(event)
         if not player:
             yield event.make_result().message("请先使用\"创建展会+名字\"创建展会")
             return
@@ -1016,7 +952,8 @@ class MyPlugin(Star):
         booth_name = match.group(1).strip()
         
         # 检查展台是否存在
-        if booth_name not in self.booths:
+        booth_record = self.get_catalog().booths.get(booth_name)
+        if booth_record is None:
             yield event.make_result().message("没有这个展台")
             return
             
@@ -1026,7 +963,7 @@ class MyPlugin(Star):
             return
             
         # 计算解锁费用
-        cost = self.parse_gold(self.booths[booth_name]['unlock_cost'])
+        cost = booth_record.unlock_cost
         
         # 检查金币是否足够
         if player['gold'] < cost:
@@ -1038,48 +975,31 @@ class MyPlugin(Star):
         player['booths'][booth_name]['unlocked'] = True
         
         # 保存玩家数据
-        self.save_player(event, player)
+        await self.save_player(event, player)
         
         yield event.make_result().message(f"成功解锁展台：{booth_name}！\n请分配助理到该展台以获得收益。")
 
     @filter.regex("^展会信息$")
+    @retry_on_conflict
     async def show_info(self, event: AstrMessageEvent):
         """显示展会信息"""
         # 检查玩家是否存在
-        player = self.load_player(event)
+        player = await self.load_player(event)
         if not player:
             yield event.make_result().message("请先使用\"创建展会+名字\"创建展会")
             return
             
         now = time.time()
-        income_rate = 0
-        city_level = self.get_city_level(player['total_income'])
+        rates = self.get_income_snapshot(player)
+        city_level = rates.city_level
         buff = self.get_city_buff(city_level)
-        booth_details_for_display = {}
+        booth_details_for_display = {booth: {'income': rates.booth_rates.get(booth, 0)} for booth in player['booths']}
         
-        # 计算回忆卡加成
+        # 回忆卡加成（用于显示）
         memory_card_bonus = self.get_memory_card_bonus(player)
         
-        for booth, info in player['booths'].items():
-            current_booth_income = 0
-            if info['unlocked'] and info['assistant']:
-                booth_base = self.booths[booth]['base_income']
-                assistant = info['assistant']
-                assistant_bonus = self.calculate_assistant_bonus(assistant, booth, player['booths'])
-                
-                # 计算基础收入（每秒）
-                base_income = self.parse_gold(booth_base) * buff
-                
-                # 应用回忆卡加成
-                area_bonus = memory_card_bonus.get(self.booths[booth]['area'], 1.0)
-                current_booth_income = base_income * assistant_bonus * memory_card_bonus['all'] * area_bonus
-                
-                income_rate += current_booth_income
-                
-            booth_details_for_display[booth] = {'income': current_booth_income}
-            
         # 应用展会事件加成到总收入速率
-        income_rate *= memory_card_bonus['event']
+        income_rate = rates.total_rate * rates.event_multiplier
         
         next_level = city_level + 1 if city_level < 10 else 10
         next_need = self.get_city_level_threshold(next_level)
@@ -1107,16 +1027,16 @@ class MyPlugin(Star):
             
         # 区域分组
         areas = {'消费展区': {}, '趣味展区': {}, '纪念展区': {}}
+        booth_records = self.get_catalog().booths
         for booth, info in player['booths'].items():
-            area = self.booths[booth]['area']
-            areas[area][booth] = info
+            areas[booth_records[booth].area][booth] = info
             
         for area, booths in areas.items():
             msg += f"\n★【{area}】★\n"
             for booth, info in booths.items():
                 msg += ('✅' if info['unlocked'] else '❌') + booth
                 if not info['unlocked']:
-                    msg += f"（解锁价：{self.booths[booth]['unlock_cost']}）"
+                    msg += f"（解锁价：{booth_records[booth].unlock_cost_text}）"
                 else:
                     booth_income_to_show = booth_details_for_display[booth]['income']
                     if booth_income_to_show > 0:
@@ -1131,7 +1051,7 @@ class MyPlugin(Star):
                     assistant_rank = '见习'
                     assistant_details = self.get_assistant_static_details(info['assistant']['name'])
                     if assistant_details:
-                        assistant_rank = assistant_details['level']
+                        assistant_rank = assistant_details.rarity
                         
                     for player_assistant in player['assistants']:
                         if player_assistant['name'] == info['assistant']['name']:
@@ -1191,14 +1111,16 @@ class MyPlugin(Star):
             
         # 如果没有当前事件，有10%概率触发新事件
         if not player['current_event'] and (now % 10) < 1:  # 简单的10%概率实现
-            event_data = self.load_star_sea_anecdotes()
-            if event_data and '星海轶闻' in event_data and event_data['星海轶闻']:
+            anecdotes = self.get_catalog().anecdotes
+            if anecdotes:
+                import copy
                 import random
-                random_event = random.choice(event_data['星海轶闻'])
+                # 目录中的事件是共享的，玩家数据中保存副本
+                random_event = copy.deepcopy(random.choice(anecdotes))
                 player['current_event'] = random_event
                 player['event_expire_time'] = now + 3600  # 事件1小时后过期
                 event_triggered = True
-                self.save_player(event, player)
+                await self.save_player(event, player)
                 
         # 如果触发了事件或有当前事件，显示提示
         if event_triggered:
@@ -1215,19 +1137,13 @@ class MyPlugin(Star):
     @filter.regex("^世界排行$")
     async def world_rank(self, event: AstrMessageEvent):
         """世界总收入排行榜"""
-        # 加载世界排行数据
-        world = self.load_world()
-        
-        # 对世界排行按总收入排序
-        world.sort(key=lambda x: x['total_income'], reverse=True)
-        
-        msg = "🌏 世界总收入排行榜\n"
-        i = 1
-        for player in world:
-            if i > 20:  # 显示前20名
-                break
-            msg += f"{i}. {player['name']}：{self.format_gold(player['total_income'])}\n"
-            i += 1
+        # 排行数据由存储后端的内存索引提供，前20名不变时直接复用上次生成的文本
+        try:
+            db = await self.get_async_database()
+            msg = await db.render_world_ranking(self.render_world_rank)
+        except Exception as e:
+            logger.info(f"加载排行数据失败: {str(e)}")
+            msg = self.render_world_rank([])
             
         # 根据是否使用ArkReply决定回复方式
         if self.useArkReply:
@@ -1236,12 +1152,19 @@ class MyPlugin(Star):
         else:
             yield event.make_result().message(msg)
         yield event.stop_event()
+
+    def render_world_rank(self, world):
+        """生成世界排行榜文本，world 已按总收入降序排列"""
+        msg = "🌏 世界总收入排行榜\n"
+        for i, player in enumerate(world[:20], 1):  # 显示前20名
+            msg += f"{i}. {player['name']}：{self.format_gold(player['total_income'])}\n"
+        return msg
             
     @filter.regex("^玩家[Ii][Dd]$")
     async def show_my_player_id(self, event: AstrMessageEvent):
         """显示玩家ID信息"""
         # 加载玩家数据
-        player = self.load_player(event)
+        player = await self.load_player(event, read_only=True)
         if not player:
             yield event.make_result().message("你还没有创建展会，请使用 \"创建展会 你的展会名\" 来开始游戏")
             return
@@ -1263,11 +1186,103 @@ class MyPlugin(Star):
             yield event.make_result().message(msg)
         yield event.stop_event()
             
+    def parse_player_id_arg(self, event: AstrMessageEvent, command):
+        """从“指令+玩家ID”格式的消息中取出玩家ID，格式不正确时返回None"""
+        text = event.message_str.replace(command, "", 1).strip()
+        return int(text) if text.isdigit() else None
+
+    @filter.regex("^添加好友(.*)$")
+    async def add_friend(self, event: AstrMessageEvent):
+        """向指定玩家ID发送好友请求"""
+        player = await self.load_player(event, read_only=True)
+        if not player:
+            yield event.make_result().message("请先使用\"创建展会+名字\"创建展会")
+            return
+        friend_player_id = self.parse_player_id_arg(event, "添加好友")
+        if friend_player_id is None:
+            yield event.make_result().message("格式错误，请使用：添加好友+玩家ID")
+            return
+        db = await self.get_async_database()
+        result = await db.add_friend(event.get_sender_id(), friend_player_id)
+        yield event.make_result().message(("✅ " if result['success'] else "❌ ") + result['message'])
+        yield event.stop_event()
+
+    @filter.regex("^同意好友(.*)$")
+    async def accept_friend(self, event: AstrMessageEvent):
+        """同意指定玩家ID的好友请求"""
+        requester_player_id = self.parse_player_id_arg(event, "同意好友")
+        if requester_player_id is None:
+            yield event.make_result().message("格式错误，请使用：同意好友+玩家ID")
+            return
+        db = await self.get_async_database()
+        result = await db.accept_friend(event.get_sender_id(), requester_player_id)
+        yield event.make_result().message(("✅ " if result['success'] else "❌ ") + result['message'])
+        yield event.stop_event()
+
+    @filter.regex("^删除好友(.*)$")
+    async def remove_friend(self, event: AstrMessageEvent):
+        """删除指定玩家ID的好友"""
+        friend_player_id = self.parse_player_id_arg(event, "删除好友")
+        if friend_player_id is None:
+            yield event.make_result().message("格式错误，请使用：删除好友+玩家ID")
+            return
+        db = await self.get_async_database()
+        result = await db.remove_friend(event.get_sender_id(), friend_player_id)
+        yield event.make_result().message(("✅ " if result['success'] else "❌ ") + result['message'])
+        yield event.stop_event()
+
+    @filter.regex("^好友申请$")
+    async def show_friend_requests(self, event: AstrMessageEvent):
+        """查看收到的好友请求"""
+        db = await self.get_async_database()
+        requests = await db.get_friend_requests(event.get_sender_id())
+        if not requests:
+            yield event.make_result().message("暂时没有新的好友请求")
+            return
+        msg = "📨 好友请求\n"
+        for player_id, name, city_level, total_income, request_time in requests[:20]:
+            msg += f"{name}（ID:{player_id}）展会等级{city_level}\n"
+        msg += "💡 使用 \"同意好友 玩家ID\" 同意请求"
+        yield event.make_result().message(msg)
+        yield event.stop_event()
+
+    @filter.regex("^我的好友$")
+    async def show_friends(self, event: AstrMessageEvent):
+        """查看好友列表"""
+        db = await self.get_async_database()
+        friends = await db.list_friends(event.get_sender_id())
+        if not friends:
+            yield event.make_result().message("你还没有好友，使用 \"添加好友 玩家ID\" 添加好友")
+            return
+        msg = f"👥 我的好友（{len(friends)}人）\n"
+        for friend in friends:
+            msg += f"{friend['name']}（ID:{friend['player_id']}）总收入：{self.format_gold(friend['total_income'])}\n"
+        yield event.make_result().message(msg)
+        yield event.stop_event()
+
+    @filter.regex("^好友排行$")
+    async def friend_rank(self, event: AstrMessageEvent):
+        """自己和好友的总收入排行榜"""
+        player = await self.load_player(event, read_only=True)
+        if not player:
+            yield event.make_result().message("请先使用\"创建展会+名字\"创建展会")
+            return
+        db = await self.get_async_database()
+        ranking, my_rank = await db.friend_leaderboard(event.get_sender_id())
+        msg = "👥 好友总收入排行榜\n"
+        for i, profile in enumerate(ranking, 1):
+            msg += f"{i}. {profile['name']}：{self.format_gold(profile['total_income'])}\n"
+        if my_rank:
+            msg += f"你的名次：第{my_rank}名"
+        yield event.make_result().message(msg)
+        yield event.stop_event()
+
     @filter.regex("^改名(.*)$")
+    @retry_on_conflict
     async def change_name(self, event: AstrMessageEvent):
         """修改展会名称"""
         # 加载玩家数据
-        player = self.load_player(event)
+        player = await self.load_player(event)
         if not player:
             yield event.make_result().message("你还没有创建展会，请使用 \"创建展会 你的展会名\" 来开始游戏")
             return
@@ -1298,27 +1313,47 @@ class MyPlugin(Star):
             yield event.make_result().message("新名称与当前名称相同，无需改名")
             return
         
-        # 检查重名
-        if self.check_name_exists(new_name):
+        # 检查重名；只改大小写或全半角时规范名称不变，名称仍归自己
+        from .Database import normalize_name
+        if normalize_name(new_name) != normalize_name(player['name']) and await self.check_name_exists(new_name):
             yield event.make_result().message(f"展会名称「{new_name}」已被占用，请更换另一个名字")
             return
         # 检查钻石是否足够
         if player['diamond'] < 100:
             yield event.make_result().message(f"钻石不足，改名需要100钻石\n当前钻石：{player['diamond']}")
             return
+
+        # 预留新名称，保存成功后确认并释放旧名称
+        user_id = event.get_sender_id()
+        reserved = await self.reserve_name(user_id, new_name)
+        if reserved is None:
+            yield event.make_result().message("改名失败，请稍后再试")
+            return
+        if not reserved:
+            yield event.make_result().message(f"展会名称「{new_name}」已被占用，请更换另一个名字")
+            return
         
         # 执行改名
         old_name = player['name']
         player['name'] = new_name
         player['diamond'] -= 100
         
-        # 保存玩家数据
-        self.save_player(event, player)
+        # 保存玩家数据并等待写入数据库，确认落库后才提交名称；
+        # 版本冲突时释放预留后由 retry_on_conflict 重新执行
+        try:
+            saved = await self.save_player(event, player, immediate=True)
+        except BaseException:
+            await self.release_name(user_id, new_name)
+            raise
+        if not saved:
+            await self.release_name(user_id, new_name)
+            yield event.make_result().message("改名失败，请稍后再试")
+            return
+        await self.commit_name(user_id, new_name, old_name)
         
         # 更新世界排行榜
         try:
-            user_id = event.get_sender_id()
-            self.update_world_ranking(user_id, player['name'], player['gold'], player['total_income'])
+            await self.update_world_ranking(user_id, player['name'], player['gold'], player['total_income'])
         except Exception as e:
             logger.error(f"更新排行榜失败: {str(e)}")
         
@@ -1369,14 +1404,18 @@ class MyPlugin(Star):
         msg += "展会信息 | 一键收取 | 我的助理\n"
         msg += "世界排行 | 展会签到 | 助理卡池\n"
         msg += "我的背包 | 我的回忆卡 | 我的ID\n"
-        msg += "一键升级助理\n"
+        msg += "一键升级助理 | 最大升级\n"
 
         msg += "\n【邀约指令】\n"
         msg += "普通邀约 | 黄金邀约 | 炫彩邀约\n"
+        msg += "普通邀约十连 | 黄金邀约十连 | 炫彩邀约十连\n"
         msg += "\n【回忆卡指令】\n"
         msg += "抽取回忆1/2/3/4\n"
+        msg += "抽取回忆1 x10（连续抽取）\n"
         msg += "\n【来宾事件指令】\n"
         msg += "查看事件 | 事件选择+数字\n"
+        msg += "\n【好友指令】\n"
+        msg += "我的好友 | 好友申请 | 好友排行\n"
 
         msg += "\n⭐\n"
 
@@ -1388,7 +1427,11 @@ class MyPlugin(Star):
         msg += "查看展台 展台名\n"
         msg += "升级助理 助理名\n"
         msg += "快速升级 助理名\n"
+        msg += "最大升级 助理名\n"
         msg += "解锁 展台名\n"
+        msg += "添加好友 玩家ID\n"
+        msg += "同意好友 玩家ID\n"
+        msg += "删除好友 玩家ID\n"
 
         msg += "⭐\n"
         msg += "参数说明：使用空格分隔参数，例如：'分配助理 助理名 咖啡馆'\n"
@@ -1405,7 +1448,7 @@ class MyPlugin(Star):
     async def show_assistants(self, event: AstrMessageEvent):
         """显示我的助理列表"""
         # 检查玩家是否存在
-        player = self.load_player(event)
+        player = await self.load_player(event, read_only=True)
         if not player:
             yield event.make_result().message("请先使用\"创建展会+名字\"创建展会")
             return
@@ -1436,10 +1479,11 @@ class MyPlugin(Star):
         yield event.stop_event()
         
     @filter.regex("^升级助理(.*)$")
+    @retry_on_conflict
     async def upgrade_assistant(self, event: AstrMessageEvent):
         """升级助理等级"""
         # 检查玩家是否存在
-        player = self.load_player(event)
+        player = await self.load_player(event)
         if not player:
             yield event.make_result().message("请先使用\"创建展会+名字\"创建展会")
             return
@@ -1477,7 +1521,7 @@ class MyPlugin(Star):
         player['assistants'][assistant_index]['level'] += 1
         
         # 保存玩家数据
-        self.save_player(event, player)
+        await self.save_player(event, player)
         
         msg = f"🎉 升级成功！\n"
         msg += f"助理：{assistant_name}\n"
@@ -1489,10 +1533,11 @@ class MyPlugin(Star):
         yield event.stop_event()
         
     @filter.regex("^快速升级(.*)$")
+    @retry_on_conflict
     async def quick_upgrade_assistant(self, event: AstrMessageEvent):
         """快速升级助理（升级10级）"""
         # 检查玩家是否存在
-        player = self.load_player(event)
+        player = await self.load_player(event)
         if not player:
             yield event.make_result().message("请先使用\"创建展会+名字\"创建展会")
             return
@@ -1517,11 +1562,9 @@ class MyPlugin(Star):
         assistant = player['assistants'][assistant_index]
         current_level = assistant['level']
         
-        # 计算升级10级的总费用
-        total_cost = 0
-        for i in range(10):
-            level_cost = int(self.level_upgrade_base_cost * (self.level_upgrade_multiplier ** (current_level + i - 1)))
-            total_cost += level_cost
+        # 计算升级10级的总费用（等比数列求和）
+        from .Economy import level_upgrade_cost
+        total_cost = int(level_upgrade_cost(current_level, 10))
             
         # 检查金币是否足够
         if player['gold'] < total_cost:
@@ -1533,7 +1576,7 @@ class MyPlugin(Star):
         player['assistants'][assistant_index]['level'] += 10
         
         # 保存玩家数据
-        self.save_player(event, player)
+        await self.save_player(event, player)
         
         msg = f"🎉 快速升级成功！\n"
         msg += f"助理：{assistant_name}\n"
@@ -1545,10 +1588,11 @@ class MyPlugin(Star):
         yield event.stop_event()
         
     @filter.regex("^分配助理(.*)$")
+    @retry_on_conflict
     async def assign_assistant(self, event: AstrMessageEvent):
         """分配助理到展台"""
         # 检查玩家是否存在
-        player = self.load_player(event)
+        player = await self.load_player(event)
         if not player:
             yield event.make_result().message("请先使用\"创建展会+名字\"创建展会")
             return
@@ -1618,7 +1662,7 @@ class MyPlugin(Star):
             tutorial_msg = ""
             
         # 保存玩家数据
-        self.save_player(event, player)
+        await self.save_player(event, player)
         
         msg = f"✅ 分配成功！\n"
         msg += f"助理 {assistant_name} 已分配到 {booth_name}{tutorial_msg}"
@@ -1627,10 +1671,11 @@ class MyPlugin(Star):
         yield event.stop_event()
         
     @filter.regex("^一键升级助理$")
+    @retry_on_conflict
     async def bulk_upgrade_assistants(self, event: AstrMessageEvent):
         """一键升级所有助理"""
         # 检查玩家是否存在
-        player = self.load_player(event)
+        player = await self.load_player(event)
         if not player:
             yield event.make_result().message("请先使用\"创建展会+名字\"创建展会")
             return
@@ -1665,7 +1710,7 @@ class MyPlugin(Star):
             assistant['level'] += 1
             
         # 保存玩家数据
-        self.save_player(event, player)
+        await self.save_player(event, player)
         
         msg = f"🎉 一键升级完成！\n"
         msg += f"升级了 {len(player['assistants'])} 个助理\n"
@@ -1675,11 +1720,71 @@ class MyPlugin(Star):
         yield event.make_result().message(msg)
         yield event.stop_event()
         
+    @filter.regex("^最大升级(.*)$")
+    @retry_on_conflict
+    async def max_upgrade_assistants(self, event: AstrMessageEvent):
+        """用当前金币把助理升到能负担的最高等级（不带助理名则升级全部助理）"""
+        # 检查玩家是否存在
+        player = await self.load_player(event)
+        if not player:
+            yield event.make_result().message("请先使用\"创建展会+名字\"创建展会")
+            return
+            
+        if not player['assistants']:
+            yield event.make_result().message("你还没有任何助理")
+            return
+            
+        from .Economy import level_upgrade_cost, plan_level_upgrades
+        
+        # 确定要升级的助理
+        assistant_name = event.message_str.replace("最大升级", "").strip()
+        if assistant_name and assistant_name != "全部":
+            targets = [assistant for assistant in player['assistants'] if assistant['name'] == assistant_name]
+            if not targets:
+                yield event.make_result().message(f"未找到助理：{assistant_name}")
+                return
+        else:
+            targets = player['assistants']
+            
+        # 按等比数列闭式解直接算出可升级数，金币优先分给等级最低的助理
+        old_levels = [assistant['level'] for assistant in targets]
+        new_levels, total_cost = plan_level_upgrades(old_levels, player['gold'])
+        total_cost = min(int(total_cost), player['gold'])
+        
+        if new_levels == old_levels:
+            next_cost = min(level_upgrade_cost(level) for level in old_levels)
+            yield event.make_result().message(f"金币不足，至少需要 {self.format_gold(next_cost)} 金币才能升级\n当前金币：{self.format_gold(player['gold'])}")
+            return
+            
+        # 执行升级，并同步展台上的助理等级
+        player['gold'] -= total_cost
+        upgraded = {}
+        for assistant, old_level, new_level in zip(targets, old_levels, new_levels):
+            if new_level > old_level:
+                assistant['level'] = new_level
+                upgraded[assistant['name']] = (old_level, new_level)
+        for booth in player['booths'].values():
+            if booth['assistant'] and booth['assistant']['name'] in upgraded:
+                booth['assistant']['level'] = upgraded[booth['assistant']['name']][1]
+                
+        # 保存玩家数据
+        await self.save_player(event, player)
+        
+        msg = f"🎉 最大升级完成！\n"
+        for name, (old_level, new_level) in upgraded.items():
+            msg += f"{name}：Lv.{old_level} → Lv.{new_level}\n"
+        msg += f"总消耗金币：{self.format_gold(total_cost)}\n"
+        msg += f"剩余金币：{self.format_gold(player['gold'])}"
+        
+        yield event.make_result().message(msg)
+        yield event.stop_event()
+        
     @filter.regex("^展会签到$")
+    @retry_on_conflict
     async def daily_check_in(self, event: AstrMessageEvent):
         """每日签到"""
         # 检查玩家是否存在
-        player = self.load_player(event)
+        player = await self.load_player(event)
         if not player:
             yield event.make_result().message("请先使用\"创建展会+名字\"创建展会")
             return
@@ -1729,7 +1834,7 @@ class MyPlugin(Star):
         player['diamond'] += total_reward
         
         # 保存玩家数据
-        self.save_player(event, player)
+        await self.save_player(event, player)
         
         msg = f"🎉 签到成功！\n{player['name']} 获得了 {total_reward} 钻石"
         if extra_reward > 0:
@@ -1756,7 +1861,7 @@ class MyPlugin(Star):
     async def show_my_bag(self, event: AstrMessageEvent):
         """显示背包信息"""
         # 检查玩家是否存在
-        player = self.load_player(event)
+        player = await self.load_player(event, read_only=True)
         if not player:
             yield event.make_result().message("请先使用\"创建展会+名字\"创建展会")
             return
@@ -1791,7 +1896,7 @@ class MyPlugin(Star):
     async def show_my_memory_cards(self, event: AstrMessageEvent):
         """显示我的回忆卡"""
         # 检查玩家是否存在
-        player = self.load_player(event)
+        player = await self.load_player(event, read_only=True)
         if not player:
             yield event.make_result().message("请先使用\"创建展会+名字\"创建展会")
             return
@@ -1809,24 +1914,24 @@ class MyPlugin(Star):
             4: '匹诺康尼'
         }
         
-        memory_cards = self.load_memory_card_data()
+        catalog = self.get_catalog()
         msg = "📚 回忆卡收集情况 📚\n\n"
         
         if area_index is not None and area_index in area_names:
             # 显示特定区域
             area_name = area_names[area_index]
-            area_cards = [card for card in memory_cards if card['所属'] == area_name]
+            area_cards = catalog.memory_cards_by_area.get(area_name, ())
             
             msg += f"【{area_name}】\n"
             for card in area_cards:
-                card_name = card['名称']
+                card_name = card.name
                 has_a = '✅' if f"{card_name}_A" in player.get('memory_parts', {}) else '❌'
                 has_b = '✅' if f"{card_name}_B" in player.get('memory_parts', {}) else '❌'
                 has_c = '✅' if f"{card_name}_C" in player.get('memory_parts', {}) else '❌'
                 completed = '🌟' if card_name in player.get('memory_cards', {}) else ''
                 
                 msg += f"● {card_name} {completed} [A{has_a} B{has_b} C{has_c}]\n"
-                msg += f"➤ {card['介绍']}\n"
+                msg += f"➤ {card.description}\n"
                 
             # 显示已激活的效果
             if player.get('memory_cards', {}):
@@ -1834,11 +1939,9 @@ class MyPlugin(Star):
                 
                 # 显示每张回忆卡的效果和数量
                 for card_name, card_count in player.get('memory_cards', {}).items():
-                    # 查找该回忆卡的效果
-                    for card_data in memory_cards:
-                        if card_data['名称'] == card_name:
-                            msg += f"- {card_data['集齐效果']} (拥有{card_count}张)\n"
-                            break
+                    card_data = catalog.memory_cards_by_name.get(card_name)
+                    if card_data:
+                        msg += f"- {card_data.effect} (拥有{card_count}张)\n"
             
             # 提示其他区域
             other_areas = []
@@ -1850,9 +1953,9 @@ class MyPlugin(Star):
             # 显示所有区域概括
             msg += "【所有区域概括】\n"
             for idx, area_name in area_names.items():
-                area_cards = [card for card in memory_cards if card['所属'] == area_name]
+                area_cards = catalog.memory_cards_by_area.get(area_name, ())
                 total_cards = len(area_cards)
-                collected_cards = sum(1 for card in area_cards if card['名称'] in player.get('memory_cards', {}))
+                collected_cards = sum(1 for card in area_cards if card.name in player.get('memory_cards', {}))
                 
                 msg += f"- {area_name}: {collected_cards}/{total_cards}\n"
             
@@ -1865,20 +1968,50 @@ class MyPlugin(Star):
         yield event.make_result().message(msg)
         yield event.stop_event()
         
+    def draw_memory_cards(self, player, area_name, count):
+        """
+        在内存中连续抽取 count 次回忆卡部分，集齐A/B/C三个部分时自动合成完整回忆卡
+        :return: 每次抽取的结果字典列表（card、part、combined）
+        """
+        from .Economy import MEMORY_CARD_PARTS
+        pool = self.get_catalog().memory_card_pools[area_name]
+        memory_parts = player.setdefault('memory_parts', {})
+        memory_cards = player.setdefault('memory_cards', {})
+
+        results = []
+        for _ in range(count):
+            card, part = pool.draw()
+            memory_parts[f"{card.name}_{part}"] = memory_parts.get(f"{card.name}_{part}", 0) + 1
+            part_keys = [f"{card.name}_{p}" for p in MEMORY_CARD_PARTS]
+            combined = all(memory_parts.get(key, 0) for key in part_keys)
+            if combined:
+                for key in part_keys:
+                    memory_parts[key] -= 1
+                    if memory_parts[key] <= 0:
+                        memory_parts.pop(key, None)
+                memory_cards[card.name] = memory_cards.get(card.name, 0) + 1
+            results.append({'card': card, 'part': part, 'combined': combined})
+
+        if any(result['combined'] for result in results):
+            self.invalidate_memory_card_bonus(player)
+        return results
+
     @filter.regex("^抽取回忆(.*)$")
+    @retry_on_conflict
     async def gacha_memory_card(self, event: AstrMessageEvent):
-        """抽取回忆卡"""
+        """抽取回忆卡，可在区域后加 x次数 连续抽取"""
         # 检查玩家是否存在
-        player = self.load_player(event)
+        player = await self.load_player(event)
         if not player:
             yield event.make_result().message("请先使用\"创建展会+名字\"创建展会")
             return
         
         # 检查指令格式
         import re
-        match = re.match(r'^抽取回忆([1-4])$', event.message_str)
+        from .Economy import MEMORY_CARD_DRAW_COST, MEMORY_CARD_MAX_BATCH
+        match = re.match(r'^抽取回忆([1-4])(?:\s*[xX×]\s*(\d+))?$', event.message_str.strip())
         if not match:
-            yield event.make_result().message("格式错误，请使用指令：抽取回忆1/2/3/4")
+            yield event.make_result().message("格式错误，请使用指令：抽取回忆1/2/3/4，连续抽取请使用：抽取回忆1 x10")
             return
             
         # 获取区域信息
@@ -1890,115 +2023,100 @@ class MyPlugin(Star):
             4: '匹诺康尼'
         }
         area_name = area_names.get(area_index, '')
+        batch = match.group(2) is not None
+        draw_count = int(match.group(2)) if batch else 1
+        if not 1 <= draw_count <= MEMORY_CARD_MAX_BATCH:
+            yield event.make_result().message(f"抽取次数需在1到{MEMORY_CARD_MAX_BATCH}之间")
+            return
         
-        # 检查消耗方式
-        use_ticket = False
-        if player.get('memory_tickets', 0) > 0:
-            player['memory_tickets'] -= 1
-            use_ticket = True
-        else:
-            # 检查钻石是否足够
-            cost = 100
-            if player.get('diamond', 0) < cost:
-                yield event.make_result().message(f"钻石不足，需要{cost}钻石\n当前钻石：{player.get('diamond', 0)}")
-                return
-            player['diamond'] -= cost
+        # 检查消耗：先用回忆卡抽取券，不足的次数消耗钻石
+        used_tickets = min(player.get('memory_tickets', 0), draw_count)
+        cost = (draw_count - used_tickets) * MEMORY_CARD_DRAW_COST
+        if player.get('diamond', 0) < cost:
+            msg = f"钻石不足，需要{cost}钻石"
+            if used_tickets:
+                msg += f"（已有{used_tickets}张回忆卡抽取券）"
+            yield event.make_result().message(f"{msg}\n当前钻石：{player.get('diamond', 0)}")
+            return
         
-        # 加载回忆卡数据
-        memory_cards = self.load_memory_card_data()
-        if not memory_cards:
+        # 回忆卡数据，每个区域的抽取池在加载目录时已建好
+        catalog = self.get_catalog()
+        if not catalog.memory_cards:
             yield event.make_result().message("回忆卡数据加载失败，请稍后重试")
             return
-            
-        # 筛选指定区域的回忆卡
-        area_cards = [card for card in memory_cards if card.get('所属') == area_name]
-        if not area_cards:
+        if area_name not in catalog.memory_card_pools:
             yield event.make_result().message(f"没有找到{area_name}的回忆卡数据")
             return
-            
-        # 按稀有度分组
-        normal_cards = [card for card in area_cards if card.get('稀有度') != '稀有']
-        rare_cards = [card for card in area_cards if card.get('稀有度') == '稀有']
-        
-        # 抽取回忆卡 (普通70%，稀有30%)
-        import random
-        rand = random.randint(1, 100)
-        selected_pool = rare_cards if (rand <= 30 and rare_cards) else normal_cards
-        if not selected_pool:
-            selected_pool = normal_cards
-            
-        # 随机选择一张回忆卡
-        selected_card = random.choice(selected_pool)
-        card_name = selected_card['名称']
-        
-        # 随机选择部分 (A/B/C)
-        parts = ['A', 'B', 'C']
-        selected_part = random.choice(parts)
-        part_key = f"{card_name}_{selected_part}"
-        
-        # 更新玩家数据
-        if 'memory_parts' not in player:
-            player['memory_parts'] = {}
-        if part_key not in player['memory_parts']:
-            player['memory_parts'][part_key] = 0
-        player['memory_parts'][part_key] += 1
-        
-        # 检查是否可以合成完整回忆卡
-        can_combine = True
-        for part in parts:
-            check_key = f"{card_name}_{part}"
-            if not player['memory_parts'].get(check_key, 0):
-                can_combine = False
-                break
+
+        if used_tickets:
+            player['memory_tickets'] -= used_tickets
+        player['diamond'] -= cost
+        draws = self.draw_memory_cards(player, area_name, draw_count)
                 
         # 构建回复消息
         msg = "✨ 回忆卡抽取结果 ✨\n"
         msg += f"区域：{area_name}\n"
-        if use_ticket:
-            msg += "消耗：1张回忆卡抽取券\n"
+        consumed = []
+        if used_tickets:
+            consumed.append(f"{used_tickets}张回忆卡抽取券")
+        if cost:
+            consumed.append(f"{cost}钻石")
+        msg += f"消耗：{'、'.join(consumed)}\n"
+
+        if not batch:
+            draw = draws[0]
+            selected_card = draw['card']
+            card_name = selected_card.name
+            msg += f"获得：{card_name} {draw['part']}部分\n"
+            msg += f"稀有度：{selected_card.rarity}\n"
+            msg += f"{selected_card.description}\n"
+            
+            # 显示当前拥有的部分（合成前）
+            combined = 1 if draw['combined'] else 0
+            part_a = player['memory_parts'].get(f"{card_name}_A", 0) + combined
+            part_b = player['memory_parts'].get(f"{card_name}_B", 0) + combined
+            part_c = player['memory_parts'].get(f"{card_name}_C", 0) + combined
+            msg += f"当前拥有：{card_name} A:{part_a} B:{part_b} C:{part_c}\n"
+            
+            if draw['combined']:
+                msg += f"\n🎉 恭喜！集齐了{card_name}的所有部分，已合成完整回忆卡！\n"
+                msg += f"激活效果：{selected_card.effect}\n"
+                msg += f"当前拥有该回忆卡数量：{player['memory_cards'][card_name]}张"
         else:
-            msg += "消耗：100钻石\n"
-        msg += f"获得：{card_name} {selected_part}部分\n"
-        msg += f"稀有度：{selected_card.get('稀有度', '普通')}\n"
-        msg += f"{selected_card.get('介绍', '')}\n"
-        
-        # 显示当前拥有的部分
-        part_a = player['memory_parts'].get(f"{card_name}_A", 0)
-        part_b = player['memory_parts'].get(f"{card_name}_B", 0)
-        part_c = player['memory_parts'].get(f"{card_name}_C", 0)
-        msg += f"当前拥有：{card_name} A:{part_a} B:{part_b} C:{part_c}\n"
-        
-        # 如果可以合成
-        if can_combine:
-            # 合成完整回忆卡
-            for part in parts:
-                part_key = f"{card_name}_{part}"
-                player['memory_parts'][part_key] -= 1
-                if player['memory_parts'][part_key] <= 0:
-                    player['memory_parts'].pop(part_key, None)
-                    
-            # 添加完整回忆卡
-            if 'memory_cards' not in player:
-                player['memory_cards'] = {}
-            if card_name not in player['memory_cards']:
-                player['memory_cards'][card_name] = 0
-            player['memory_cards'][card_name] += 1
-            
-            msg += f"\n🎉 恭喜！集齐了{card_name}的所有部分，已合成完整回忆卡！\n"
-            msg += f"激活效果：{selected_card.get('集齐效果', '')}\n"
-            msg += f"当前拥有该回忆卡数量：{player['memory_cards'][card_name]}张"
+            # 按回忆卡汇总本次获得的部分，保持首次抽到的顺序
+            gained = {}
+            for draw in draws:
+                parts = gained.setdefault(draw['card'].name, {})
+                parts[draw['part']] = parts.get(draw['part'], 0) + 1
+            rare_count = sum(1 for draw in draws if draw['card'].rarity == '稀有')
+            msg += f"抽取{draw_count}次，其中稀有{rare_count}次\n"
+            msg += "--------------------\n"
+            for card_name, parts in gained.items():
+                part_text = ' '.join(f"{part}x{count}" for part, count in sorted(parts.items()))
+                msg += f"{card_name}：{part_text}\n"
+
+            combined_cards = {}
+            for draw in draws:
+                if draw['combined']:
+                    combined_cards.setdefault(draw['card'].name, [draw['card'], 0])[1] += 1
+            if combined_cards:
+                msg += "--------------------\n🎉 合成完整回忆卡：\n"
+                for card_name, (card, count) in combined_cards.items():
+                    msg += f"{card_name} x{count}（当前{player['memory_cards'][card_name]}张）激活效果：{card.effect}\n"
+            msg += f"\n剩余：回忆卡抽取券{player.get('memory_tickets', 0)}张，钻石{player['diamond']}"
             
         # 保存玩家数据
-        self.save_player(event, player)
+        await self.save_player(event, player)
         
-        yield event.make_result().message(msg)
+        yield event.make_result().message(msg.rstrip('\n'))
         yield event.stop_event()
         
     @filter.regex("^查看事件$")
+    @retry_on_conflict
     async def show_current_event(self, event: AstrMessageEvent):
         """查看当前来宾事件"""
         # 检查玩家是否存在
-        player = self.load_player(event)
+        player = await self.load_player(event)
         if not player:
             yield event.make_result().message("请先使用\"创建展会+名字\"创建展会")
             return
@@ -2014,7 +2132,7 @@ class MyPlugin(Star):
         if now > player.get('event_expire_time', 0):
             player['current_event'] = None
             player['event_expire_time'] = 0
-            self.save_player(event, player)
+            await self.save_player(event, player)
             yield event.make_result().message("来宾事件已过期")
             return
             
@@ -2032,10 +2150,11 @@ class MyPlugin(Star):
         yield event.stop_event()
         
     @filter.regex("^事件选择(\d+)$")
+    @retry_on_conflict
     async def select_event_option(self, event: AstrMessageEvent):
         """选择事件选项"""
         # 检查玩家是否存在
-        player = self.load_player(event)
+        player = await self.load_player(event)
         if not player:
             yield event.make_result().message("请先使用\"创建展会+名字\"创建展会")
             return
@@ -2051,7 +2170,7 @@ class MyPlugin(Star):
         if now > player.get('event_expire_time', 0):
             player['current_event'] = None
             player['event_expire_time'] = 0
-            self.save_player(event, player)
+            await self.save_player(event, player)
             yield event.make_result().message("来宾事件已过期")
             return
             
@@ -2097,7 +2216,7 @@ class MyPlugin(Star):
         player['event_expire_time'] = 0
         
         # 保存玩家数据
-        self.save_player(event, player)
+        await self.save_player(event, player)
         
         msg = f"🎭 事件结果\n"
         msg += f"你选择了：{selected_option['选择']}\n"
@@ -2111,7 +2230,7 @@ class MyPlugin(Star):
     async def show_shop_detail(self, event: AstrMessageEvent):
         """显示展台详细信息"""
         # 加载玩家数据
-        player = self.load_player(event)
+        player = await self.load_player(event, read_only=True)
         if not player:
             yield event.make_result().message("请先使用\"创建展会+名字\"创建展会")
             return
@@ -2145,23 +2264,19 @@ class MyPlugin(Star):
         upgrade_cost = self.level_upgrade_base_cost * (self.level_upgrade_multiplier ** (assistant['level'] - 1))
 
         # 计算当前速率
-        city_level = self.get_city_level(player['total_income'])
-        buff = self.get_city_buff(city_level)
-        booth_base = self.booths[booth]['base_income']
-        current_bonus = self.calculate_assistant_bonus(assistant, booth, player['booths'])
-        current_rate = self.parse_gold(booth_base) * buff * current_bonus
-
-        # 计算下一级速率
-        next_level_assistant = assistant.copy()
-        next_level_assistant['level'] += 1
-        next_level_bonus = self.calculate_assistant_bonus(next_level_assistant, booth, player['booths'])
-        next_level_rate = self.parse_gold(booth_base) * buff * next_level_bonus
-
-        # 计算下10级速率
-        next_10_level_assistant = assistant.copy()
-        next_10_level_assistant['level'] += 10
-        next_10_level_bonus = self.calculate_assistant_bonus(next_10_level_assistant, booth, player['booths'])
-        next_10_level_rate = self.parse_gold(booth_base) * buff * next_10_level_bonus
+        rates = self.get_income_snapshot(player)
+        current_rate = rates.booth_rates.get(booth, 0)
+
+        # 按同一公式计算升级后的速率
+        from .Economy import working_assistants
+        engine = self.get_income_engine()
+        buff = self.get_city_buff(rates.city_level)
+        memory_card_bonus = self.get_memory_card_bonus(player)
+        working = working_assistants(player['booths'])
+        next_level_assistant = dict(assistant, level=assistant['level'] + 1)
+        next_level_rate = engine.booth_rate(booth, next_level_assistant, buff, memory_card_bonus, working)
+        next_10_level_assistant = dict(assistant, level=assistant['level'] + 10)
+        next_10_level_rate = engine.booth_rate(booth, next_10_level_assistant, buff, memory_card_bonus, working)
 
         # 构建消息
         msg = f"🏪 展台：{booth}\n"
@@ -2178,13 +2293,13 @@ class MyPlugin(Star):
         # 添加特质信息
         if assistant_static_info:
             msg += "\n【特质】\n"
-            for trait in assistant_static_info['traits']:
+            for trait in assistant_static_info.traits:
                 msg += f"- {trait}\n"
 
             # 添加羁绊信息
-            if 'bond' in assistant_static_info and assistant_static_info['bond']:
+            if assistant_static_info.bond:
                 msg += "\n【羁绊】\n"
-                for bond in assistant_static_info['bond']:
+                for bond in assistant_static_info.bond:
                     has_bond = "❌"
                     # 检查所有展台分配的助理
                     for booth_info in player['booths'].values():
@@ -2204,6 +2319,21 @@ class MyPlugin(Star):
     async def initialize(self):
         """可选择实现异步的插件初始化方法，当实例化该插件类之后会自动调用该方法。"""
         # 在initialize方法中也可以定义或修改实例变量
+        catalog = self.reload_catalog()
+        logger.info(f"静态数据已加载：{len(catalog.assistants)} 名助理，{len(catalog.memory_cards)} 张回忆卡，"
+                    f"{len(catalog.anecdotes)} 个星海轶闻")
         self.is_initialized = True
         logger.info(f"{self.plugin_name} v{self.version} 已初始化")
+
+    async def terminate(self):
+        """插件被卸载/停用时调用，关闭数据库线程池和存储后端"""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        if self.async_database is not None:
+            # 等待线程池中的保存操作完成并关闭后端（写回缓存和排行数据），放到默认线程池中避免阻塞事件循环
+            await loop.run_in_executor(None, self.async_database.close)
+            self.async_database = None
+        elif self.database is not None:
+            await loop.run_in_executor(None, self.database.close)
+        self.database = None
     
\ No newline at end of file
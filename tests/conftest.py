@@ -0,0 +1,52 @@
+"""测试公共设置
+
+插件模块之间使用相对导入，这里把插件目录注册为 srworld 包（metadata.yaml 中的插件名），
+测试统一通过 srworld.Database / srworld.Storage 等导入，不依赖插件目录本身的名称。
+"""
+import importlib.machinery
+import importlib.util
+import os
+import sys
+
+import pytest
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if 'srworld' not in sys.modules:
+    spec = importlib.machinery.ModuleSpec('srworld', None, is_package=True)
+    spec.submodule_search_locations = [PLUGIN_DIR]
+    sys.modules['srworld'] = importlib.util.module_from_spec(spec)
+
+
+def make_player(name, **fields):
+    """测试用的最小玩家数据"""
+    player = {
+        'name': name,
+        'gold': 0,
+        'diamond': 0,
+        'total_income': 0,
+        'tickets': {'普通': 1, '黄金': 0, '炫彩': 0},
+        'booths': {'咖啡馆': {'unlocked': True, 'assistant': None, 'last_collect': 0}},
+        'assistants': [],
+        'fragments': {},
+        'memory_parts': {},
+        'memory_cards': {},
+    }
+    player.update(fields)
+    return player
+
+
+@pytest.fixture
+def memory_db():
+    from srworld.Storage import MemoryDatabase
+    database = MemoryDatabase()
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    from srworld.Storage import SQLiteDatabase
+    database = SQLiteDatabase(str(tmp_path / 'world.db'), {'enabled': False})
+    yield database
+    database.close()
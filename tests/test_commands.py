@@ -0,0 +1,196 @@
+"""指令处理器测试：使用内存后端执行完整指令，需要 AstrBot（astrbot.api），未安装时跳过"""
+import asyncio
+import math
+import random
+
+import pytest
+
+pytest.importorskip('astrbot.api')
+
+from conftest import PLUGIN_DIR
+from srworld.Catalog import load_catalog
+from srworld.Economy import (
+    ASSISTANT_POOLS, BOOTHS, GACHA_REWARDS, MEMORY_CARD_DRAW_COST, MEMORY_CARD_MAX_BATCH, MULTI_PULL_COUNT,
+    STAR_UPGRADE_COST, level_upgrade_cost,
+)
+
+
+class FakeResult:
+    def __init__(self):
+        self.text = None
+
+    def message(self, text):
+        self.text = text
+        return self
+
+
+class FakeEvent:
+    def __init__(self, user_id, message_str):
+        self.user_id = user_id
+        self.message_str = message_str
+
+    def get_sender_id(self):
+        return self.user_id
+
+    def make_result(self):
+        return FakeResult()
+
+    def stop_event(self):
+        return None
+
+
+@pytest.fixture
+def plugin(memory_db):
+    from srworld.main import MyPlugin
+    plugin = MyPlugin(None)
+    plugin.catalog = load_catalog(PLUGIN_DIR, BOOTHS, plugin.assistant_pool, cache_path='')
+    # 测试期间不检查数据文件是否被修改
+    plugin.catalog_check_interval = math.inf
+    plugin.database = memory_db
+    yield plugin
+    asyncio.run(plugin.terminate())
+
+
+def run(handler, user_id, message_str):
+    """执行一条指令，返回回复文本列表"""
+    async def collect():
+        return [result.text async for result in handler(FakeEvent(user_id, message_str)) if result is not None]
+    return asyncio.run(collect())
+
+
+def create_player(plugin, user_id, booth_assistants=(), **fields):
+    """创建测试玩家，booth_assistants 为 [(展台名, 助理名)]，分配的助理需在 assistants 中"""
+    player = plugin.get_default_player('测试展会', plugin.database.get_next_player_id())
+    player.update(fields)
+    for booth_name, assistant_name in booth_assistants:
+        assistant = next(a for a in player['assistants'] if a['name'] == assistant_name)
+        player['booths'][booth_name].update(unlocked=True, assistant=dict(assistant))
+    assert plugin.database.save_player(user_id, player)
+    return player
+
+
+def count_saves(plugin, monkeypatch):
+    """记录指令保存玩家数据的次数"""
+    saves = []
+    original = plugin.save_player
+
+    async def save_player(event, player_data, immediate=False):
+        saves.append(event.get_sender_id())
+        return await original(event, player_data, immediate)
+
+    monkeypatch.setattr(plugin, 'save_player', save_player)
+    return saves
+
+
+def test_max_upgrade_syncs_booth_level(plugin, monkeypatch):
+    """金币正好够连升3级：升到4级，展台上的同一助理同步为4级，其他助理不变"""
+    names = [record.name for record in plugin.catalog.assistants[:2]]
+    gold = math.ceil(level_upgrade_cost(1, 3))
+    create_player(plugin, 'u1', booth_assistants=[('咖啡馆', names[0])], gold=gold, assistants=[
+        {'name': names[0], 'level': 1, 'star': 1}, {'name': names[1], 'level': 10, 'star': 1}])
+    saves = count_saves(plugin, monkeypatch)
+
+    replies = run(plugin.max_upgrade_assistants, 'u1', f'最大升级{names[0]}')
+    assert 'Lv.1 → Lv.4' in replies[0]
+    stored = plugin.database.load_player('u1')
+    assert [a['level'] for a in stored['assistants']] == [4, 10]
+    assert stored['booths']['咖啡馆']['assistant']['level'] == 4
+    assert float(stored['gold']) == gold - int(level_upgrade_cost(1, 3))
+    assert saves == ['u1']
+
+
+def test_max_upgrade_reports_missing_gold(plugin):
+    name = plugin.catalog.assistants[0].name
+    create_player(plugin, 'u1', gold=math.floor(level_upgrade_cost(1)) - 1,
+                  assistants=[{'name': name, 'level': 1, 'star': 1}])
+    replies = run(plugin.max_upgrade_assistants, 'u1', '最大升级')
+    assert replies[0].startswith('金币不足')
+    assert plugin.database.load_player('u1')['assistants'][0]['level'] == 1
+
+
+def test_multi_pull_matches_ten_single_pulls(plugin, monkeypatch):
+    """同一随机序列下，十连与连续10次单抽的碎片转换和自动升星结果相同，十连只保存一次"""
+    novices = [record.name for record in plugin.catalog.assistants if record.rarity == '见习']
+    # 已拥有全部见习助理且差1个碎片升星，抽到重复助理时会转换碎片并升星
+    fields = dict(diamond=10 * ASSISTANT_POOLS['普通']['cost'], tickets={'普通': 0, '黄金': 0, '炫彩': 0},
+                  assistants=[{'name': name, 'level': 1, 'star': 1} for name in novices],
+                  fragments={name: STAR_UPGRADE_COST[1] - 1 for name in novices}, tutorial_step=3)
+    create_player(plugin, 'multi', **fields)
+    create_player(plugin, 'single', **fields)
+    saves = count_saves(plugin, monkeypatch)
+
+    random.seed(2024)
+    run(plugin.gacha_assistant, 'multi', '普通邀约十连')
+    random.seed(2024)
+    for _ in range(MULTI_PULL_COUNT):
+        run(plugin.gacha_assistant, 'single', '普通邀约')
+
+    multi, single = plugin.database.load_player('multi'), plugin.database.load_player('single')
+    for key in ('assistants', 'fragments', 'gold', 'diamond', 'tickets'):
+        assert multi[key] == single[key]
+    assert multi['diamond'] == MULTI_PULL_COUNT * GACHA_REWARDS['普通']['diamond']
+    assert any(assistant['star'] > 1 for assistant in multi['assistants'])
+    assert saves.count('multi') == 1 and saves.count('single') == MULTI_PULL_COUNT
+
+
+class SequencePool:
+    """按给定顺序返回 (回忆卡, 部分) 的抽取池"""
+
+    def __init__(self, outcomes):
+        self.outcomes = iter(outcomes)
+
+    def draw(self, rng=None):
+        return next(self.outcomes)
+
+
+AREA = '空间站「黑塔」'
+
+
+def test_memory_card_batch_uses_tickets_before_diamonds(plugin):
+    create_player(plugin, 'u1', memory_tickets=3, diamond=500)
+    replies = run(plugin.gacha_memory_card, 'u1', '抽取回忆1 x5')
+    assert '3张回忆卡抽取券、200钻石' in replies[0]
+    stored = plugin.database.load_player('u1')
+    assert (stored['memory_tickets'], stored['diamond']) == (0, 500 - 2 * MEMORY_CARD_DRAW_COST)
+    assert sum(stored['memory_parts'].values()) + 3 * sum(stored['memory_cards'].values()) == 5
+
+
+def test_memory_card_batch_is_capped(plugin, monkeypatch):
+    create_player(plugin, 'u1', diamond=(MEMORY_CARD_MAX_BATCH + 1) * MEMORY_CARD_DRAW_COST)
+    saves = count_saves(plugin, monkeypatch)
+    replies = run(plugin.gacha_memory_card, 'u1', f'抽取回忆1 x{MEMORY_CARD_MAX_BATCH + 1}')
+    assert replies == [f"抽取次数需在1到{MEMORY_CARD_MAX_BATCH}之间"]
+    assert saves == []
+
+    run(plugin.gacha_memory_card, 'u1', f'抽取回忆1 x{MEMORY_CARD_MAX_BATCH}')
+    assert plugin.database.load_player('u1')['diamond'] == MEMORY_CARD_DRAW_COST
+    assert saves == ['u1']
+
+
+def test_memory_card_batch_combines_parts(plugin, monkeypatch):
+    """同一批次内集齐A/B/C自动合成，合成后清除回忆卡加成缓存"""
+    card = plugin.catalog.memory_cards_by_area[AREA][0]
+    outcomes = [(card, 'A'), (card, 'B'), (card, 'A'), (card, 'C')]
+    monkeypatch.setitem(plugin.catalog.memory_card_pools, AREA, SequencePool(outcomes))
+    invalidated = []
+    monkeypatch.setattr(plugin, 'invalidate_memory_card_bonus', lambda player: invalidated.append(player['name']))
+    create_player(plugin, 'u1', diamond=len(outcomes) * MEMORY_CARD_DRAW_COST)
+
+    replies = run(plugin.gacha_memory_card, 'u1', f'抽取回忆1 x{len(outcomes)}')
+    assert f'{card.name} x1' in replies[0]
+    stored = plugin.database.load_player('u1')
+    assert stored['memory_cards'] == {card.name: 1}
+    assert stored['memory_parts'] == {f'{card.name}_A': 1}
+    assert invalidated == ['测试展会']
+
+
+def test_memory_card_batch_without_combination_keeps_bonus(plugin, monkeypatch):
+    card = plugin.catalog.memory_cards_by_area[AREA][0]
+    monkeypatch.setitem(plugin.catalog.memory_card_pools, AREA, SequencePool([(card, 'A'), (card, 'A')]))
+    invalidated = []
+    monkeypatch.setattr(plugin, 'invalidate_memory_card_bonus', lambda player: invalidated.append(player['name']))
+    create_player(plugin, 'u1', diamond=2 * MEMORY_CARD_DRAW_COST)
+
+    run(plugin.gacha_memory_card, 'u1', '抽取回忆1 x2')
+    assert plugin.database.load_player('u1')['memory_parts'] == {f'{card.name}_A': 2}
+    assert invalidated == []
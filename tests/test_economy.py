@@ -0,0 +1,96 @@
+import math
+import random
+from collections import Counter
+
+import pytest
+
+from srworld.Economy import (
+    ASSISTANT_POOLS, MEMORY_CARD_PARTS, MEMORY_CARD_RARE_RATE, AliasTable, GachaPool, Gold, MemoryCardPool, gold_code,
+    level_upgrade_cost, max_affordable_levels, plan_level_upgrades,
+)
+
+
+def test_gold_encode_preserves_order():
+    rng = random.Random(7)
+    values = [0, 1, -1, 999, 1000, 1e15, -1e15, 1e300]
+    values += [rng.choice((1, -1)) * 10 ** rng.uniform(0, 200) for _ in range(2000)]
+    values.sort()
+    codes = [gold_code(value) for value in values]
+    assert codes == sorted(codes)
+
+
+def test_gold_decode_round_trip():
+    for value in (0, 1, 999.5, 123456789, -5e20, 1e150):
+        decoded = Gold.decode(gold_code(value))
+        assert abs(float(decoded) - value) <= abs(value) * 1e-12
+        assert Gold.decode(decoded.encode()).encode() == decoded.encode()
+
+
+def test_gold_format_and_parse():
+    assert Gold(1500).format() == '1K'
+    assert Gold.parse('1.5aa').format() == '1AA'
+    assert Gold.parse('oops') == 0
+    assert Gold(1000) + 500 == 1500
+
+
+def test_max_affordable_levels_exact_boundary():
+    for level in (1, 37, 200):
+        for count in (1, 5, 20):
+            cost = level_upgrade_cost(level, count)
+            assert max_affordable_levels(level, cost) == count
+            assert max_affordable_levels(level, math.nextafter(cost, 0)) == count - 1
+    assert max_affordable_levels(1, 0) == 0
+    assert max_affordable_levels(1, Gold(level_upgrade_cost(1, 3) + 1)) == 3
+
+
+def test_max_affordable_levels_overflow():
+    assert level_upgrade_cost(1, 10 ** 6) == math.inf
+    count = max_affordable_levels(1, 1e308)
+    assert level_upgrade_cost(1, count) <= 1e308 < level_upgrade_cost(1, count + 1)
+    # 单级费用已超出浮点范围的等级无法再升级
+    assert level_upgrade_cost(10 ** 5) == math.inf
+    assert max_affordable_levels(10 ** 5, Gold.parse('999ZZ')) == 0
+
+
+def test_plan_level_upgrades_levels_lowest_first():
+    to_three = level_upgrade_cost(1, 2)
+    assert plan_level_upgrades([1, 3], to_three) == ([3, 3], to_three)
+    assert plan_level_upgrades([1, 3], math.nextafter(to_three, 0))[0] == [2, 3]
+    # 追平后剩余的金币让停在同一等级的助理依次再升一级
+    new_levels, spent = plan_level_upgrades([1, 3], to_three + level_upgrade_cost(3))
+    assert new_levels == [4, 3] and spent == to_three + level_upgrade_cost(3)
+    assert plan_level_upgrades([2, 2], level_upgrade_cost(2) - 1) == ([2, 2], 0)
+    assert plan_level_upgrades([], 1e9) == ([], 0.0)
+
+
+def test_gacha_pool_matches_configured_rates():
+    """别名表的抽取频率与 ASSISTANT_POOLS 的稀有度概率一致，同一稀有度内均匀；没有助理的稀有度概率不变"""
+    members = {'见习': ('甲', '乙', '丙'), '熟练': ('丁',)}
+    draws = 200000
+    for type_name, config in ASSISTANT_POOLS.items():
+        pool = GachaPool(config['rates'], members)
+        rng = random.Random(type_name)
+        counts = Counter(pool.draw(rng) for _ in range(draws))
+        for rarity, rate in config['rates'].items():
+            bucket = members.get(rarity) or (None,)
+            for member in bucket:
+                expected = rate / len(bucket)
+                assert abs(counts[(rarity, member)] / draws - expected) < 4 * math.sqrt(expected / draws) + 1e-4
+
+
+def test_alias_table_rejects_empty_weights():
+    with pytest.raises(ValueError):
+        AliasTable([0, 0])
+
+
+def test_memory_card_pool_rare_rate():
+    """稀有卡共占 MEMORY_CARD_RARE_RATE，三个部分均匀；只有一种稀有度时全部均匀"""
+    pool = MemoryCardPool(['普通甲', '普通乙'], ['稀有甲'])
+    rng = random.Random(11)
+    draws = [pool.draw(rng) for _ in range(60000)]
+    rare = sum(1 for card, _ in draws if card == '稀有甲') / len(draws)
+    assert abs(rare - MEMORY_CARD_RARE_RATE) < 0.01
+    parts = Counter(part for _, part in draws)
+    assert set(parts) == set(MEMORY_CARD_PARTS)
+    assert max(parts.values()) - min(parts.values()) < 0.03 * len(draws)
+    assert {card for card, _ in MemoryCardPool([], ['稀有甲']).outcomes} == {'稀有甲'}
@@ -0,0 +1,149 @@
+import asyncio
+
+import pytest
+
+from conftest import make_player
+from srworld.Database import AsyncIdleTycoonDatabase, PlayerVersionConflict
+from srworld.Storage import SQLiteDatabase
+
+
+@pytest.fixture
+def cached_db(tmp_path):
+    # 写库间隔设得很长，由测试调用 flush_all 控制写库时机
+    database = SQLiteDatabase(str(tmp_path / 'world.db'), {'enabled': True, 'flush_interval': 3600})
+    yield database
+    database.close()
+
+
+def stored(database, user_id):
+    """绕过缓存直接读取数据库中的数据"""
+    return database.load_player(user_id)
+
+
+def test_cached_saves_are_coalesced(cached_db):
+    cached_db.save_player_async_queue('u1', make_player('甲'))
+    for _ in range(3):
+        player = cached_db.load_player_cached('u1')
+        player['gold'] += 10
+        assert cached_db.save_player_async_queue('u1', player)
+    assert stored(cached_db, 'u1')['gold'] == 0
+    cached_db.session_cache.flush_all()
+    assert stored(cached_db, 'u1')['gold'] == 30
+    assert cached_db.load_player_cached('u1')['gold'] == 30
+
+
+def test_flush_conflict_merges_instead_of_dropping(cached_db):
+    cached_db.save_player_async_queue('u1', make_player('甲'))
+    player = cached_db.load_player_cached('u1')
+    player['gold'] += 100
+    cached_db.save_player_async_queue('u1', player)
+
+    # 缓存以外的写入（如其他进程）修改了同一玩家
+    external = stored(cached_db, 'u1')
+    external['diamond'] += 50
+    assert cached_db.save_player('u1', external)
+
+    cached_db.session_cache.flush_all()
+    # 冲突后合并到最新数据上，下一轮写库同时保留双方的修改
+    cached_db.session_cache.flush_all()
+    result = stored(cached_db, 'u1')
+    assert (result['gold'], result['diamond']) == (100, 50)
+    cached = cached_db.load_player_cached('u1')
+    assert (cached['gold'], cached['diamond']) == (100, 50)
+
+
+def test_save_player_now_writes_before_returning(cached_db):
+    cached_db.save_player_async_queue('u1', make_player('甲'))
+    player = cached_db.load_player_cached('u1')
+    player['gold'] += 10
+    cached_db.save_player_async_queue('u1', player)
+
+    player = cached_db.load_player_cached('u1')
+    player['name'] = '乙'
+    assert cached_db.save_player_now('u1', player)
+    result = stored(cached_db, 'u1')
+    assert (result['name'], result['gold']) == ('乙', 10)
+    assert cached_db.session_cache.stats()['dirty_players'] == 0
+
+
+def test_overlapping_cached_saves_conflict(cached_db):
+    cached_db.save_player_async_queue('u1', make_player('甲'))
+    first, second = cached_db.load_player_cached('u1'), cached_db.load_player_cached('u1')
+    first['gold'] += 100
+    assert cached_db.save_player_async_queue('u1', first)
+    second['diamond'] += 50
+    with pytest.raises(PlayerVersionConflict):
+        cached_db.save_player_async_queue('u1', second)
+
+
+def test_stale_copy_conflicts_after_eviction(tmp_path):
+    database = SQLiteDatabase(str(tmp_path / 'world.db'), {'enabled': True, 'max_size': 1, 'flush_interval': 3600})
+    try:
+        for user_id in ('u1', 'u2'):
+            database.save_player_async_queue(user_id, make_player(user_id))
+        stale = database.load_player_cached('u1')
+        fresh = database.load_player_cached('u1')
+        fresh['gold'] += 10
+        database.save_player_async_queue('u1', fresh)
+        # u2 挤出 u1，u1 写库后重新加载，版本来自新的缓存数据
+        database.load_player_cached('u2')
+        database.session_cache.flush_all()
+        database.load_player_cached('u1')
+        stale['diamond'] += 5
+        with pytest.raises(PlayerVersionConflict):
+            database.save_player_async_queue('u1', stale)
+    finally:
+        database.close()
+
+
+def test_async_layer_retries_on_conflict(cached_db):
+    """两条指令同时修改同一玩家：后保存的一方冲突，重新加载后再执行，两次修改都保留"""
+    async_db = AsyncIdleTycoonDatabase(lambda: cached_db, max_workers=2)
+    attempts = []
+
+    async def command(name, field, amount, player):
+        # 与 main.retry_on_conflict 相同：冲突时重新加载玩家数据并重新执行
+        while True:
+            attempts.append(name)
+            player[field] += amount
+            try:
+                return await async_db.save_player('u1', player)
+            except PlayerVersionConflict:
+                player = await async_db.load_player('u1')
+
+    async def scenario():
+        await async_db.save_player('u1', make_player('甲'))
+        first, second = await async_db.load_player('u1'), await async_db.load_player('u1')
+        assert first.cache_version == second.cache_version
+        assert await command('收取', 'gold', 100, first)
+        assert await command('邀约', 'diamond', 50, second)
+
+    asyncio.run(scenario())
+    async_db.close()
+    assert attempts == ['收取', '邀约', '邀约']
+    result = stored(cached_db, 'u1')
+    assert (result['gold'], result['diamond']) == (100, 50)
+
+
+def test_async_close_shuts_down_backend(tmp_path):
+    """关闭异步层时一并关闭后端：缓存的玩家数据和排行数据都写入数据库，后台写库线程退出"""
+    path = str(tmp_path / 'world.db')
+    database = SQLiteDatabase(path, {'enabled': True, 'flush_interval': 3600})
+    async_db = AsyncIdleTycoonDatabase(lambda: database, max_workers=2)
+
+    async def scenario():
+        await async_db.save_player('u1', make_player('甲', gold=300))
+        await async_db.update_world_ranking('u1', '甲', 300, 900)
+
+    asyncio.run(scenario())
+    ranking_thread = database.ranking_buffer._flush_thread
+    async_db.close()
+    assert database.session_cache is None and database.ranking_buffer is None
+    assert not ranking_thread.is_alive()
+
+    reopened = SQLiteDatabase(path)
+    try:
+        assert reopened.load_player('u1')['gold'] == 300
+        assert [row['name'] for row in reopened.load_world_ranking(10)] == ['甲']
+    finally:
+        reopened.close()
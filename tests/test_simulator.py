@@ -0,0 +1,42 @@
+"""模拟器测试：需要 NumPy，未安装时跳过"""
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from srworld.Catalog import BoothRecord
+from srworld.Economy import BOOTHS, IncomeEngine, TraitEngine, city_buff, parse_amount
+from srworld.Simulator import EconomyModel, Simulation, load_assistant_data
+
+
+def test_booth_rates_match_income_engine():
+    """模拟器的向量化收入公式与插件的 IncomeEngine 一致（不含回忆卡）"""
+    assistant_data = load_assistant_data()
+    model = EconomyModel(assistant_data)
+    sim = Simulation(model, players=1, seed=0)
+    state = sim.state
+    booths = len(model.booth_names)
+    state.unlocked[:] = booths
+    state.owned[:, :booths] = True
+    state.level[0, :booths] = np.arange(booths) % 7 + 1
+    state.star[0, :booths] = np.arange(booths) % 4 + 1
+    state.total_income[:] = 2e13
+    sim.assign()
+
+    player_booths = {}
+    for booth, name in enumerate(model.booth_names):
+        index = state.assignment[0, booth]
+        assistant = None
+        if index >= 0:
+            assistant = {'name': model.assistant_names[index], 'level': int(state.level[0, index]),
+                         'star': int(state.star[0, index])}
+        player_booths[name] = {'unlocked': True, 'assistant': assistant}
+    records = {name: BoothRecord(name, config['area'], parse_amount(config['unlock_cost']),
+                                 parse_amount(config['base_income']), config['unlock_cost'], config['base_income'])
+               for name, config in BOOTHS.items()}
+    engine = IncomeEngine(records, TraitEngine(assistant_data))
+    snapshot = engine.snapshot({'booths': player_booths}, 3, city_buff(3), {'all': 1.0})
+
+    rates = sim.booth_rates()[0]
+    expected = [snapshot.booth_rates.get(name, 0.0) for name in model.booth_names]
+    assert np.allclose(rates, expected)
+    assert any(rate > 0 for rate in expected)
@@ -0,0 +1,175 @@
+import re
+import sqlite3
+
+import pytest
+
+from conftest import make_player
+from srworld.Database import IdBlockAllocator, PlayerVersionConflict, RankingIndex
+from srworld.Economy import gold_code
+from srworld.Storage import SQLiteDatabase, create_backend
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request):
+    return request.getfixturevalue(f'{request.param}_db')
+
+
+def test_save_and_load_round_trip(backend):
+    player = make_player('甲', gold=1.5e30, diamond=20, assistants=[{'name': '三月七', 'level': 3, 'star': 2}],
+                         fragments={'三月七': 4}, memory_cards={'佩佩': 1})
+    assert backend.save_player('u1', player)
+    loaded = backend.load_player('u1')
+    assert float(loaded['gold']) == pytest.approx(1.5e30)
+    assert loaded['assistants'] == [{'name': '三月七', 'level': 3, 'star': 2}]
+    assert loaded['fragments'] == {'三月七': 4}
+    assert loaded['memory_cards'] == {'佩佩': 1}
+    assert loaded['player_id'] == player['player_id']
+
+
+def test_overlapping_saves_conflict(backend):
+    backend.save_player('u1', make_player('甲'))
+    first, second = backend.load_player('u1'), backend.load_player('u1')
+    first['gold'] += 100
+    assert backend.save_player('u1', first)
+    second['diamond'] += 50
+    with pytest.raises(PlayerVersionConflict):
+        backend.save_player('u1', second)
+    reloaded = backend.load_player('u1')
+    assert (reloaded['gold'], reloaded['diamond']) == (100, 0)
+
+
+def test_new_player_save_does_not_overwrite(backend):
+    """没有快照的数据只能创建新玩家：重复创建时抛出冲突，已有数据保持不变"""
+    backend.save_player('u1', make_player('甲', diamond=500, memory_cards={'佩佩': 1}))
+    with pytest.raises(PlayerVersionConflict):
+        backend.save_player('u1', make_player('乙'))
+    stored = backend.load_player('u1')
+    assert (stored['name'], stored['diamond'], stored['memory_cards']) == ('甲', 500, {'佩佩': 1})
+
+
+def test_unchanged_save_keeps_version(backend):
+    backend.save_player('u1', make_player('甲'))
+    player = backend.load_player('u1')
+    version = player.version
+    assert backend.save_player('u1', player)
+    assert backend.load_player('u1').version == version
+
+
+def test_id_allocator_reserves_blocks():
+    reserved = []
+
+    def reserve(size):
+        reserved.append(size)
+        return 1 + 10 * (len(reserved) - 1)
+
+    allocator = IdBlockAllocator(reserve, block_size=10)
+    assert [allocator.next_id() for _ in range(12)] == list(range(1, 13))
+    assert reserved == [10, 10]
+
+
+def test_sqlite_id_block_survives_failed_save(tmp_path, monkeypatch):
+    path = str(tmp_path / 'world.db')
+    database = SQLiteDatabase(path, {'enabled': False})
+
+    def broken_save(*args):
+        raise RuntimeError('写入失败')
+
+    monkeypatch.setattr(database, '_save_player_full', broken_save)
+    assert not database.save_player('u1', make_player('甲'))
+    monkeypatch.undo()
+    player = make_player('乙')
+    assert database.save_player('u2', player)
+    database.close()
+
+    # 失败的保存回滚时不能带走ID段的预留，重启后不会再分配到已使用的ID
+    reopened = SQLiteDatabase(path, {'enabled': False})
+    newcomer = make_player('丙')
+    assert reopened.save_player('u3', newcomer)
+    assert newcomer['player_id'] > player['player_id']
+    reopened.close()
+
+
+def test_ranking_index_orders_and_evicts():
+    index = RankingIndex(capacity=3, display_size=2)
+    index.load([('a', '甲', gold_code(0), gold_code(300)), ('b', '乙', gold_code(0), gold_code(100))])
+    index.update('c', '丙', 0, 200)
+    index.update('d', '丁', 0, 200)
+    assert [row['name'] for row in index.top()] == ['甲', '丙', '丁']
+    index.update('b', '乙', 0, 1000)
+    assert [row['name'] for row in index.top()] == ['乙', '甲', '丙']
+    index.update('e', '戊', 0, 1)
+    assert [row['name'] for row in index.top()] == ['乙', '甲', '丙']
+
+
+def test_world_ranking_through_backend(backend):
+    for user_id, name, total_income in (('u1', '甲', 5e20), ('u2', '乙', 7e40), ('u3', '丙', 10)):
+        backend.save_player(user_id, make_player(name, total_income=total_income))
+        backend.update_world_ranking(user_id, name, 0, total_income)
+    backend.ranking_buffer.flush()
+    backend.ranking_index.invalidate()
+    assert [row['name'] for row in backend.load_world_ranking(10)] == ['乙', '甲', '丙']
+
+
+def test_sqlite_migrates_real_gold_columns(tmp_path):
+    """旧版本插件建的 REAL 金额列重建为整数编码列，子表数据和索引保留"""
+    path = str(tmp_path / 'old.db')
+    version, description, script = SQLiteDatabase.MIGRATIONS[0]
+    real_script = re.sub(r'(gold|total_income) INTEGER NOT NULL DEFAULT 0', r'\1 REAL DEFAULT 0', script)
+    old_migrations = [(version, description, real_script)] + SQLiteDatabase.MIGRATIONS[1:3]
+    old_schema = type('OldSQLiteDatabase', (SQLiteDatabase,), {'MIGRATIONS': old_migrations})
+    old_schema(path, {'enabled': False}).close()
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("INSERT INTO players (user_id, player_id, name, gold, total_income) VALUES ('u1', 1, '甲', 1.5e20, 3e25)")
+    conn.execute("INSERT INTO player_fragments (user_id, assistant_name, count) VALUES ('u1', '三月七', 4)")
+    conn.execute("INSERT INTO world_ranking (user_id, name, gold, total_income) VALUES ('u1', '甲', 1.5e20, 3e25)")
+    conn.close()
+
+    database = SQLiteDatabase(path, {'enabled': False})
+    player = database.load_player('u1')
+    assert (player['gold'], player['total_income']) == (1.5e20, 3e25)
+    assert player['fragments'] == {'三月七': 4}
+    assert database.load_world_ranking(10)[0]['total_income'] == 3e25
+    conn = database._connection()
+    assert {row[1]: row[2] for row in conn.execute("PRAGMA table_info(players)")}['gold'] == 'INTEGER'
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {'idx_players_total_income', 'idx_world_ranking_total_income'} <= indexes
+    assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+    database.close()
+
+
+def test_sqlite_name_migration_reports_collisions(tmp_path, capsys):
+    """规范化后重名的玩家逐个写入迁移日志，旧版本建的 players.name 索引被删除"""
+    path = str(tmp_path / 'old.db')
+    old_schema = type('OldSQLiteDatabase', (SQLiteDatabase,), {'MIGRATIONS': SQLiteDatabase.MIGRATIONS[:2]})
+    old_schema(path, {'enabled': False}).close()
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("CREATE INDEX idx_players_name ON players (name)")
+    conn.executemany("INSERT INTO players (user_id, player_id, name) VALUES (?, ?, ?)",
+                     [('u1', 1, 'Alice'), ('u2', 2, 'ａｌｉｃｅ '), ('u3', 3, 'Bob')])
+    conn.close()
+
+    database = SQLiteDatabase(path, {'enabled': False})
+    output = capsys.readouterr().out
+    assert '有 1 个玩家的名称与其他玩家重复' in output
+    assert '玩家 u2 的名称「ａｌｉｃｅ 」已由玩家 u1 登记' in output
+    owners = dict(database._connection().execute("SELECT name_key, user_id FROM player_names"))
+    assert owners == {'alice': 'u1', 'bob': 'u3'}
+    indexes = [row[0] for row in database._connection().execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+    assert 'idx_players_name' not in indexes
+    database.close()
+
+
+def test_create_backend_keeps_cache_options_per_instance(tmp_path):
+    default_enabled = SQLiteDatabase.SESSION_CACHE_ENABLED
+    database = create_backend({'backend': 'sqlite', 'sqlite': {'path': str(tmp_path / 'world.db')},
+                               'session_cache': {'enabled': False, 'max_size': 5}})
+    assert database.session_cache is None
+    assert database.SESSION_CACHE_SIZE == 5
+    assert SQLiteDatabase.SESSION_CACHE_ENABLED == default_enabled
+    assert SQLiteDatabase.SESSION_CACHE_SIZE == 1000
+    database.close()
+
+    memory = create_backend({'backend': 'memory', 'session_cache': {'enabled': True}})
+    assert memory.session_cache is None
+    memory.close()